@@ -0,0 +1,245 @@
+"""Latency and query counts of the main endpoints at several database sizes.
+
+Usage::
+
+    python -m benchmarks.endpoints run --sizes 100,10000,100000 --name before
+    python -m benchmarks.endpoints run --sizes 100,10000,100000 --compare before
+    python -m benchmarks.endpoints compare before after --threshold 0.15
+
+``run`` seeds a throwaway SQLite database per size with ``flask seed``'s
+generator, drives every endpoint through ``app.test_client()`` and writes
+``benchmarks/baselines/<name>.json``. ``compare`` (or ``run --compare``)
+flags endpoints whose median or p90 latency grew by more than
+``--threshold`` or that now run more queries, and exits non-zero if any did.
+
+``baselines/main.json`` is the committed reference. Check a change with
+``run --compare main``. Refresh the file with ``run --name main`` on the
+same machine when a slowdown is intended. Latencies from other machines
+are only roughly comparable, but query counts are exact.
+"""
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+import click
+import sqlalchemy
+from sqlalchemy import event
+from gp_app import create_app, db
+from gp_app.models import User, UserType, MANAGE_USERS, MANAGE_USER_TYPES
+from gp_app.passwords import bcrypt_hash
+from gp_app.seed import ensure_user_types, seed_users, RoleSampler
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines')
+ADMIN_EMAIL = 'admin@mycompany.com'
+PASSWORD = 'benchmark'
+
+
+def _build_app(db_path, size, cost):
+	app = create_app({
+		'TESTING': True,
+		'WTF_CSRF_ENABLED': False,
+		'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+		'BCRYPT_LOG_ROUNDS': cost,
+		'PASSWORD_HASH_EXECUTOR': 'inline',
+		'RATELIMIT_BACKEND': None,
+	})
+	with app.app_context():
+		db.create_all()
+		admin_type = UserType(name='Admin', permissions=[MANAGE_USERS, MANAGE_USER_TYPES])
+		admin = User(username='admin', email=ADMIN_EMAIL, password=bcrypt_hash(PASSWORD, cost))
+		admin.user_types.append(admin_type)
+		db.session.add(admin)
+		type_ids = ensure_user_types(10, 'bench-type-')
+		db.session.commit()
+		sampler = RoleSampler(type_ids, [0, 1, 2, 3], [1, 6, 2, 1], 1.0, random.Random(0))
+		seed_users(size, sampler, bcrypt_hash(PASSWORD, cost), 'bench', 10000)
+	return app
+
+
+class QueryCounter(object):
+	def __init__(self, engine):
+		self.count = 0
+		event.listen(engine, 'before_cursor_execute', self._count)
+
+	def _count(self, *args):
+		self.count += 1
+
+
+def _logged_in(app):
+	client = app.test_client()
+	client.post('/login', data={'email': ADMIN_EMAIL, 'password': PASSWORD})
+	return client
+
+
+def scenarios(app):
+	"""Map endpoint names to a callable making one request, and its expected status."""
+	admin = _logged_in(app)
+	anonymous = app.test_client()
+	serial = itertools.count()
+
+	def register():
+		n = next(serial)
+		return anonymous.post('/register', data={
+			'username': f'reg{n}', 'email': f'reg{n}@mycompany.com',
+			'password': PASSWORD, 'confirm_password': PASSWORD})
+
+	return {
+		'login': (lambda: app.test_client().post('/login', data={
+			'email': ADMIN_EMAIL, 'password': PASSWORD}), 302),
+		'register': (register, 302),
+		'users': (lambda: admin.get('/users'), 200),
+		'user_types': (lambda: admin.get('/user_types'), 200),
+		'account': (lambda: admin.get('/account'), 200),
+		'reset_password': (lambda: anonymous.post('/reset_password', data={
+			'email': ADMIN_EMAIL}), 302),
+	}
+
+
+def _percentile(samples, fraction):
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(request, expected, counter, requests, warmup):
+	for _ in range(warmup):
+		request()
+	latencies, queries = [], []
+	for _ in range(requests):
+		before = counter.count
+		started = time.perf_counter()
+		response = request()
+		latencies.append((time.perf_counter() - started) * 1000)
+		queries.append(counter.count - before)
+		if response.status_code != expected:
+			raise click.ClickException(
+				f'{request!r} answered {response.status_code}, expected {expected}')
+	return {
+		'requests': requests,
+		'mean_ms': round(statistics.mean(latencies), 3),
+		'p50_ms': round(_percentile(latencies, 0.5), 3),
+		'p90_ms': round(_percentile(latencies, 0.9), 3),
+		'p99_ms': round(_percentile(latencies, 0.99), 3),
+		'max_ms': round(max(latencies), 3),
+		'queries': statistics.median_low(queries),
+	}
+
+
+def run_size(size, endpoints, requests, warmup, cost):
+	db_fd, db_path = tempfile.mkstemp()
+	try:
+		app = _build_app(db_path, size, cost)
+		with app.app_context():
+			counter = QueryCounter(db.engine)
+		requests_by_name = scenarios(app)
+		return {name: measure(*requests_by_name[name], counter, requests, warmup)
+		        for name in endpoints}
+	finally:
+		os.close(db_fd)
+		os.unlink(db_path)
+
+
+def _path(name):
+	return name if name.endswith('.json') else os.path.join(BASELINES, name + '.json')
+
+
+def load(name):
+	with open(_path(name)) as f:
+		return json.load(f)
+
+
+def compare(baseline, current, threshold):
+	"""Return ``(rows, regressions)`` for every size and endpoint in both runs."""
+	rows, regressions = [], 0
+	for size, endpoints in sorted(current['results'].items(), key=lambda item: int(item[0])):
+		for name, now in endpoints.items():
+			before = baseline['results'].get(size, {}).get(name)
+			if before is None:
+				continue
+			flags = []
+			for key in ('p50_ms', 'p90_ms'):
+				if before[key] and now[key] > before[key] * (1 + threshold):
+					flags.append(f'{key} +{now[key] / before[key] - 1:.0%}')
+			if now['queries'] > before['queries']:
+				flags.append(f"queries {before['queries']}->{now['queries']}")
+			regressions += bool(flags)
+			rows.append((size, name, before, now, flags))
+	return rows, regressions
+
+
+def report(rows, regressions):
+	click.echo(f"{'size':>7}  {'endpoint':<15}{'p50 ms':>16}{'p90 ms':>18}{'queries':>9}")
+	for size, name, before, now, flags in rows:
+		click.echo(f"{size:>7}  {name:<15}"
+		           f"{before['p50_ms']:>7.2f} -> {now['p50_ms']:<7.2f}"
+		           f"{before['p90_ms']:>7.2f} -> {now['p90_ms']:<8.2f}"
+		           f"{before['queries']:>3} -> {now['queries']:<3}"
+		           f"{'  REGRESSION: ' + ', '.join(flags) if flags else ''}")
+	if regressions:
+		raise click.ClickException(f'{regressions} regression(s)')
+	click.echo('No regressions.')
+
+
+@click.group()
+def main():
+	pass
+
+
+@main.command('run')
+@click.option('--sizes', default='100,10000', help='Comma separated numbers of seeded users.')
+@click.option('--endpoints', default='login,register,users,user_types,account,reset_password',
+              help='Comma separated endpoints to measure.')
+@click.option('--requests', default=100, help='Measured requests per endpoint.')
+@click.option('--warmup', default=5, help='Unmeasured requests per endpoint first.')
+@click.option('--cost', default=4, help='bcrypt cost; low so login measures the app, '
+                                        'see benchmarks.login_throughput for bcrypt.')
+@click.option('--name', default=None, help='Baseline to write; defaults to a timestamp.')
+@click.option('--compare', 'compare_to', default=None, help='Baseline to compare against.')
+@click.option('--threshold', default=0.2, help='Allowed relative latency growth.')
+def run_command(sizes, endpoints, requests, warmup, cost, name, compare_to, threshold):
+	endpoints = endpoints.split(',')
+	results = {}
+	for size in [int(s) for s in sizes.split(',')]:
+		click.echo(f'Seeding {size} users...', err=True)
+		results[str(size)] = run_size(size, endpoints, requests, warmup, cost)
+	current = {
+		'meta': {
+			'created': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+			'python': platform.python_version(),
+			'sqlalchemy': sqlalchemy.__version__,
+			'sqlite': __import__('sqlite3').sqlite_version,
+			'machine': platform.machine(),
+			'requests': requests,
+			'cost': cost,
+		},
+		'results': results,
+	}
+	path = _path(name or datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	with open(path, 'w') as f:
+		json.dump(current, f, indent=2, sort_keys=True)
+	click.echo(f'Wrote {path}')
+
+	if compare_to:
+		report(*compare(load(compare_to), current, threshold))
+	else:
+		for size, by_name in results.items():
+			for endpoint, stats in by_name.items():
+				click.echo(f"{size:>7}  {endpoint:<15}p50 {stats['p50_ms']:>8.2f} ms  "
+				           f"p90 {stats['p90_ms']:>8.2f} ms  queries {stats['queries']}")
+
+
+@main.command('compare')
+@click.argument('baseline')
+@click.argument('current')
+@click.option('--threshold', default=0.2, help='Allowed relative latency growth.')
+def compare_command(baseline, current, threshold):
+	report(*compare(load(baseline), load(current), threshold))
+
+
+if __name__ == '__main__':
+	main()
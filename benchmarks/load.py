@@ -0,0 +1,305 @@
+"""Concurrent load against the app served by a local WSGI server.
+
+Usage::
+
+    python -m benchmarks.load --profile mixed --concurrency 32 --seconds 20
+    python -m benchmarks.load --profile login-storm --processes 4 --cost 12
+
+The app runs from ``create_app()`` in a separate process under werkzeug's
+threaded server (or its forking server with ``--processes``) on a seeded
+throwaway SQLite database. ``--concurrency`` virtual users each take a
+role from the profile and loop over that role's weighted actions with
+their own cookie jar. The report gives throughput, latency percentiles
+and error rates per action.
+
+CSRF checks are off so the clients don't have to scrape tokens. Rate
+limiting is off too unless ``--rate-limit`` is given.
+"""
+import http.client
+import http.cookies
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+import click
+from gp_app import create_app, db
+from gp_app.models import User, UserType, MANAGE_USERS, MANAGE_USER_TYPES
+from gp_app.passwords import bcrypt_hash
+from gp_app.seed import ensure_user_types, seed_users, RoleSampler
+
+PASSWORD = 'benchmark'
+ADMIN_EMAIL = 'admin@mycompany.com'
+
+# Shared by every virtual user; next() on a count is atomic under the GIL.
+_registrations = itertools.count()
+
+
+class Client(object):
+	"""One virtual user: a cookie jar and a connection per request."""
+
+	def __init__(self, host, port, timeout=30):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.cookies = {}
+
+	def request(self, method, path, form=None):
+		headers = {}
+		body = None
+		if form is not None:
+			body = urlencode(form)
+			headers['Content-Type'] = 'application/x-www-form-urlencoded'
+		if self.cookies:
+			headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+		conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+		try:
+			conn.request(method, path, body, headers)
+			response = conn.getresponse()
+			response.read()
+			for header in response.msg.get_all('Set-Cookie') or ():
+				for name, morsel in http.cookies.SimpleCookie(header).items():
+					self.cookies[name] = morsel.value
+			return response.status
+		finally:
+			conn.close()
+
+
+class World(object):
+	# What the actions need to know about the seeded database.
+	def __init__(self, users, type_names, rng):
+		self.users = users
+		self.type_names = type_names
+		self.rng = rng
+
+	def email(self):
+		return f'bench{self.rng.randint(1, self.users)}@example.com'
+
+
+# Login attempts come from a fresh session, like a storm of new visitors.
+
+def login(client, world):
+	client.cookies.clear()
+	return client.request('POST', '/login', {'email': world.email(), 'password': PASSWORD}), 302
+
+def bad_login(client, world):
+	# The form comes back with a flash; no redirect.
+	client.cookies.clear()
+	return client.request('POST', '/login', {'email': world.email(), 'password': 'wrong'}), 200
+
+def logout(client, world):
+	return client.request('GET', '/logout'), 302
+
+def home(client, world):
+	return client.request('GET', '/home'), 200
+
+def about(client, world):
+	return client.request('GET', '/about'), 200
+
+def register_page(client, world):
+	return client.request('GET', '/register'), 200
+
+def register(client, world):
+	n = next(_registrations)
+	return client.request('POST', '/register', {
+		'username': f'load{n}', 'email': f'load{n}@example.com',
+		'password': PASSWORD, 'confirm_password': PASSWORD}), 302
+
+def list_users(client, world):
+	after = world.rng.randint(0, world.users)
+	return client.request('GET', f'/users?after={after}'), 200
+
+def search_users(client, world):
+	return client.request('GET', f'/users?q=bench{world.rng.randint(1, 99)}'), 200
+
+def update_user(client, world):
+	user_id = world.rng.randint(1, world.users)
+	names = world.rng.sample(world.type_names, world.rng.randint(0, 2))
+	# Several values for one field, like the multi-select submits.
+	form = [('user_types', name) for name in names] or [('user_types', '')]
+	return client.request('POST', f'/users/{user_id}/update', form), 302
+
+def user_types_page(client, world):
+	return client.request('GET', '/user_types'), 200
+
+def lookup_types(client, world):
+	return client.request('GET', '/user_types/lookup?q=bench'), 200
+
+
+ROLES = {
+	'anonymous': [(6, home), (2, about), (1, register_page), (1, register)],
+	'login': [(4, login), (1, bad_login), (4, home), (1, logout)],
+	'admin': [(4, list_users), (2, search_users), (3, update_user), (1, user_types_page),
+	          (2, lookup_types)],
+}
+
+PROFILES = {
+	'login-storm': {'login': 1},
+	'admin-editing': {'admin': 1},
+	'browsing': {'anonymous': 1},
+	'mixed': {'anonymous': 6, 'login': 3, 'admin': 1},
+}
+
+
+def _prepare_database(db_path, users, cost):
+	app = create_app({
+		'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+		'BCRYPT_LOG_ROUNDS': cost,
+	})
+	with app.app_context():
+		db.create_all()
+		type_ids = ensure_user_types(10, 'bench-type-')
+		db.session.commit()
+		sampler = RoleSampler(type_ids, [0, 1, 2, 3], [1, 6, 2, 1], 1.0, random.Random(0))
+		seed_users(users, sampler, bcrypt_hash(PASSWORD, cost), 'bench', 10000)
+		admin = User(username='admin', email=ADMIN_EMAIL, password=bcrypt_hash(PASSWORD, cost))
+		admin.user_types.append(
+			UserType(name='Admin', permissions=[MANAGE_USERS, MANAGE_USER_TYPES]))
+		db.session.add(admin)
+		db.session.commit()
+		return [name for name, in db.session.query(UserType.name)]
+
+
+def _serve(config, processes, ready):
+	from werkzeug.serving import make_server
+	logging.getLogger('werkzeug').setLevel(logging.ERROR)
+	app = create_app(config)
+	server = make_server('127.0.0.1', 0, app, threaded=processes == 1, processes=processes)
+	ready.put(server.server_port)
+	server.serve_forever()
+
+
+def _percentile(ordered, fraction):
+	return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples, elapsed):
+	"""``samples`` maps action names to lists of ``(ms, ok)``."""
+	rows = {}
+	for name, results in sorted(samples.items()):
+		latencies = sorted(ms for ms, _ in results)
+		errors = sum(not ok for _, ok in results)
+		rows[name] = {
+			'requests': len(results),
+			'per_second': round(len(results) / elapsed, 2),
+			'error_rate': round(errors / len(results), 4),
+			'p50_ms': round(_percentile(latencies, 0.5), 2),
+			'p90_ms': round(_percentile(latencies, 0.9), 2),
+			'p99_ms': round(_percentile(latencies, 0.99), 2),
+			'max_ms': round(latencies[-1], 2),
+		}
+	return rows
+
+
+def drive(port, profile, concurrency, seconds, world_args, seed):
+	roles = list(PROFILES[profile].items())
+	samples = {}
+	lock = threading.Lock()
+	deadline = time.monotonic() + seconds
+
+	def virtual_user(number):
+		rng = random.Random(seed * 1000 + number)
+		world = World(*world_args, rng)
+		role = rng.choices([name for name, _ in roles], [w for _, w in roles])[0]
+		actions, weights = zip(*[(action, w) for w, action in ROLES[role]])
+		client = Client('127.0.0.1', port)
+		if role == 'admin':
+			client.request('POST', '/login', {'email': ADMIN_EMAIL, 'password': PASSWORD})
+		local = {}
+		while time.monotonic() < deadline:
+			action = rng.choices(actions, weights)[0]
+			started = time.perf_counter()
+			try:
+				status, expected = action(client, world)
+				ok = status == expected
+			except (OSError, http.client.HTTPException):
+				ok = False
+			local.setdefault(action.__name__, []).append(
+				((time.perf_counter() - started) * 1000, ok))
+		with lock:
+			for name, results in local.items():
+				samples.setdefault(name, []).extend(results)
+
+	started = time.monotonic()
+	threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return samples, time.monotonic() - started
+
+
+@click.command()
+@click.option('--profile', type=click.Choice(sorted(PROFILES)), default='mixed',
+              show_default=True)
+@click.option('--concurrency', default=16, show_default=True, help='Virtual users.')
+@click.option('--seconds', default=10.0, show_default=True, help='Duration of the run.')
+@click.option('--users', default=10000, show_default=True, help='Seeded users.')
+@click.option('--cost', default=10, show_default=True, help='bcrypt cost of the seeded users.')
+@click.option('--processes', default=1, show_default=True,
+              help='Server processes; 1 runs the threaded server instead.')
+@click.option('--hash-executor', default='thread', show_default=True,
+              type=click.Choice(['inline', 'thread', 'process']),
+              help='PASSWORD_HASH_EXECUTOR for the server.')
+@click.option('--rate-limit', is_flag=True, help='Keep the login/register rate limits on.')
+@click.option('--seed', default=0, help='Random seed for the traffic.')
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False),
+              help='Also write the report to this file.')
+def main(profile, concurrency, seconds, users, cost, processes, hash_executor, rate_limit,
+         seed, json_path):
+	db_fd, db_path = tempfile.mkstemp()
+	server = None
+	try:
+		click.echo(f'Seeding {users} users...', err=True)
+		type_names = _prepare_database(db_path, users, cost)
+		config = {
+			'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+			'WTF_CSRF_ENABLED': False,
+			'BCRYPT_LOG_ROUNDS': cost,
+			'PASSWORD_HASH_EXECUTOR': hash_executor,
+			'RATELIMIT_BACKEND': 'memory' if rate_limit else None,
+		}
+		ready = multiprocessing.Queue()
+		server = multiprocessing.Process(target=_serve, args=(config, processes, ready),
+		                                 daemon=True)
+		server.start()
+		port = ready.get(timeout=60)
+		socket.create_connection(('127.0.0.1', port), timeout=10).close()
+
+		click.echo(f'Running {profile} with {concurrency} virtual users for {seconds}s '
+		           f'against port {port}...', err=True)
+		samples, elapsed = drive(port, profile, concurrency, seconds, (users, type_names), seed)
+	finally:
+		if server is not None:
+			server.terminate()
+			server.join()
+		os.close(db_fd)
+		os.unlink(db_path)
+
+	rows = summarize(samples, elapsed)
+	total = sum(len(results) for results in samples.values())
+	errors = sum(not ok for results in samples.values() for _, ok in results)
+	click.echo(f"{'action':<16}{'requests':>9}{'req/s':>9}{'errors':>8}"
+	           f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+	for name, row in rows.items():
+		click.echo(f"{name:<16}{row['requests']:>9}{row['per_second']:>9.1f}"
+		           f"{row['error_rate']:>8.1%}{row['p50_ms']:>9.1f}{row['p90_ms']:>9.1f}"
+		           f"{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+	click.echo(f'total: {total} requests, {total / elapsed:.1f} req/s, '
+	           f'{errors / total if total else 0:.1%} errors')
+
+	if json_path:
+		with open(json_path, 'w') as f:
+			json.dump({'profile': profile, 'concurrency': concurrency, 'seconds': elapsed,
+			           'processes': processes, 'cost': cost, 'actions': rows,
+			           'total': {'requests': total, 'errors': errors}}, f, indent=2)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,89 @@
+"""Login throughput at several bcrypt cost settings.
+
+Usage::
+
+    python -m benchmarks.login_throughput --costs 4,8,10,12 --threads 4 --seconds 5
+
+Every run creates a throwaway SQLite database with one user hashed at the
+cost under test, then hammers ``POST /login`` from ``--threads`` test
+clients for ``--seconds`` and prints logins per second.
+"""
+import os
+import tempfile
+import threading
+import time
+import click
+from gp_app import create_app, db
+from gp_app.models import User
+from gp_app.passwords import bcrypt_hash
+
+PASSWORD = 'benchmark'
+
+
+def _build_app(db_path, cost, executor, workers):
+	app = create_app({
+		'TESTING': True,
+		'WTF_CSRF_ENABLED': False,
+		'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+		'BCRYPT_LOG_ROUNDS': cost,
+		'PASSWORD_HASH_EXECUTOR': executor,
+		'PASSWORD_HASH_WORKERS': workers,
+		'RATELIMIT_BACKEND': None,
+	})
+	with app.app_context():
+		db.create_all()
+		db.session.add(User(username='bench', email='bench@mycompany.com',
+		                    password=bcrypt_hash(PASSWORD, cost)))
+		db.session.commit()
+	return app
+
+
+def run(cost, executor, threads, seconds, workers=None):
+	db_fd, db_path = tempfile.mkstemp()
+	try:
+		app = _build_app(db_path, cost, executor, workers)
+		counts = [0] * threads
+		failures = [0] * threads
+		deadline = time.monotonic() + seconds
+
+		def hammer(slot):
+			while time.monotonic() < deadline:
+				response = app.test_client().post('/login', data={
+					'email': 'bench@mycompany.com', 'password': PASSWORD})
+				if response.status_code == 302:
+					counts[slot] += 1
+				else:
+					failures[slot] += 1
+
+		started = time.monotonic()
+		pool = [threading.Thread(target=hammer, args=(i,)) for i in range(threads)]
+		for thread in pool:
+			thread.start()
+		for thread in pool:
+			thread.join()
+		elapsed = time.monotonic() - started
+		app.extensions['password_hasher'].shutdown()
+		return sum(counts) / elapsed, sum(failures)
+	finally:
+		os.close(db_fd)
+		os.unlink(db_path)
+
+
+@click.command()
+@click.option('--costs', default='4,8,10,12', help='Comma separated bcrypt costs.')
+@click.option('--executors', default='inline,thread,process',
+              help='Comma separated PASSWORD_HASH_EXECUTOR values.')
+@click.option('--threads', default=4, help='Concurrent clients.')
+@click.option('--seconds', default=3.0, help='Duration of each run.')
+@click.option('--workers', default=None, type=int, help='PASSWORD_HASH_WORKERS.')
+def main(costs, executors, threads, seconds, workers):
+	click.echo(f"{'cost':>4}  {'executor':<8}  {'logins/s':>9}  {'ms/login':>9}  failures")
+	for cost in [int(c) for c in costs.split(',')]:
+		for executor in executors.split(','):
+			rate, failures = run(cost, executor, threads, seconds, workers)
+			per_login = 1000.0 / rate if rate else float('inf')
+			click.echo(f'{cost:>4}  {executor:<8}  {rate:>9.1f}  {per_login:>9.1f}  {failures}')
+
+
+if __name__ == '__main__':
+	main()
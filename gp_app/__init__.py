@@ -2,19 +2,26 @@ import os
 import click
 from flask.cli import with_appcontext
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_migrate import Migrate
+from .identity import IdentityCache, AnonymousIdentity
+from .passwords import PasswordHasher
+from .ratelimit import RateLimiter
+from .caching import PageCache
+from .database import RoutingSQLAlchemy
 
-db = SQLAlchemy()
-bcrypt = Bcrypt()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
 login_manager.login_message_category = 'info'
+login_manager.anonymous_user = AnonymousIdentity
 mail = Mail()
 migrate = Migrate()
+identity_cache = IdentityCache()
+passwords = PasswordHasher()
+limiter = RateLimiter()
+page_cache = PageCache()
 
 def create_app(test_config=None):
 	# create and configure the app
@@ -28,7 +35,66 @@ def create_app(test_config=None):
 		MAIL_USE_TLS = 'True',
 		MAIL_USERNAME = os.environ.get('EMAIL_USER'),
 		MAIL_PASSWORD = os.environ.get('EMAIL_PASS'),
-
+		# Engine profile, see gp_app.database and the README.
+		DATABASE_POOL_SIZE = 5,
+		DATABASE_MAX_OVERFLOW = 10,
+		DATABASE_POOL_TIMEOUT = 30,
+		DATABASE_POOL_RECYCLE = 1800,
+		DATABASE_POOL_PRE_PING = True,
+		# Bind keys from SQLALCHEMY_BINDS that replicate the primary.
+		DATABASE_REPLICAS = [],
+		DATABASE_REPLICA_STICKY_SECONDS = 5,
+		# Data migrations, see gp_app.backfill.
+		BACKFILL_BATCH_SIZE = 1000,
+		BACKFILL_PAUSE = 0.0,
+		SQLITE_PRAGMAS = {
+			'journal_mode': 'wal',
+			'synchronous': 'normal',
+			'busy_timeout': 5000,
+			'cache_size': -16000,
+			'mmap_size': 128 * 1024 * 1024,
+			'temp_store': 'memory',
+		},
+		USERS_PER_PAGE = 50,
+		USERS_MAX_PER_PAGE = 500,
+		USER_TYPE_LOOKUP_PER_PAGE = 20,
+		STREAM_ROWS_PER_FETCH = 200,
+		STREAM_CHUNK_SIZE = 16384,
+		IDENTITY_CACHE_SIZE = 1024,
+		IDENTITY_CACHE_TTL = 300,
+		BCRYPT_LOG_ROUNDS = 12,
+		PASSWORD_HASH_EXECUTOR = 'thread',
+		PASSWORD_HASH_WORKERS = None,
+		PASSWORD_HASH_MAX_PENDING = None,
+		RATELIMIT_BACKEND = 'memory',
+		RATELIMIT_SQLITE_PATH = None,
+		RATELIMIT_MEMORY_MAX_KEYS = 100000,
+		RATELIMIT_LOGIN = '10/minute',
+		RATELIMIT_REGISTER = '5/minute',
+		RATELIMIT_RESET_PASSWORD = '5/minute',
+		PAGE_CACHE_ENABLED = True,
+		PAGE_CACHE_AUTHENTICATED = True,
+		ASSETS_FOLDER = None,
+		COMPRESS_ENABLED = True,
+		COMPRESS_MIN_SIZE = 500,
+		COMPRESS_LEVEL = 6,
+		COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/plain', 'text/csv',
+			'application/json', 'application/javascript', 'application/x-ndjson'],
+		METRICS_ENABLED = False,
+		METRICS_SERVER_TIMING = True,
+		# /metrics is only served when a scrape token is set.
+		METRICS_TOKEN = None,
+		# Seconds; statements slower than this are logged. None turns the
+		# slow-query log off.
+		SLOW_QUERY_THRESHOLD = None,
+		SLOW_QUERY_EXPLAIN = True,
+		MAIL_QUEUE_THREAD = False,
+		MAIL_QUEUE_BATCH_SIZE = 50,
+		MAIL_QUEUE_MAX_ATTEMPTS = 5,
+		MAIL_QUEUE_RETRY_DELAY = 30,
+		MAIL_QUEUE_MAX_RETRY_DELAY = 3600,
+		MAIL_QUEUE_POLL_INTERVAL = 5,
+		MAIL_QUEUE_LEASE = 300,
 	)
 
 	if test_config is None:
@@ -45,11 +111,17 @@ def create_app(test_config=None):
 	except OSError:
 		pass
 
+	from . import database
+	database.configure(app)
 	db.init_app(app)
-	bcrypt.init_app(app)
+	database.init_app(app, db)
 	login_manager.init_app(app)
 	mail.init_app(app)
 	migrate.init_app(app, db)
+	identity_cache.init_app(app)
+	passwords.init_app(app)
+	limiter.init_app(app)
+	page_cache.init_app(app)
 
 	from . import models
 
@@ -60,4 +132,33 @@ def create_app(test_config=None):
 	app.register_blueprint(main)
 	app.register_blueprint(errors)
 
+	from .users.importer import import_users_command
+	from .users.export import export_users_command
+	app.cli.add_command(import_users_command)
+	app.cli.add_command(export_users_command)
+
+	from .seed import seed_command
+	app.cli.add_command(seed_command)
+
+	from . import mailqueue
+	mailqueue.init_app(app)
+
+	from .assets import routes as assets
+	assets.init_app(app)
+
+	if app.config['COMPRESS_ENABLED']:
+		from . import compression
+		compression.init_app(app)
+
+	if app.config['METRICS_ENABLED']:
+		from .metrics import instrumentation
+		from .metrics.routes import metrics
+		instrumentation.init_app(app)
+		if app.config['METRICS_TOKEN']:
+			app.register_blueprint(metrics)
+
+	if app.config['SLOW_QUERY_THRESHOLD'] is not None:
+		from .metrics import slow_queries
+		slow_queries.init_app(app, db)
+
 	return app
\ No newline at end of file
@@ -0,0 +1,164 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import urllib.request
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+try:
+	import brotli
+except ImportError:  # optional: only gzip variants are built without it
+	brotli = None
+
+try:
+	import rjsmin
+except ImportError:  # optional: fall back to whitespace-only JS minification
+	rjsmin = None
+
+# Third-party files the layout used to pull from four CDNs, pinned to the
+# same versions. `flask assets fetch` downloads them into static/vendor.
+VENDOR = {
+	'bootstrap.min.css': ('https://stackpath.bootstrapcdn.com/bootstrap/4.1.3/css/bootstrap.min.css',
+		'sha384-MCw98/SFnGE8fJT3GXwEOngsV7Zt27NXFoaoApmYm81iuXoPkFOJwJ8ERdknLPMO'),
+	'bootstrap-select.min.css': ('https://cdnjs.cloudflare.com/ajax/libs/bootstrap-select/1.10.0/css/bootstrap-select.min.css', None),
+	'select2.min.css': ('https://cdnjs.cloudflare.com/ajax/libs/select2/4.0.3/css/select2.min.css', None),
+	'jquery-3.3.1.slim.min.js': ('https://code.jquery.com/jquery-3.3.1.slim.min.js',
+		'sha384-q8i/X+965DzO0rT7abK41JStQIAqVgRVzpbzo5smXKp4YfRvH+8abtTE1Pi6jizo'),
+	'popper.min.js': ('https://cdnjs.cloudflare.com/ajax/libs/popper.js/1.14.3/umd/popper.min.js',
+		'sha384-ZMP7rVo3mIykV+2+9J3UJ46jBk0WLaUAdn689aCwoqbBJiSnjAK/l8WvCWPIPm49'),
+	'bootstrap.min.js': ('https://stackpath.bootstrapcdn.com/bootstrap/4.1.3/js/bootstrap.min.js',
+		'sha384-ChfqqxuZUCnJSK3+MXmPNIyE6ZbWh2IMqE241rYiqJxyMiZ6OW/JmZQ5stwEULTy'),
+	'bootstrap-select.min.js': ('https://cdnjs.cloudflare.com/ajax/libs/bootstrap-select/1.10.0/js/bootstrap-select.min.js', None),
+	'select2.min.js': ('https://cdnjs.cloudflare.com/ajax/libs/select2/4.0.3/js/select2.min.js', None),
+}
+
+# Bundle name -> source files relative to the static folder, in load order.
+BUNDLES = {
+	'site.css': ['vendor/bootstrap.min.css', 'vendor/bootstrap-select.min.css',
+	             'vendor/select2.min.css', 'main.css'],
+	'site.js': ['vendor/jquery-3.3.1.slim.min.js', 'vendor/popper.min.js',
+	            'vendor/bootstrap.min.js', 'vendor/bootstrap-select.min.js',
+	            'vendor/select2.min.js', 'custom.js'],
+}
+
+MANIFEST = 'manifest.json'
+
+
+def dist_folder(app):
+	return app.config['ASSETS_FOLDER'] or os.path.join(app.static_folder, 'dist')
+
+
+def load_manifest(app):
+	try:
+		with open(os.path.join(dist_folder(app), MANIFEST)) as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return {}
+
+
+def minify_css(text):
+	text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+	text = re.sub(r'\s+', ' ', text)
+	text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+	# Spaces around ':' only go inside declaration blocks (the text before
+	# a '}'); in a selector "a :hover" and "a:hover" mean different things.
+	parts = re.split(r'([{}])', text)
+	for i in range(0, len(parts) - 1, 2):
+		if parts[i + 1] == '}':
+			parts[i] = re.sub(r'\s*:\s*', ':', parts[i])
+	return ''.join(parts).replace(';}', '}').strip()
+
+
+def minify_js(text):
+	if rjsmin is not None:
+		return rjsmin.jsmin(text)
+	lines = (line.strip() for line in text.splitlines())
+	return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def _read_source(static_folder, path):
+	with open(os.path.join(static_folder, path), encoding='utf-8') as f:
+		text = f.read()
+	if '.min.' in path:
+		return text
+	return minify_css(text) if path.endswith('.css') else minify_js(text)
+
+
+def write_variants(path, data):
+	"""Write ``data`` to ``path`` plus ``.gz`` (and ``.br`` when available)."""
+	with open(path, 'wb') as f:
+		f.write(data)
+	with open(path + '.gz', 'wb') as f:
+		# mtime=0 keeps the output reproducible between builds.
+		with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+			gz.write(data)
+	if brotli is not None:
+		with open(path + '.br', 'wb') as f:
+			f.write(brotli.compress(data, quality=11))
+
+
+def missing_sources(static_folder, bundles=BUNDLES):
+	return sorted({src for sources in bundles.values() for src in sources
+	               if not os.path.isfile(os.path.join(static_folder, src))})
+
+
+def build(static_folder, out_folder, bundles=BUNDLES):
+	"""Concatenate, minify and fingerprint ``bundles`` into ``out_folder``.
+
+	Returns the manifest mapping each bundle name to its hashed file name.
+	"""
+	os.makedirs(out_folder, exist_ok=True)
+	manifest = {}
+	for name, sources in sorted(bundles.items()):
+		separator = ';\n' if name.endswith('.js') else '\n'
+		data = separator.join(_read_source(static_folder, src) for src in sources).encode('utf-8')
+		stem, ext = os.path.splitext(name)
+		hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+		write_variants(os.path.join(out_folder, hashed), data)
+		manifest[name] = hashed
+	with open(os.path.join(out_folder, MANIFEST), 'w') as f:
+		json.dump(manifest, f, indent=2, sort_keys=True)
+	return manifest
+
+
+def sri_hash(data):
+	return 'sha384-' + base64.b64encode(hashlib.sha384(data).digest()).decode('ascii')
+
+
+assets_cli = AppGroup('assets', help='Self-hosted static asset pipeline.')
+
+
+@assets_cli.command('fetch')
+def fetch_command():
+	"""Download the pinned third-party files into static/vendor."""
+	vendor = os.path.join(current_app.static_folder, 'vendor')
+	os.makedirs(vendor, exist_ok=True)
+	for filename, (url, integrity) in sorted(VENDOR.items()):
+		with urllib.request.urlopen(url, timeout=30) as response:
+			data = response.read()
+		actual = sri_hash(data)
+		if integrity and actual != integrity:
+			raise click.ClickException(f'{filename}: integrity mismatch ({actual})')
+		with open(os.path.join(vendor, filename), 'wb') as f:
+			f.write(data)
+		click.echo(f'{filename}  {actual}')
+
+
+@assets_cli.command('build')
+def build_command():
+	"""Bundle, minify, fingerprint and precompress the static assets."""
+	missing = missing_sources(current_app.static_folder)
+	if missing:
+		# static/vendor is not committed; it comes from the pinned CDN files.
+		raise click.ClickException('Missing ' + ', '.join(missing) +
+		                           '. Run `flask assets fetch` first.')
+	out = dist_folder(current_app)
+	manifest = build(current_app.static_folder, out)
+	for name, hashed in sorted(manifest.items()):
+		click.echo(f'{name} -> {hashed}')
+	if brotli is None:
+		click.echo('brotli is not installed; only gzip variants were written.')
@@ -0,0 +1,64 @@
+import hashlib
+import mimetypes
+import os
+from flask import Blueprint, current_app, request, send_from_directory, url_for, abort
+from .pipeline import dist_folder, load_manifest, assets_cli
+
+assets = Blueprint('assets', __name__)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Preferred first: smallest variant the client accepts wins.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+@assets.route("/assets/<path:filename>")
+def bundle(filename):
+	folder = dist_folder(current_app)
+	if not os.path.isfile(os.path.join(folder, filename)):
+		abort(404)
+	mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+	served, encoding = filename, None
+	for name, suffix in ENCODINGS:
+		if name in request.accept_encodings and os.path.isfile(os.path.join(folder, filename + suffix)):
+			served, encoding = filename + suffix, name
+			break
+	response = send_from_directory(folder, served, mimetype=mimetype, conditional=True)
+	if encoding:
+		response.headers['Content-Encoding'] = encoding
+	response.headers['Cache-Control'] = IMMUTABLE
+	response.vary.add('Accept-Encoding')
+	return response
+
+
+def _static_version(filename):
+	path = os.path.join(current_app.static_folder, filename)
+	try:
+		mtime = os.path.getmtime(path)
+	except OSError:
+		return None
+	versions = current_app.extensions['assets']['versions']
+	cached = versions.get(filename)
+	if cached is None or cached[0] != mtime:
+		with open(path, 'rb') as f:
+			cached = versions[filename] = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+	return cached[1]
+
+
+def asset_url(filename):
+	"""Like ``url_for('static', filename=...)``, but cache-busted.
+
+	Built bundles resolve to their fingerprinted, immutable URL; any other
+	static file gets a ``?v=<content hash>`` query string.
+	"""
+	manifest = current_app.extensions['assets']['manifest']
+	if filename in manifest:
+		return url_for('assets.bundle', filename=manifest[filename])
+	return url_for('static', filename=filename, v=_static_version(filename))
+
+
+def init_app(app):
+	app.extensions['assets'] = {'manifest': load_manifest(app), 'versions': {}}
+	app.jinja_env.globals.update(asset_url=asset_url,
+	                             asset_bundles=app.extensions['assets']['manifest'])
+	app.register_blueprint(assets)
+	app.cli.add_command(assets_cli)
@@ -0,0 +1,146 @@
+"""Batched data backfills for migration scripts.
+
+A backfill walks a table in primary key order, ``batch_size`` rows at a
+time, and commits each chunk together with a checkpoint in
+``backfill_progress``. Locks are held for one chunk, not the whole
+table. An interrupted run resumes after the last committed chunk. The
+checkpoint is removed when the run completes. A later run with the same
+name, e.g. after a downgrade, starts over.
+
+Give a backfill its own revision and run it in an autocommit block
+(Alembic 1.2+). The block commits the migrations before it, so their
+locks don't stall the chunks::
+
+    def upgrade():
+        user = sa.table('user', sa.column('id', sa.Integer), sa.column('email', sa.String))
+        with op.get_context().autocommit_block():
+            backfill.update(op.get_bind(), 'lowercase-emails', user,
+                            {'email': sa.func.lower(user.c.email)},
+                            where=user.c.email != sa.func.lower(user.c.email))
+
+A chunk can run twice if the process dies between its update and its
+commit, so updates must be idempotent.
+"""
+import json
+import logging
+import time
+from datetime import datetime
+import sqlalchemy as sa
+from flask import current_app
+from .models import BackfillProgress
+
+log = logging.getLogger('gp_app.backfill')
+
+# Seconds between progress log lines.
+REPORT_INTERVAL = 5.0
+
+_progress = BackfillProgress.__table__
+
+
+def _primary_key(table):
+	columns = list(table.primary_key.columns)
+	if len(columns) != 1:
+		raise ValueError(f'{table.name} needs a single-column key; pass key= explicitly')
+	return columns[0]
+
+
+def _after(key, last_key):
+	return key > last_key if last_key is not None else sa.true()
+
+
+def _load_checkpoint(conn, name):
+	row = conn.execute(sa.select([_progress.c.last_key, _progress.c.rows])
+	                   .where(_progress.c.name == name)).first()
+	if row is None:
+		return None, 0
+	return json.loads(row.last_key), row.rows
+
+
+def _save_checkpoint(conn, name, last_key, rows):
+	values = {'last_key': json.dumps(last_key), 'rows': rows, 'updated_at': datetime.utcnow()}
+	if not conn.execute(_progress.update().where(_progress.c.name == name)
+	                    .values(values)).rowcount:
+		conn.execute(_progress.insert().values(name=name, **values))
+
+
+def log_progress(name, done, total, elapsed):
+	rate = done / elapsed if elapsed else 0
+	if total:
+		eta = f', {(total - done) / rate:.0f}s left' if rate else ''
+		log.info('%s: %d/%d rows (%.0f%%), %.0f rows/s%s', name, done, total,
+		         100.0 * done / total, rate, eta)
+	else:
+		log.info('%s: %d rows, %.0f rows/s', name, done, rate)
+
+
+def run(bind, name, table, handler, where=None, key=None, batch_size=None, pause=None,
+        progress=log_progress):
+	"""Call ``handler(conn, lower, upper)`` for each chunk of ``table``.
+
+	A chunk holds the next ``batch_size`` rows matching ``where`` in ``key``
+	order. It covers keys above ``lower`` (None on the first chunk) up to
+	and including ``upper``. The handler returns how many rows it changed.
+	Each chunk runs in its own transaction on a new connection from
+	``bind``'s engine. ``pause`` seconds of sleep between chunks give
+	other writers a turn. ``batch_size`` and ``pause`` default to
+	``BACKFILL_BATCH_SIZE`` and ``BACKFILL_PAUSE``.
+
+	``progress(name, done, total, elapsed)`` is called at most every
+	``REPORT_INTERVAL`` seconds and once at the end. Returns the number
+	of rows changed.
+	"""
+	key = _primary_key(table) if key is None else key
+	batch_size = batch_size or current_app.config['BACKFILL_BATCH_SIZE']
+	pause = current_app.config['BACKFILL_PAUSE'] if pause is None else pause
+	matching = [where] if where is not None else []
+
+	with bind.engine.connect() as conn:
+		last_key, done = _load_checkpoint(conn, name)
+		total = done + conn.execute(sa.select([sa.func.count()]).select_from(table)
+		                            .where(sa.and_(_after(key, last_key), *matching))).scalar()
+		if last_key is not None:
+			log.info('%s: resuming after %s=%r, %d rows done', name, key.name, last_key, done)
+
+		started = reported = time.monotonic()
+		changed = 0
+		while True:
+			keys = [k for k, in conn.execute(
+				sa.select([key]).where(sa.and_(_after(key, last_key), *matching))
+				.order_by(key).limit(batch_size))]
+			if not keys:
+				break
+			with conn.begin():
+				changed += handler(conn, last_key, keys[-1]) or 0
+				_save_checkpoint(conn, name, keys[-1], done + len(keys))
+			last_key, done = keys[-1], done + len(keys)
+
+			now = time.monotonic()
+			if progress is not None and now - reported >= REPORT_INTERVAL:
+				progress(name, done, total, now - started)
+				reported = now
+			if len(keys) < batch_size:
+				break
+			if pause:
+				time.sleep(pause)
+
+		with conn.begin():
+			conn.execute(_progress.delete().where(_progress.c.name == name))
+		if progress is not None:
+			progress(name, done, total, time.monotonic() - started)
+	return changed
+
+
+def update(bind, name, table, values, where=None, key=None, **options):
+	"""Backfill with ``UPDATE table SET values`` for the rows matching ``where``.
+
+	Takes the same options as :func:`run`.
+	"""
+	key = _primary_key(table) if key is None else key
+
+	def handler(conn, lower, upper):
+		stmt = table.update().where(sa.and_(_after(key, lower), key <= upper))
+		if where is not None:
+			stmt = stmt.where(where)
+		return conn.execute(stmt.values(values)).rowcount
+
+	return run(bind, name, table, handler, where=where, key=key, **options)
@@ -0,0 +1,104 @@
+import functools
+import hashlib
+import os
+import threading
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+
+
+def _templates_mtime(names):
+	env = current_app.jinja_env
+	return max(os.path.getmtime(env.get_template(name).filename) for name in names)
+
+
+def _variant():
+	if session.get('_flashes'):
+		return None
+	if not current_user.is_authenticated:
+		return 'anonymous'
+	if current_app.config['PAGE_CACHE_AUTHENTICATED']:
+		# The nav bar only depends on what the user may do, not who they are.
+		return 'permissions:' + ','.join(sorted(current_user.permissions))
+	return None
+
+
+def _split(rv):
+	if isinstance(rv, tuple):
+		return rv[0], rv[1]
+	return rv, 200
+
+
+class PageCache(object):
+	"""Rendered pages keyed by view and visitor variant.
+
+	An entry is reused while the mtimes of the templates it was rendered
+	from are unchanged, so editing a template invalidates it.
+	"""
+
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.extensions['page_cache'] = {'entries': {}, 'lock': threading.Lock()}
+
+	@property
+	def _state(self):
+		return current_app.extensions['page_cache']
+
+	def get(self, key, mtime):
+		entry = self._state['entries'].get(key)
+		if entry is not None and entry[0] == mtime:
+			return entry[1:]
+		return None
+
+	def put(self, key, mtime, body, status, etag):
+		state = self._state
+		with state['lock']:
+			state['entries'][key] = (mtime, body, status, etag)
+
+	def clear(self):
+		state = self._state
+		with state['lock']:
+			state['entries'].clear()
+
+	def __len__(self):
+		return len(self._state['entries'])
+
+	def cached(self, *templates):
+		"""Serve the view's rendered HTML from memory for GET requests.
+
+		``templates`` lists every file the page is rendered from. 200 responses
+		carry a strong ETag and answer ``If-None-Match`` with 304; error pages
+		are returned as ``(body, status)`` like the handlers they wrap.
+		"""
+		def decorator(view):
+			@functools.wraps(view)
+			def wrapped_view(*args, **kwargs):
+				if not current_app.config['PAGE_CACHE_ENABLED'] or request.method != 'GET':
+					return view(*args, **kwargs)
+				variant = _variant()
+				if variant is None:
+					return view(*args, **kwargs)
+
+				key = (view.__module__, view.__name__, variant)
+				mtime = _templates_mtime(templates)
+				cached = self.get(key, mtime)
+				if cached is None:
+					body, status = _split(view(*args, **kwargs))
+					etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+					self.put(key, mtime, body, status, etag)
+				else:
+					body, status, etag = cached
+
+				if status != 200:
+					return body, status
+				response = make_response(body)
+				response.set_etag(etag)
+				response.headers['Cache-Control'] = ('no-cache' if variant == 'anonymous'
+				                                     else 'private, no-cache')
+				response.vary.add('Cookie')
+				return response.make_conditional(request)
+
+			return wrapped_view
+		return decorator
@@ -0,0 +1,134 @@
+import re
+import zlib
+from flask import request
+
+try:
+	import brotli
+except ImportError:  # optional: gzip only without it
+	brotli = None
+
+_ETAG_SUFFIX = re.compile(r'-(?:gzip|br)"')
+_IF_NONE_MATCH = 'gp_app.compression.if_none_match'
+
+
+class _Gzip(object):
+	def __init__(self, level):
+		# wbits 16 + MAX_WBITS writes a gzip header and trailer.
+		self._z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+	def compress(self, data):
+		return self._z.compress(data)
+
+	def flush(self):
+		return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+	def finish(self):
+		return self._z.flush(zlib.Z_FINISH)
+
+
+class _Brotli(object):
+	def __init__(self, level):
+		self._c = brotli.Compressor(quality=min(level, 11))
+
+	def compress(self, data):
+		return self._c.process(data)
+
+	def flush(self):
+		return self._c.flush()
+
+	def finish(self):
+		return self._c.finish()
+
+
+def _compressor(encoding, level):
+	return _Brotli(level) if encoding == 'br' else _Gzip(level)
+
+
+def compress(data, encoding, level):
+	c = _compressor(encoding, level)
+	return c.compress(data) + c.finish()
+
+
+def compress_stream(chunks, encoding, level):
+	"""Compress an iterable of chunks, flushing after each one.
+
+	Flushing keeps streamed pages streaming: every chunk the view yields
+	reaches the client without waiting for the rest of the body.
+	"""
+	c = _compressor(encoding, level)
+	try:
+		for chunk in chunks:
+			if isinstance(chunk, str):
+				chunk = chunk.encode('utf-8')
+			data = c.compress(chunk) + c.flush()
+			if data:
+				yield data
+		yield c.finish()
+	finally:
+		close = getattr(chunks, 'close', None)
+		if close is not None:
+			close()
+
+
+def _not_modified(response):
+	# The view matched the stripped validator; answer with the tag the
+	# client holds so its cache entry keeps the same ETag.
+	etag, weak = response.get_etag()
+	sent = request.environ.get(_IF_NONE_MATCH, '')
+	for encoding in ('br', 'gzip'):
+		if etag and f'{etag}-{encoding}"' in sent:
+			response.set_etag(f'{etag}-{encoding}', weak)
+			response.vary.add('Accept-Encoding')
+			break
+	return response
+
+
+def negotiate():
+	offered = ('br', 'gzip') if brotli is not None else ('gzip',)
+	return request.accept_encodings.best_match(offered)
+
+
+def init_app(app):
+	mimetypes = frozenset(app.config['COMPRESS_MIMETYPES'])
+	min_size = app.config['COMPRESS_MIN_SIZE']
+	level = app.config['COMPRESS_LEVEL']
+
+	@app.before_request
+	def strip_etag_encoding():
+		# Compressed responses carry '"<etag>-gzip"'; compare validators
+		# against the uncompressed entity the views know about.
+		value = request.environ.get('HTTP_IF_NONE_MATCH')
+		if value:
+			request.environ[_IF_NONE_MATCH] = value
+			request.environ['HTTP_IF_NONE_MATCH'] = _ETAG_SUFFIX.sub('"', value)
+
+	@app.after_request
+	def compress_response(response):
+		if response.status_code == 304:
+			return _not_modified(response)
+		if (response.status_code < 200 or response.status_code == 204
+				or response.direct_passthrough
+				or 'Content-Encoding' in response.headers
+				or response.mimetype not in mimetypes):
+			return response
+		# Pages next to reflected input are safe to compress because their
+		# CSRF tokens are masked per response, see gp_app.csrf.
+		response.vary.add('Accept-Encoding')
+		encoding = negotiate()
+		if encoding is None:
+			return response
+
+		if response.is_streamed:
+			response.response = compress_stream(response.response, encoding, level)
+			response.headers.pop('Content-Length', None)
+		else:
+			data = response.get_data()
+			if len(data) < min_size:
+				return response
+			response.set_data(compress(data, encoding, level))
+
+		response.headers['Content-Encoding'] = encoding
+		etag, weak = response.get_etag()
+		if etag:
+			response.set_etag(f'{etag}-{encoding}', weak)
+		return response
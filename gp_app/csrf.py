@@ -0,0 +1,60 @@
+"""CSRF tokens masked per response.
+
+Flask-WTF hands out the same signed token for the whole session. Pages
+that also reflect user input, such as the users search, would leak it
+through the compressed size of the response (BREACH). Every token that
+goes into a page is XORed with a fresh random pad instead, so no two
+responses contain the same bytes, and the pad travels with it.
+"""
+import base64
+import os
+from flask_wtf import FlaskForm
+from flask_wtf.csrf import _FlaskFormCSRF, generate_csrf, validate_csrf
+
+
+def mask(token):
+	data = token.encode('ascii')
+	pad = os.urandom(len(data))
+	return base64.urlsafe_b64encode(pad + bytes(a ^ b for a, b in zip(pad, data))).decode('ascii')
+
+
+def unmask(value):
+	"""The token behind ``mask(token)``.
+
+	Anything that isn't a masked token comes back unchanged, so
+	``validate_csrf`` still reports it as missing or invalid.
+	"""
+	if not value:
+		return value
+	try:
+		data = base64.urlsafe_b64decode(value.encode('ascii'))
+		half = len(data) // 2
+		return bytes(a ^ b for a, b in zip(data[:half], data[half:])).decode('ascii')
+	except (ValueError, UnicodeError):
+		return value
+
+
+def masked_csrf():
+	"""A masked copy of the session's CSRF token for a template."""
+	return mask(generate_csrf())
+
+
+def validate_masked_csrf(value):
+	"""Like ``validate_csrf``, for a token that came from a page."""
+	validate_csrf(unmask(value))
+
+
+class MaskedCSRF(_FlaskFormCSRF):
+	def generate_csrf_token(self, csrf_token_field):
+		return mask(super().generate_csrf_token(csrf_token_field))
+
+	def validate_csrf_token(self, form, field):
+		field.data = unmask(field.data)
+		super().validate_csrf_token(form, field)
+
+
+class MaskedForm(FlaskForm):
+	"""FlaskForm whose ``hidden_tag()`` renders a masked token."""
+
+	class Meta:
+		csrf_class = MaskedCSRF
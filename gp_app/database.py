@@ -0,0 +1,205 @@
+import contextlib
+import random
+import re
+import sqlite3
+import time
+import click
+from flask import request, session as flask_session, has_request_context
+from flask.cli import with_appcontext
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+_PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+_READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+# Flask session key: until when this client's reads stay on the primary.
+_PRIMARY_UNTIL = '_db_primary_until'
+
+
+def is_sqlite_file(uri):
+	url = make_url(uri)
+	return url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:')
+
+
+def engine_options(config, uri):
+	"""``create_engine`` keyword arguments for ``uri`` from the DATABASE_* settings.
+
+	File-backed SQLite gets a real connection pool so the pragmas set on
+	connect are paid once per connection rather than once per request;
+	in-memory SQLite is left to Flask-SQLAlchemy's StaticPool.
+	"""
+	url = make_url(uri)
+	if url.drivername.startswith('sqlite'):
+		if not is_sqlite_file(uri):
+			return {}
+		return {
+			'poolclass': QueuePool,
+			'pool_size': config['DATABASE_POOL_SIZE'],
+			'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+			'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+			# Pooled connections move between request threads.
+			'connect_args': {'check_same_thread': False},
+		}
+	return {
+		'pool_size': config['DATABASE_POOL_SIZE'],
+		'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+		'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+		'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+		'pool_pre_ping': config['DATABASE_POOL_PRE_PING'],
+	}
+
+
+def configure(app):
+	"""Fill ``SQLALCHEMY_ENGINE_OPTIONS`` from the engine profile.
+
+	Options already set there win over the profile.
+	"""
+	options = engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+	options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+	app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def set_pragmas(pragmas):
+	for name in pragmas:
+		if not _PRAGMA_NAME.match(name):
+			raise ValueError(f'Invalid SQLite pragma name {name!r}')
+
+	def on_connect(dbapi_connection, connection_record):
+		cursor = dbapi_connection.cursor()
+		try:
+			for name, value in pragmas.items():
+				cursor.execute(f'PRAGMA {name} = {value}')
+		finally:
+			cursor.close()
+
+	return on_connect
+
+
+def _is_write(clause):
+	if isinstance(clause, UpdateBase):
+		return True
+	return isinstance(clause, TextClause) and not clause.text.lstrip().upper().startswith(
+		('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN'))
+
+
+def _reads_from_replica():
+	if not has_request_context() or request.method not in _READ_METHODS:
+		return False
+	return flask_session.get(_PRIMARY_UNTIL, 0) < time.time()
+
+
+class RoutingSession(SignallingSession):
+	"""Sends the reads of GET/HEAD/OPTIONS requests to a replica bind.
+
+	Everything else uses the primary: other methods, work outside a
+	request, clients that wrote within ``DATABASE_REPLICA_STICKY_SECONDS``,
+	and every statement after this session's first write.
+	"""
+
+	def __init__(self, db, **options):
+		self.db = db
+		self.wrote = False
+		self._on_primary = 0
+		self._replica = None
+		super(RoutingSession, self).__init__(db, **options)
+
+	def use_primary(self):
+		self.wrote = True
+
+	@contextlib.contextmanager
+	def reads_on_primary(self):
+		self._on_primary += 1
+		try:
+			yield
+		finally:
+			self._on_primary -= 1
+
+	def get_bind(self, mapper=None, clause=None):
+		bind = super(RoutingSession, self).get_bind(mapper, clause)
+		if self._flushing or _is_write(clause):
+			self.wrote = True
+		# Tables with their own __bind_key__ are left where they are.
+		if self.wrote or self._on_primary or bind is not self.bind:
+			return bind
+		if self._replica is None:
+			replicas = self.app.config['DATABASE_REPLICAS']
+			if not replicas or not _reads_from_replica():
+				return bind
+			# One replica for the whole request, so it reads one snapshot.
+			self._replica = self.db.get_engine(self.app, random.choice(replicas))
+		return self._replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+	def create_session(self, options):
+		return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def use_primary():
+	"""Keep the rest of this request's queries on the primary."""
+	from . import db
+	db.session().use_primary()
+
+
+def reads_on_primary():
+	"""Context manager sending the enclosed reads to the primary.
+
+	Unlike :func:`use_primary` it leaves the rest of the request on the
+	replica and doesn't make the client sticky. For reads that must not be
+	stale, like the identity that gets cached for IDENTITY_CACHE_TTL.
+	"""
+	from . import db
+	return db.session().reads_on_primary()
+
+
+@click.command('sync-replicas')
+@with_appcontext
+def sync_replicas_command():
+	"""Copy the primary SQLite database over every replica file.
+
+	Stands in for replication when the replicas are local SQLite files.
+	"""
+	from . import db
+	app = db.get_app()
+	source = db.engine.url.database
+	for key in app.config['DATABASE_REPLICAS']:
+		engine = db.get_engine(app, key)
+		if engine.dialect.name != 'sqlite' or db.engine.dialect.name != 'sqlite':
+			raise click.ClickException('sync-replicas only copies SQLite files.')
+		engine.dispose()
+		src, dst = sqlite3.connect(source), sqlite3.connect(engine.url.database)
+		try:
+			src.backup(dst)
+		finally:
+			src.close()
+			dst.close()
+		click.echo(f'{source} -> {engine.url.database}')
+
+
+def init_app(app, db):
+	binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+	for key in app.config['DATABASE_REPLICAS']:
+		if key not in binds:
+			raise ValueError(f'DATABASE_REPLICAS names {key!r}, which is not in SQLALCHEMY_BINDS')
+	app.cli.add_command(sync_replicas_command)
+
+	pragmas = app.config['SQLITE_PRAGMAS']
+	if pragmas:
+		on_connect = set_pragmas(pragmas)
+		with app.app_context():
+			for bind in binds:
+				engine = db.get_engine(app, bind)
+				if engine.dialect.name == 'sqlite':
+					event.listen(engine, 'connect', on_connect)
+
+	if app.config['DATABASE_REPLICAS']:
+		@app.after_request
+		def stick_to_primary(response):
+			# Let the client read its own writes on the next few requests.
+			if db.session().wrote:
+				flask_session[_PRIMARY_UNTIL] = (
+					time.time() + app.config['DATABASE_REPLICA_STICKY_SECONDS'])
+			return response
@@ -1,19 +1,31 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, make_response
+from .. import page_cache
 
 errors = Blueprint('errors', __name__)
 
 
 
 @errors.app_errorhandler(404)
+@page_cache.cached('errors/404.html', 'layout.html')
 def error_404(error):
 	return render_template('errors/404.html'), 404
 
 
 @errors.app_errorhandler(403)
+@page_cache.cached('errors/403.html', 'layout.html')
 def error_403(error):
 	return render_template('errors/403.html'), 403
 
 
+@errors.app_errorhandler(429)
+def error_429(error):
+	response = make_response(render_template('errors/429.html'), 429)
+	retry_after = getattr(error, 'retry_after', None)
+	if retry_after:
+		response.headers['Retry-After'] = str(retry_after)
+	return response
+
+
 @errors.app_errorhandler(500)
 def error_500(error):
 	return render_template('errors/500.html'), 500
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from flask_login import UserMixin, AnonymousUserMixin
+
+
+class Identity(UserMixin):
+	# A detached, read-only snapshot of a user that is safe to keep between
+	# requests. Views that need to change the user must load the real model.
+	def __init__(self, id, username, email, user_type_names, permissions=()):
+		self.id = id
+		self.username = username
+		self.email = email
+		self.user_type_names = frozenset(user_type_names)
+		self.permissions = frozenset(permissions)
+
+	def has_permission(self, name):
+		return name in self.permissions
+
+	def __repr__(self):
+		return f"Identity('{self.username}', '{self.email}')"
+
+
+class AnonymousIdentity(AnonymousUserMixin):
+	permissions = frozenset()
+
+	def has_permission(self, name):
+		return False
+
+
+class _LRUStore(object):
+	def __init__(self, maxsize, ttl):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] > time.monotonic():
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry[1]
+			if entry is not None:
+				del self._entries[key]
+			self.misses += 1
+			return None
+
+	def put(self, key, value):
+		if self.maxsize <= 0:
+			return
+		with self._lock:
+			self._entries[key] = (time.monotonic() + self.ttl, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def pop(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def __len__(self):
+		return len(self._entries)
+
+
+class IdentityCache(object):
+	"""Bounded TTL/LRU cache of :class:`Identity` objects keyed by user id.
+
+	The cache lives in ``app.extensions`` so every app (and every process)
+	gets its own. Writers call :meth:`invalidate` for the user they changed;
+	the TTL bounds how stale other processes can be.
+	"""
+
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.extensions['identity_cache'] = _LRUStore(app.config['IDENTITY_CACHE_SIZE'],
+		                                             app.config['IDENTITY_CACHE_TTL'])
+
+	@property
+	def _store(self):
+		return current_app.extensions['identity_cache']
+
+	def get(self, user_id, loader):
+		identity = self._store.get(user_id)
+		if identity is None:
+			identity = loader(user_id)
+			if identity is not None:
+				self._store.put(user_id, identity)
+		return identity
+
+	def invalidate(self, user_id):
+		self._store.pop(user_id)
+
+	def clear(self):
+		self._store.clear()
+
+	@property
+	def hits(self):
+		return self._store.hits
+
+	@property
+	def misses(self):
+		return self._store.misses
+
+	def stats(self):
+		store = self._store
+		return {'hits': store.hits, 'misses': store.misses, 'size': len(store),
+		        'maxsize': store.maxsize}
@@ -0,0 +1,181 @@
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+from . import db, mail
+from .models import OutboundMail
+
+
+def enqueue(msg):
+	# Requests only pay for one INSERT; a worker does the SMTP round trips.
+	queued = OutboundMail(subject=msg.subject, sender=msg.sender,
+		recipients=','.join(msg.recipients), body=msg.body)
+	db.session.add(queued)
+	db.session.commit()
+	worker = current_app.extensions.get('mail_worker')
+	if worker is not None:
+		worker.wake()
+	return queued
+
+
+def retry_delay(attempts):
+	base = current_app.config['MAIL_QUEUE_RETRY_DELAY']
+	return timedelta(seconds=min(base * 2 ** (attempts - 1),
+	                             current_app.config['MAIL_QUEUE_MAX_RETRY_DELAY']))
+
+
+def _record_failure(queued, error, now):
+	queued.attempts += 1
+	queued.last_error = repr(error)
+	if queued.attempts >= current_app.config['MAIL_QUEUE_MAX_ATTEMPTS']:
+		queued.status = 'failed'
+	else:
+		queued.status = 'pending'
+		queued.next_attempt_at = now + retry_delay(queued.attempts)
+
+
+def claim_due(batch_size, now):
+	"""Claim up to ``batch_size`` due messages for this worker and commit.
+
+	A claim flips the row to 'sending' with a conditional UPDATE, so of
+	several workers (every process's thread, ``flask mail-worker``) only
+	one wins each message. The claim is a lease: if its worker dies, the
+	message is due again after MAIL_QUEUE_LEASE seconds.
+	"""
+	lease_until = now + timedelta(seconds=current_app.config['MAIL_QUEUE_LEASE'])
+	candidates = [id for id, in db.session.query(OutboundMail.id).filter(
+		OutboundMail.status.in_(['pending', 'sending']),
+		OutboundMail.next_attempt_at <= now)
+		.order_by(OutboundMail.next_attempt_at, OutboundMail.id).limit(batch_size)]
+	claimed = []
+	for id in candidates:
+		rows = OutboundMail.query.filter(OutboundMail.id == id,
+			OutboundMail.status.in_(['pending', 'sending']),
+			OutboundMail.next_attempt_at <= now) \
+			.update({'status': 'sending', 'next_attempt_at': lease_until},
+			        synchronize_session=False)
+		if rows:
+			claimed.append(id)
+	db.session.commit()
+	if not claimed:
+		return []
+	return OutboundMail.query.filter(OutboundMail.id.in_(claimed)) \
+		.order_by(OutboundMail.id).all()
+
+
+def deliver_due(batch_size=None):
+	"""Send one batch of due messages over a single SMTP connection.
+
+	Returns ``(sent, failed)`` counts for the batch. Messages that fail are
+	rescheduled with exponential backoff until ``MAIL_QUEUE_MAX_ATTEMPTS``.
+	"""
+	batch_size = batch_size or current_app.config['MAIL_QUEUE_BATCH_SIZE']
+	now = datetime.utcnow()
+	batch = claim_due(batch_size, now)
+	if not batch:
+		return 0, 0
+
+	sent = failed = 0
+	attempted = 0
+	try:
+		with mail.connect() as conn:
+			for queued in batch:
+				attempted += 1
+				msg = Message(queued.subject, sender=queued.sender,
+					recipients=queued.recipients.split(','), body=queued.body)
+				try:
+					conn.send(msg)
+				except (smtplib.SMTPServerDisconnected, OSError) as e:
+					# The connection is gone; the rest of the batch waits
+					# for the next pass instead of failing one by one.
+					_record_failure(queued, e, now)
+					failed += 1
+					break
+				except smtplib.SMTPException as e:
+					_record_failure(queued, e, now)
+					failed += 1
+				else:
+					queued.status = 'sent'
+					queued.sent_at = datetime.utcnow()
+					queued.attempts += 1
+					sent += 1
+				db.session.commit()
+	except (smtplib.SMTPException, OSError) as e:
+		# Before any attempt this means we could not connect at all: back
+		# off the whole batch. After one it is quit() failing on a dropped
+		# connection, which the messages have nothing to do with.
+		if not attempted:
+			for queued in batch:
+				_record_failure(queued, e, now)
+				failed += 1
+	# Hand back what this pass never tried, without charging an attempt.
+	for queued in batch[attempted:]:
+		if queued.status == 'sending':
+			queued.status = 'pending'
+			queued.next_attempt_at = now
+	db.session.commit()
+	return sent, failed
+
+
+class MailWorker(threading.Thread):
+	"""Daemon thread that drains the mail queue for one app."""
+
+	def __init__(self, app):
+		super().__init__(name='mail-worker', daemon=True)
+		self.app = app
+		self._wakeup = threading.Event()
+		self._stopped = threading.Event()
+
+	def wake(self):
+		self._wakeup.set()
+
+	def stop(self):
+		self._stopped.set()
+		self._wakeup.set()
+
+	def run(self):
+		interval = self.app.config['MAIL_QUEUE_POLL_INTERVAL']
+		while not self._stopped.is_set():
+			self._wakeup.clear()
+			with self.app.app_context():
+				try:
+					sent, failed = deliver_due()
+				except Exception:
+					self.app.logger.exception('Mail queue batch failed')
+					sent = failed = 0
+				finally:
+					db.session.remove()
+			if not sent:
+				self._wakeup.wait(interval)
+
+
+def init_app(app):
+	app.cli.add_command(mail_worker_command)
+	if app.config['MAIL_QUEUE_THREAD']:
+		worker = MailWorker(app)
+		app.extensions['mail_worker'] = worker
+		worker.start()
+
+
+@click.command('mail-worker')
+@click.option('--once', is_flag=True, help='Drain the due messages and exit.')
+@with_appcontext
+def mail_worker_command(once):
+	"""Deliver queued mail, reusing one SMTP connection per batch."""
+	interval = current_app.config['MAIL_QUEUE_POLL_INTERVAL']
+	total_sent = total_failed = 0
+	while True:
+		sent, failed = deliver_due()
+		total_sent += sent
+		total_failed += failed
+		if sent or failed:
+			click.echo(f'Sent {sent}, failed {failed}.')
+		if once and not sent:
+			break
+		if not sent:
+			time.sleep(interval)
+	click.echo(f'Done: sent {total_sent}, failed {total_failed}.')
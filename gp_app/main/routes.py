@@ -1,15 +1,18 @@
 from flask import Blueprint
 from flask import render_template, request, Blueprint
+from .. import page_cache
 
 main = Blueprint('main', __name__)
 
 
 @main.route("/")
 @main.route("/home")
+@page_cache.cached('home.html', 'layout.html')
 def home():
 	return render_template('home.html', title='Home')
 
 
 @main.route("/about")
+@page_cache.cached('about.html', 'layout.html')
 def about():
 	return render_template('about.html', title='About')
\ No newline at end of file
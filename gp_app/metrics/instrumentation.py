@@ -0,0 +1,164 @@
+import threading
+import time
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name -> (help, buckets, RequestStats attribute)
+HISTOGRAMS = (
+	('gp_request_duration_seconds', 'Total request latency.', LATENCY_BUCKETS, 'duration'),
+	('gp_sql_queries_per_request', 'SQL statements executed per request.', COUNT_BUCKETS, 'sql_count'),
+	('gp_sql_duration_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS, 'sql_time'),
+	('gp_template_render_seconds', 'Jinja render time per request.', LATENCY_BUCKETS, 'render_time'),
+	('gp_bcrypt_seconds', 'Password hashing time per request.', LATENCY_BUCKETS, 'bcrypt_time'),
+)
+
+
+class RequestStats(object):
+	__slots__ = ('start', 'duration', 'sql_count', 'sql_time', 'render_time',
+	             'bcrypt_time', '_render_start')
+
+	def __init__(self):
+		self.start = time.perf_counter()
+		self.duration = 0.0
+		self.sql_count = 0
+		self.sql_time = 0.0
+		self.render_time = 0.0
+		self.bcrypt_time = 0.0
+		self._render_start = None
+
+
+class Histogram(object):
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		else:
+			self.counts[-1] += 1
+		self.sum += value
+		self.count += 1
+
+
+class Registry(object):
+	def __init__(self):
+		self._histograms = {}
+		self._lock = threading.Lock()
+
+	def observe(self, endpoint, stats):
+		with self._lock:
+			for name, _, buckets, attr in HISTOGRAMS:
+				histogram = self._histograms.get((name, endpoint))
+				if histogram is None:
+					histogram = self._histograms[(name, endpoint)] = Histogram(buckets)
+				histogram.observe(getattr(stats, attr))
+
+	def render(self):
+		"""Prometheus text exposition format, version 0.0.4."""
+		lines = []
+		with self._lock:
+			for name, help, buckets, _ in HISTOGRAMS:
+				lines.append(f'# HELP {name} {help}')
+				lines.append(f'# TYPE {name} histogram')
+				for (metric, endpoint), histogram in sorted(self._histograms.items()):
+					if metric != name:
+						continue
+					label = f'endpoint="{endpoint}"'
+					cumulative = 0
+					for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+						cumulative += count
+						lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+					lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+					lines.append(f'{name}_count{{{label}}} {histogram.count}')
+		return '\n'.join(lines) + '\n'
+
+
+def current_stats():
+	if has_request_context():
+		return g.get('_request_stats')
+
+
+def add_timing(attr, seconds):
+	stats = current_stats()
+	if stats is not None:
+		setattr(stats, attr, getattr(stats, attr) + seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	# Kept on the statement's execution context, which goes away with it
+	# whether or not the statement raises.
+	if context is not None:
+		context._metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	started = getattr(context, '_metrics_query_start', None)
+	stats = current_stats()
+	if stats is not None and started is not None:
+		stats.sql_count += 1
+		stats.sql_time += time.perf_counter() - started
+
+
+def _before_render(app, template, context, **extra):
+	stats = current_stats()
+	if stats is not None:
+		stats._render_start = time.perf_counter()
+
+
+def _rendered(app, template, context, **extra):
+	stats = current_stats()
+	if stats is not None and stats._render_start is not None:
+		stats.render_time += time.perf_counter() - stats._render_start
+		stats._render_start = None
+
+
+def _server_timing(stats):
+	return ', '.join((
+		f'app;dur={stats.duration * 1000:.2f}',
+		f'db;dur={stats.sql_time * 1000:.2f};desc="{stats.sql_count} queries"',
+		f'tpl;dur={stats.render_time * 1000:.2f}',
+		f'bcrypt;dur={stats.bcrypt_time * 1000:.2f}',
+	))
+
+
+_hooks_installed = False
+
+def _install_global_hooks():
+	# Engine events are registered once per process on the Engine class;
+	# they only record while a request with instrumentation is active.
+	global _hooks_installed
+	if not _hooks_installed:
+		event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+		event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+		_hooks_installed = True
+
+
+def init_app(app):
+	registry = app.extensions['metrics'] = Registry()
+	_install_global_hooks()
+	before_render_template.connect(_before_render, app)
+	template_rendered.connect(_rendered, app)
+
+	@app.before_request
+	def start_request_stats():
+		g._request_stats = RequestStats()
+
+	@app.after_request
+	def record_request_stats(response):
+		stats = g.pop('_request_stats', None)
+		if stats is None:
+			return response
+		stats.duration = time.perf_counter() - stats.start
+		registry.observe(request.endpoint or '<unmatched>', stats)
+		if app.config['METRICS_SERVER_TIMING']:
+			response.headers['Server-Timing'] = _server_timing(stats)
+		return response
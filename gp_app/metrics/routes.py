@@ -0,0 +1,16 @@
+import hmac
+from flask import Blueprint, Response, current_app, request
+
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.route("/metrics")
+def prometheus_metrics():
+	# Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>".
+	expected = ('Bearer ' + current_app.config['METRICS_TOKEN']).encode('utf-8')
+	given = request.headers.get('Authorization', '').encode('utf-8')
+	if not hmac.compare_digest(given, expected):
+		return Response('Unauthorized\n', 401, {'WWW-Authenticate': 'Bearer'},
+		                mimetype='text/plain')
+	return Response(current_app.extensions['metrics'].render(),
+	                mimetype='text/plain; version=0.0.4')
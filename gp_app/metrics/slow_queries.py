@@ -0,0 +1,84 @@
+import logging
+import re
+import time
+from flask import request, has_request_context
+from sqlalchemy import event
+
+logger = logging.getLogger('gp_app.slow_query')
+
+_PASSWORD_HASH = re.compile(r'^\$2[abxy]?\$\d\d\$[./A-Za-z0-9]{53}$')
+_EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+REDACTED = '<redacted>'
+
+
+def redact(parameters):
+	if isinstance(parameters, dict):
+		return {key: REDACTED if 'password' in str(key).lower() else redact(value)
+		        for key, value in parameters.items()}
+	if isinstance(parameters, (list, tuple)):
+		return type(parameters)(redact(value) for value in parameters)
+	if isinstance(parameters, str) and _PASSWORD_HASH.match(parameters):
+		return REDACTED
+	return parameters
+
+
+def explain(conn, statement, parameters):
+	"""Return the query plan as text, or ``None`` if it can't be explained."""
+	if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+		return None
+	prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+	# Use a raw DBAPI cursor so the EXPLAIN doesn't fire these events again.
+	cursor = conn.connection.cursor()
+	try:
+		cursor.execute(prefix + statement, parameters)
+		rows = cursor.fetchall()
+	except Exception as e:
+		return f'EXPLAIN failed: {e!r}'
+	finally:
+		cursor.close()
+	if conn.dialect.name == 'sqlite':
+		# (id, parent, notused, detail)
+		return '\n'.join(str(row[-1]) for row in rows)
+	return '\n'.join(' '.join(str(col) for col in row) for row in rows)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	# On the execution context, so a statement that raises leaves nothing behind.
+	if context is not None:
+		context._slow_query_start = time.perf_counter()
+
+
+def _make_after_cursor_execute(app):
+	threshold = app.config['SLOW_QUERY_THRESHOLD']
+	with_plan = app.config['SLOW_QUERY_EXPLAIN']
+
+	def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+		started = getattr(context, '_slow_query_start', None)
+		if started is None:
+			return
+		elapsed = time.perf_counter() - started
+		if elapsed < threshold:
+			return
+		entry = {
+			'duration_ms': round(elapsed * 1000, 3),
+			'endpoint': request.endpoint if has_request_context() else None,
+			'statement': statement,
+			'parameters': redact(parameters),
+			'plan': explain(conn, statement, parameters)
+				if with_plan and not executemany else None,
+		}
+		logger.warning('Slow query (%.1f ms) in %s: %s\nparameters: %r\nplan:\n%s',
+			entry['duration_ms'], entry['endpoint'], statement, entry['parameters'],
+			entry['plan'], extra={'slow_query': entry})
+
+	return after_cursor_execute
+
+
+def init_app(app, db):
+	after_cursor_execute = _make_after_cursor_execute(app)
+	binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+	with app.app_context():
+		for bind in binds:
+			engine = db.get_engine(app, bind)
+			event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+			event.listen(engine, 'after_cursor_execute', after_cursor_execute)
@@ -1,15 +1,45 @@
+from datetime import datetime
 from flask_login import UserMixin
-from . import db, login_manager
+from . import db, login_manager, identity_cache
+from .identity import Identity
+from .database import reads_on_primary
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app
 
 @login_manager.user_loader
 def load_user(user_id):
-	return User.query.get(int(user_id))
+	return identity_cache.get(int(user_id), load_identity)
+
+def load_identity(user_id):
+	# One round trip for the user and all of their role names. It is read
+	# from the primary: a lagging replica could hand back a revoked role,
+	# which the identity cache would then keep for its whole TTL.
+	with reads_on_primary():
+		rows = db.session.query(User.id, User.username, User.email, UserType.name,
+		                        UserTypePermission.name) \
+			.outerjoin(user_types, user_types.c.user_id == User.id) \
+			.outerjoin(UserType, UserType.id == user_types.c.user_type_id) \
+			.outerjoin(UserTypePermission, UserTypePermission.user_type_id == UserType.id) \
+			.filter(User.id == user_id).all()
+	if not rows:
+		return None
+	id, username, email, _, _ = rows[0]
+	return Identity(id, username, email,
+		[row[3] for row in rows if row[3] is not None],
+		[row[4] for row in rows if row[4] is not None])
+
+# Named permissions a user type can grant. Views check these through
+# permission_required() instead of looking at user type names.
+MANAGE_USERS = 'manage_users'
+MANAGE_USER_TYPES = 'manage_user_types'
+PERMISSIONS = (MANAGE_USERS, MANAGE_USER_TYPES)
 
 user_types = db.Table('user_types',
-    db.Column('user_type_id', db.Integer, db.ForeignKey('user_type.id')),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('user_type_id', db.Integer, db.ForeignKey('user_type.id'), primary_key=True),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # The primary key leads with user_type_id; loading a user's types needs
+    # its own index.
+    db.Index('ix_user_types_user_id', 'user_id')
 )
 
 class User(db.Model, UserMixin):
@@ -17,7 +47,11 @@ class User(db.Model, UserMixin):
 	username = db.Column(db.String(20), unique=True, nullable=False)
 	email = db.Column(db.String(120), unique=True, nullable=False)
 	password = db.Column(db.String(60), nullable=False)
-	user_types = db.relationship('UserType', secondary=user_types, lazy='subquery',
+	# Emails are unique regardless of case; by_email() relies on it.
+	__table_args__ = (db.Index('ix_user_email_lower', db.func.lower(email), unique=True),)
+	# Roles are only loaded when touched; listing views batch them with
+	# type_names_by_user() instead of relying on a per-load subquery.
+	user_types = db.relationship('UserType', secondary=user_types, lazy='select',
 		backref=db.backref('user', lazy=True))
 
 	def get_reset_token(self, expires_sec=1800):
@@ -33,19 +67,91 @@ class User(db.Model, UserMixin):
 			return None
 		return User.query.get(user_id)
 
-	def is_superuser(self):
-		for user_type in self.user_types:
-			if 'SuperUser' in user_type.name:
-				return True
+	@staticmethod
+	def by_email(email):
+		# Case-insensitive, answered from ix_user_email_lower.
+		return User.query.filter(db.func.lower(User.email) == email.lower()).first()
+
+	@staticmethod
+	def type_names_by_user(user_ids):
+		names = {user_id: [] for user_id in user_ids}
+		if not names:
+			return names
+		rows = db.session.query(user_types.c.user_id, UserType.name) \
+			.join(UserType, UserType.id == user_types.c.user_type_id) \
+			.filter(user_types.c.user_id.in_(list(names))) \
+			.order_by(user_types.c.user_id, UserType.name)
+		for user_id, name in rows:
+			names[user_id].append(name)
+		return names
+
+	@property
+	def permissions(self):
+		# Resolved with one query and kept on the instance, which lives no
+		# longer than the request's session.
+		if '_permissions' not in self.__dict__:
+			with reads_on_primary():
+				rows = db.session.query(UserTypePermission.name).distinct() \
+					.join(user_types, user_types.c.user_type_id == UserTypePermission.user_type_id) \
+					.filter(user_types.c.user_id == self.id).all()
+			self.__dict__['_permissions'] = frozenset(name for name, in rows)
+		return self.__dict__['_permissions']
 
+	def has_permission(self, name):
+		return name in self.permissions
 
 	def __repr__(self):
 		return f"User('{self.username}', '{self.email}')"
 
 class UserType(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
-	name = db.Column(db.String(20), nullable=False)
+	name = db.Column(db.String(20), nullable=False, unique=True, index=True)
+	grants = db.relationship('UserTypePermission', lazy=True, cascade='all, delete-orphan')
+
+	@property
+	def permissions(self):
+		return sorted(grant.name for grant in self.grants)
+
+	@permissions.setter
+	def permissions(self, names):
+		self.grants = [UserTypePermission(name=name) for name in set(names)]
 	
 	def __repr__(self):
 		return f"UserType('{self.name}')"
 
+
+
+class UserTypePermission(db.Model):
+	user_type_id = db.Column(db.Integer, db.ForeignKey('user_type.id'), primary_key=True)
+	name = db.Column(db.String(40), primary_key=True)
+
+	def __repr__(self):
+		return f"UserTypePermission('{self.name}')"
+
+
+class OutboundMail(db.Model):
+	id = db.Column(db.Integer, primary_key=True)
+	subject = db.Column(db.String(255), nullable=False)
+	sender = db.Column(db.String(120), nullable=False)
+	recipients = db.Column(db.Text, nullable=False)
+	body = db.Column(db.Text, nullable=False)
+	status = db.Column(db.String(10), nullable=False, default='pending', index=True)
+	attempts = db.Column(db.Integer, nullable=False, default=0)
+	next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	sent_at = db.Column(db.DateTime)
+	last_error = db.Column(db.Text)
+
+	def __repr__(self):
+		return f"OutboundMail('{self.subject}', '{self.recipients}', '{self.status}')"
+
+
+class BackfillProgress(db.Model):
+	# Checkpoint of an unfinished gp_app.backfill run; removed once it completes.
+	name = db.Column(db.String(120), primary_key=True)
+	last_key = db.Column(db.Text, nullable=False)
+	rows = db.Column(db.Integer, nullable=False, default=0)
+	updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+	def __repr__(self):
+		return f"BackfillProgress('{self.name}', {self.last_key}, {self.rows})"
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import bcrypt as _bcrypt
+from flask import current_app
+from .metrics.instrumentation import add_timing
+
+# bcrypt only looks at the first 72 bytes; newer releases raise instead of
+# truncating, so do it explicitly to keep existing hashes verifiable.
+_MAX_PASSWORD_BYTES = 72
+
+
+def _to_bytes(value):
+	return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def bcrypt_hash(password, rounds):
+	return _bcrypt.hashpw(_to_bytes(password)[:_MAX_PASSWORD_BYTES],
+	                      _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def bcrypt_check(pw_hash, password):
+	try:
+		return _bcrypt.checkpw(_to_bytes(password)[:_MAX_PASSWORD_BYTES], _to_bytes(pw_hash))
+	except ValueError:
+		return False
+
+
+def bcrypt_cost(pw_hash):
+	try:
+		return int(pw_hash.split('$')[2])
+	except (AttributeError, IndexError, ValueError):
+		return None
+
+
+class BcryptBackend(object):
+	# Module-level functions so they can be shipped to a process pool.
+	hash = staticmethod(bcrypt_hash)
+	check = staticmethod(bcrypt_check)
+	cost = staticmethod(bcrypt_cost)
+
+
+class _HasherState(object):
+	def __init__(self, backend, cost, executor, workers, max_pending):
+		self.backend = backend
+		self.cost = cost
+		self.kind = executor
+		self.workers = workers
+		self._pending = threading.BoundedSemaphore(max_pending)
+		self._executor = None
+		self._lock = threading.Lock()
+
+	@property
+	def executor(self):
+		if self._executor is None and self.kind != 'inline':
+			with self._lock:
+				if self._executor is None:
+					pool = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+					self._executor = pool(max_workers=self.workers)
+		return self._executor
+
+	def run(self, fn, *args):
+		started = time.perf_counter()
+		try:
+			if self.kind == 'inline':
+				return fn(*args)
+			# The calling request still waits for the result; the pool caps
+			# how many hashes run at once, and the semaphore bounds how many
+			# wait, so a burst of logins queues here instead of piling
+			# unbounded jobs onto the pool.
+			with self._pending:
+				return self.executor.submit(fn, *args).result()
+		finally:
+			add_timing('bcrypt_time', time.perf_counter() - started)
+
+	def shutdown(self):
+		if self._executor is not None:
+			self._executor.shutdown(wait=True)
+			self._executor = None
+
+
+class PasswordHasher(object):
+	"""Hashes and verifies passwords on a bounded worker pool.
+
+	This limits concurrency; it does not make hashing asynchronous. The
+	request thread blocks until its hash is done, but no more than
+	``PASSWORD_HASH_WORKERS`` bcrypt runs compete for the CPUs at once.
+
+	``PASSWORD_HASH_EXECUTOR`` picks ``'thread'`` (bcrypt releases the GIL),
+	``'process'`` or ``'inline'``; ``BCRYPT_LOG_ROUNDS`` sets the cost.
+	"""
+
+	def __init__(self, app=None, backend=BcryptBackend):
+		self.backend = backend
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		workers = app.config['PASSWORD_HASH_WORKERS'] or os.cpu_count() or 1
+		app.extensions['password_hasher'] = _HasherState(
+			self.backend, app.config['BCRYPT_LOG_ROUNDS'],
+			app.config['PASSWORD_HASH_EXECUTOR'], workers,
+			app.config['PASSWORD_HASH_MAX_PENDING'] or workers * 4)
+
+	@property
+	def _state(self):
+		return current_app.extensions['password_hasher']
+
+	def hash(self, password):
+		if not password:
+			raise ValueError('Password must be non-empty.')
+		state = self._state
+		return state.run(state.backend.hash, password, state.cost)
+
+	def verify(self, pw_hash, password):
+		state = self._state
+		return state.run(state.backend.check, pw_hash, password)
+
+	def needs_rehash(self, pw_hash):
+		return self._state.backend.cost(pw_hash) != self._state.cost
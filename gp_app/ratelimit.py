@@ -0,0 +1,157 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(rate):
+	"""Turn ``'10/minute'`` into ``(capacity, refill per second)``."""
+	count, _, period = rate.partition('/')
+	seconds = _PERIODS[period.strip().rstrip('s')]
+	count = int(count)
+	return count, count / float(seconds)
+
+
+def _refill(tokens, updated, now, capacity, rate):
+	if tokens is None:
+		return float(capacity)
+	return min(float(capacity), tokens + (now - updated) * rate)
+
+
+class MemoryBackend(object):
+	# Buckets for one process. Least recently used keys are dropped past
+	# max_keys so random emails cannot grow the dict forever.
+	def __init__(self, max_keys=100000, clock=time.time):
+		self.max_keys = max_keys
+		self.clock = clock
+		self._buckets = OrderedDict()
+		self._lock = threading.Lock()
+
+	def take(self, key, capacity, rate):
+		now = self.clock()
+		with self._lock:
+			tokens, updated = self._buckets.pop(key, (None, now))
+			tokens = _refill(tokens, updated, now, capacity, rate)
+			allowed = tokens >= 1
+			if allowed:
+				tokens -= 1
+			self._buckets[key] = (tokens, now)
+			while len(self._buckets) > self.max_keys:
+				self._buckets.popitem(last=False)
+		return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class SQLiteBackend(object):
+	# Buckets in a small SQLite file shared by every worker process. Kept
+	# apart from the application database so limiting never waits on it.
+	def __init__(self, path, clock=time.time):
+		self.path = path
+		self.clock = clock
+		self._local = threading.local()
+		with self._connect() as conn:
+			conn.execute('CREATE TABLE IF NOT EXISTS rate_limit '
+			             '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+	def _connect(self):
+		conn = getattr(self._local, 'conn', None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+			conn.execute('PRAGMA journal_mode=WAL')
+			self._local.conn = conn
+		return conn
+
+	def take(self, key, capacity, rate):
+		now = self.clock()
+		conn = self._connect()
+		conn.execute('BEGIN IMMEDIATE')
+		try:
+			row = conn.execute('SELECT tokens, updated FROM rate_limit WHERE key = ?',
+			                   (key,)).fetchone()
+			tokens = _refill(row[0] if row else None, row[1] if row else now,
+			                 now, capacity, rate)
+			allowed = tokens >= 1
+			if allowed:
+				tokens -= 1
+			conn.execute('INSERT OR REPLACE INTO rate_limit (key, tokens, updated) '
+			             'VALUES (?, ?, ?)', (key, tokens, now))
+			conn.execute('COMMIT')
+		except Exception:
+			conn.execute('ROLLBACK')
+			raise
+		return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+def client_ip():
+	return 'ip:' + (request.remote_addr or 'unknown')
+
+
+def form_field(name):
+	def key():
+		value = request.form.get(name, '').strip().lower()
+		return f'{name}:{value}' if value else None
+	return key
+
+
+class RateLimiter(object):
+	"""Token-bucket limits declared on views with :meth:`limit`.
+
+	``RATELIMIT_BACKEND`` is ``'memory'``, ``'sqlite'`` (shared file at
+	``RATELIMIT_SQLITE_PATH``) or ``None`` to switch limiting off.
+	"""
+
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		kind = app.config['RATELIMIT_BACKEND']
+		if kind == 'memory':
+			backend = MemoryBackend(app.config['RATELIMIT_MEMORY_MAX_KEYS'])
+		elif kind == 'sqlite':
+			backend = SQLiteBackend(app.config['RATELIMIT_SQLITE_PATH'] or
+			                        os.path.join(app.instance_path, 'ratelimit.sqlite'))
+		elif kind is None:
+			backend = None
+		else:
+			raise ValueError(f'Unknown RATELIMIT_BACKEND {kind!r}')
+		app.extensions['rate_limiter'] = backend
+
+	def hit(self, scope, rate, keys):
+		backend = current_app.extensions['rate_limiter']
+		if backend is None:
+			return
+		capacity, refill = parse_rate(rate)
+		retry_after = 0
+		for key in keys:
+			if key is None:
+				continue
+			allowed, wait = backend.take(f'{scope}:{key}', capacity, refill)
+			if not allowed:
+				retry_after = max(retry_after, wait)
+		if retry_after:
+			error = TooManyRequests()
+			error.retry_after = int(retry_after) + 1
+			raise error
+
+	def limit(self, config_key, by=(client_ip,), methods=('POST',)):
+		"""Check the rate named by ``config_key`` before the view runs.
+
+		Each callable in ``by`` yields a bucket key (or ``None`` to skip);
+		the request is rejected with 429 if any of its buckets is empty.
+		"""
+		def decorator(view):
+			@functools.wraps(view)
+			def wrapped_view(**kwargs):
+				if request.method in methods:
+					self.hit(view.__name__, current_app.config[config_key],
+					         [key() for key in by])
+				return view(**kwargs)
+
+			return wrapped_view
+		return decorator
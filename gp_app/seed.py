@@ -0,0 +1,139 @@
+import itertools
+import random
+import time
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+from . import db, passwords
+from .models import User, UserType, user_types
+
+
+def parse_distribution(value):
+	"""Turn ``'0:1,1:6,2:2'`` into ``([0, 1, 2], [1.0, 6.0, 2.0])``.
+
+	Keys are a number of user types per user, values their relative weight.
+	"""
+	counts, weights = [], []
+	try:
+		for part in value.split(','):
+			count, _, weight = part.partition(':')
+			counts.append(int(count))
+			weights.append(float(weight or 1))
+	except ValueError:
+		raise ValueError(f'expected count:weight pairs, got {value!r}')
+	if min(counts) < 0 or min(weights) < 0 or not sum(weights):
+		raise ValueError('counts and weights must be non-negative, with some weight')
+	return counts, weights
+
+
+def _distribution_option(ctx, param, value):
+	try:
+		return parse_distribution(value)
+	except ValueError as e:
+		raise click.BadParameter(str(e))
+
+
+def ensure_user_types(count, prefix):
+	"""Return the ids of ``count`` seed user types, creating missing ones."""
+	names = [f'{prefix}{i:03d}' for i in range(count)]
+	existing = dict(db.session.query(UserType.name, UserType.id)
+	                .filter(UserType.name.in_(names))) if names else {}
+	missing = [name for name in names if name not in existing]
+	if missing:
+		db.session.execute(UserType.__table__.insert(), [{'name': name} for name in missing])
+		existing = dict(db.session.query(UserType.name, UserType.id)
+		                .filter(UserType.name.in_(names)))
+	return [existing[name] for name in names]
+
+
+class RoleSampler(object):
+	# Type popularity follows a Zipf-like curve: the type at rank r is
+	# picked with weight 1 / r**skew, so skew=0 spreads users evenly.
+	def __init__(self, type_ids, counts, weights, skew, rng):
+		self.type_ids = type_ids
+		self.counts = [min(count, len(type_ids)) for count in counts]
+		self.weights = weights
+		self.type_weights = list(itertools.accumulate(
+			1 / (rank ** skew) for rank in range(1, len(type_ids) + 1)))
+		self.rng = rng
+
+	def sample(self, users):
+		"""Return a set of type ids for each of ``users`` users."""
+		pick = self.rng.choices
+		roles = []
+		for count in pick(self.counts, self.weights, k=users):
+			if not count:
+				roles.append(set())
+				continue
+			chosen = set(pick(self.type_ids, cum_weights=self.type_weights, k=count))
+			while len(chosen) < count:
+				chosen.update(pick(self.type_ids, cum_weights=self.type_weights,
+				                   k=count - len(chosen)))
+			roles.append(chosen)
+		return roles
+
+
+def seed_users(count, sampler, pw_hash, prefix, batch_size, progress=None):
+	"""Insert ``count`` users and their roles in batches; returns the roles written.
+
+	Every user gets the same ``pw_hash`` so no time is spent in bcrypt.
+	"""
+	start = db.session.query(func.max(User.id)).scalar() or 0
+	users_table = User.__table__
+	links = 0
+	for offset in range(0, count, batch_size):
+		numbers = range(start + offset + 1, start + min(offset + batch_size, count) + 1)
+		db.session.execute(users_table.insert(), [
+			{'username': f'{prefix}{n}', 'email': f'{prefix}{n}@example.com',
+			 'password': pw_hash} for n in numbers])
+		# Ids come from the database. Seeding is the only writer, so a
+		# batch's ids are consecutive from the id of its first user.
+		first_id = db.session.query(User.id).filter(
+			User.username == f'{prefix}{numbers[0]}').scalar()
+		ids = db.session.execute(select([users_table.c.id]).where(users_table.c.id >= first_id)
+		                         .order_by(users_table.c.id).limit(len(numbers)))
+		rows = [{'user_id': user_id, 'user_type_id': type_id}
+		        for (user_id,), chosen in zip(ids, sampler.sample(len(numbers)))
+		        for type_id in chosen]
+		if rows:
+			db.session.execute(user_types.insert(), rows)
+		db.session.commit()
+		links += len(rows)
+		if progress is not None:
+			progress(offset + len(numbers), links)
+	return links
+
+
+@click.command('seed')
+@click.option('--users', 'user_count', default=1000, show_default=True, type=click.IntRange(0),
+              help='Users to create.')
+@click.option('--user-types', 'type_count', default=10, show_default=True,
+              type=click.IntRange(0), help='User types to create (or reuse).')
+@click.option('--roles-per-user', default='0:1,1:6,2:2,3:1', show_default=True,
+              callback=_distribution_option,
+              help='Weighted number of user types per user, as count:weight pairs.')
+@click.option('--skew', default=1.0, show_default=True, type=click.FloatRange(0),
+              help='Zipf exponent for how popular each user type is; 0 is uniform.')
+@click.option('--prefix', default='seed', show_default=True,
+              help='Username prefix; types are named <prefix>-type-NNN.')
+@click.option('--password', default='password', show_default=True,
+              help='Password shared by every seeded user.')
+@click.option('--batch-size', default=10000, show_default=True, type=click.IntRange(1))
+@click.option('--random-seed', type=int, help='Make the role assignment reproducible.')
+@with_appcontext
+def seed_command(user_count, type_count, roles_per_user, skew, prefix, password, batch_size,
+                 random_seed):
+	"""Fill the database with synthetic users and user types."""
+	started = time.perf_counter()
+	type_ids = ensure_user_types(type_count, f'{prefix}-type-')
+	db.session.commit()
+	counts, weights = roles_per_user
+	sampler = RoleSampler(type_ids, counts, weights, skew, random.Random(random_seed))
+
+	def progress(done, links):
+		click.echo(f'{done}/{user_count} users, {links} roles')
+
+	links = seed_users(user_count, sampler, passwords.hash(password), prefix, batch_size,
+	                   progress)
+	click.echo(f'Seeded {user_count} users, {len(type_ids)} user types and {links} roles '
+	           f'in {time.perf_counter() - started:.1f}s.')
@@ -6,3 +6,14 @@ $('#deleteModal').on('show.bs.modal', function (event) {
   modal.find('.modal-title').text(delete_header)
   modal.find('.modal-form-action').attr('action', action)
 })
+
+$(document).ready(function() {
+  // https://select2.github.io/examples.html
+  $("select").select2({});
+})
+
+// Listing rows share one CSRF token instead of rendering one per form.
+$(document).on('submit', 'form.js-shared-csrf', function () {
+  var token = $('#shared-csrf-token').val()
+  $('<input type="hidden" name="csrf_token">').val(token).appendTo(this)
+})
@@ -0,0 +1,100 @@
+from sqlalchemy import select, exists, and_
+from .. import db
+from ..models import User, UserType, user_types
+
+ACTIONS = ('assign', 'revoke', 'replace', 'delete')
+
+# Stays under SQLite's default limit of 999 bound parameters per statement.
+_IDS_PER_STATEMENT = 500
+
+
+class UnknownUserTypes(ValueError):
+	def __init__(self, names):
+		super().__init__('Unknown user types: ' + ', '.join(names))
+		self.names = names
+
+
+def _chunks(ids):
+	ids = sorted(set(ids))
+	for i in range(0, len(ids), _IDS_PER_STATEMENT):
+		yield ids[i:i + _IDS_PER_STATEMENT]
+
+
+def resolve_user_types(names):
+	"""Map user type names to ids with a single ``IN`` query."""
+	names = set(names)
+	if not names:
+		return {}
+	found = dict(db.session.query(UserType.name, UserType.id).filter(UserType.name.in_(names)))
+	missing = sorted(names - set(found))
+	if missing:
+		raise UnknownUserTypes(missing)
+	return found
+
+
+def assign_user_types(user_ids, type_ids):
+	# INSERT ... SELECT over existing users x types, skipping pairs that are
+	# already linked: the (user_type_id, user_id) primary key would reject
+	# them and fail the whole statement.
+	type_ids = list(type_ids)
+	if not type_ids:
+		return 0
+	count = 0
+	for chunk in _chunks(user_ids):
+		pairs = select([User.id, UserType.id]).where(and_(
+			User.id.in_(chunk),
+			UserType.id.in_(type_ids),
+			~exists().where(and_(user_types.c.user_id == User.id,
+			                     user_types.c.user_type_id == UserType.id))))
+		count += db.session.execute(
+			user_types.insert().from_select(['user_id', 'user_type_id'], pairs)).rowcount
+	return count
+
+
+def revoke_user_types(user_ids, type_ids):
+	type_ids = list(type_ids)
+	if not type_ids:
+		return 0
+	count = 0
+	for chunk in _chunks(user_ids):
+		count += db.session.execute(user_types.delete().where(and_(
+			user_types.c.user_id.in_(chunk),
+			user_types.c.user_type_id.in_(type_ids)))).rowcount
+	return count
+
+
+def replace_user_types(user_ids, type_ids):
+	type_ids = list(type_ids)
+	count = 0
+	for chunk in _chunks(user_ids):
+		condition = user_types.c.user_id.in_(chunk)
+		if type_ids:
+			condition = and_(condition, ~user_types.c.user_type_id.in_(type_ids))
+		count += db.session.execute(user_types.delete().where(condition)).rowcount
+	return count + assign_user_types(user_ids, type_ids)
+
+
+def delete_users(user_ids):
+	count = 0
+	for chunk in _chunks(user_ids):
+		db.session.execute(user_types.delete().where(user_types.c.user_id.in_(chunk)))
+		count += User.query.filter(User.id.in_(chunk)).delete(synchronize_session=False)
+	return count
+
+
+def apply(action, user_ids, type_names=()):
+	"""Run one bulk ``action`` in the current transaction.
+
+	Returns the number of association rows (or users, for ``'delete'``)
+	written. The caller commits.
+	"""
+	if action not in ACTIONS:
+		raise ValueError(f'Unknown action {action!r}')
+	if action == 'delete':
+		return delete_users(user_ids)
+	type_ids = resolve_user_types(type_names).values()
+	if action == 'assign':
+		return assign_user_types(user_ids, type_ids)
+	if action == 'revoke':
+		return revoke_user_types(user_ids, type_ids)
+	return replace_user_types(user_ids, type_ids)
@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import click
+from flask import current_app, Response, stream_with_context
+from flask.cli import with_appcontext
+from .. import db
+from ..models import User
+from .utils import ChunkedRows, buffer_output
+
+FIELDS = ('id', 'username', 'email', 'user_types')
+
+
+def _with_type_names(users):
+	type_names = User.type_names_by_user([user.id for user in users])
+	return [(user.id, user.username, user.email, type_names[user.id]) for user in users]
+
+
+def export_rows(size):
+	"""Every user with their type names, read ``size`` rows per fetch."""
+	query = db.session.query(User.id, User.username, User.email).order_by(User.id)
+	return ChunkedRows(query, size, prepare=_with_type_names)
+
+
+def csv_lines(rows):
+	# One row per user, user types comma-separated. There is no password
+	# column, so import-users rejects these rows; this is a report, not a
+	# backup.
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(FIELDS)
+	yield buffer.getvalue()
+	buffer.seek(0)
+	buffer.truncate()
+	for id, username, email, type_names in rows:
+		writer.writerow((id, username, email, ','.join(type_names)))
+		yield buffer.getvalue()
+		buffer.seek(0)
+		buffer.truncate()
+
+
+def ndjson_lines(rows):
+	for row in rows:
+		yield json.dumps(dict(zip(FIELDS, row))) + '\n'
+
+
+FORMATS = {
+	'csv': (csv_lines, 'text/csv'),
+	'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+def export_response(fmt):
+	lines, mimetype = FORMATS[fmt]
+	rows = export_rows(current_app.config['STREAM_ROWS_PER_FETCH'])
+	body = buffer_output(lines(rows), rows, current_app.config['STREAM_CHUNK_SIZE'])
+	response = Response(stream_with_context(body), mimetype=mimetype)
+	response.headers['Content-Disposition'] = f'attachment; filename=users.{fmt}'
+	response.headers['Cache-Control'] = 'no-store'
+	return response
+
+
+@click.command('export-users')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='ndjson',
+              show_default=True)
+@with_appcontext
+def export_users_command(output, fmt):
+	"""Write every user and their user types to OUTPUT (default stdout)."""
+	lines, _ = FORMATS[fmt]
+	rows = export_rows(current_app.config['STREAM_ROWS_PER_FETCH'])
+	for line in lines(rows):
+		output.write(line)
@@ -1,9 +1,9 @@
-from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectMultipleField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
 from flask_login import current_user
-from ..models import User
+from ..csrf import MaskedForm
+from ..models import User, UserType, PERMISSIONS
 
 class Select2MultipleField(SelectMultipleField):
 
@@ -17,7 +17,7 @@ class Select2MultipleField(SelectMultipleField):
         else:
             self.data = ""
 
-class RegistrationForm(FlaskForm):
+class RegistrationForm(MaskedForm):
 	username = StringField('Username', 
 							validators=[DataRequired(), Length(min=2, max=20)])
 	email = StringField('Email', validators=[DataRequired(), Email()])
@@ -32,19 +32,18 @@ class RegistrationForm(FlaskForm):
 			raise ValidationError('That username is taken. Please choose a different one.')
 
 	def validate_email(self, email):
-		user = User.query.filter_by(email=email.data).first()
-		if user:
+		if User.by_email(email.data):
 			raise ValidationError('That email is taken. Please choose a different one.')
 
 
-class LoginForm(FlaskForm):
+class LoginForm(MaskedForm):
 	email = StringField('Email', validators=[DataRequired(), Email()])
 	password = PasswordField('Password', validators=[DataRequired()])
 	remember = BooleanField('Remember Me')
 	submit = SubmitField('Login')
 
 
-class UpdateAccountForm(FlaskForm):
+class UpdateAccountForm(MaskedForm):
 	username = StringField('Username', 
 							validators=[DataRequired(), Length(min=2, max=20)])
 	email = StringField('Email', validators=[DataRequired(), Email()])
@@ -57,35 +56,44 @@ class UpdateAccountForm(FlaskForm):
 				raise ValidationError('That username is taken. Please choose a different one.')
 
 	def validate_email(self, email):
-		if email.data != current_user.email:
-			user = User.query.filter_by(email=email.data).first()
-			if user:
-				raise ValidationError('That email is taken. Please choose a different one.')
+		# Changing only the case of one's own address is allowed.
+		user = User.by_email(email.data)
+		if user and user.id != current_user.id:
+			raise ValidationError('That email is taken. Please choose a different one.')
 
 
-class RequestResetForm(FlaskForm):
+class RequestResetForm(MaskedForm):
 	email = StringField('Email', validators=[DataRequired(), Email()])
 	submit = SubmitField('Request Password Reset')
 
 	def validate_email(self, email):
-		user = User.query.filter_by(email=email.data).first()
+		user = User.by_email(email.data)
 		if user is None:
 			raise ValidationError('There is no account with that email. You must register first.')
 
 
-class ResetPasswordForm(FlaskForm):
+class ResetPasswordForm(MaskedForm):
 	password = PasswordField('Password', validators=[DataRequired(), Length(min=5)])
 	confirm_password = PasswordField('Confirm Password', 
 									validators=[DataRequired(), Length(min=5), EqualTo('password')])
 	submit = SubmitField('Reset Password')
 
 
-class UserTypeForm(FlaskForm):
+class UserTypeForm(MaskedForm):
 	name = StringField('User Type', validators=[DataRequired(), Length(max=20)])
+	permissions = SelectMultipleField('Permissions',
+							choices=[(permission, permission) for permission in PERMISSIONS])
 	submit = SubmitField('Submit')
+	# Set to the type being edited, so keeping its name isn't a clash.
+	user_type = None
+
+	def validate_name(self, name):
+		user_type = UserType.query.filter_by(name=name.data).first()
+		if user_type and user_type is not self.user_type:
+			raise ValidationError('That user type already exists. Please choose a different name.')
 
 
-class AssignUserType(FlaskForm):
+class AssignUserType(MaskedForm):
     user_types = Select2MultipleField(u'', [],
             choices=[],
             description=u"",
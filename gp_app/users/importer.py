@@ -0,0 +1,188 @@
+import csv
+import itertools
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+from wtforms import Form, StringField
+from wtforms.validators import Email, Length
+from .. import db
+from ..models import User, UserType, user_types
+from ..passwords import bcrypt_hash
+
+# The same limits RegistrationForm enforces.
+_USERNAME_LENGTH = (2, 20)
+_EMAIL_LENGTH = 120
+_PASSWORD_MIN_LENGTH = 5
+
+
+class _EmailForm(Form):
+	# The forms' own validator, so the importer accepts what the UI accepts.
+	email = StringField(validators=[Length(max=_EMAIL_LENGTH), Email()])
+
+Record = namedtuple('Record', ['line', 'username', 'email', 'password', 'type_names'])
+
+
+def read_rows(stream, fmt):
+	"""Yield ``(line number, row)`` pairs without reading ahead.
+
+	``row`` is a dict, or an error message for a line that didn't parse.
+	"""
+	if fmt == 'csv':
+		reader = csv.DictReader(stream)
+		for row in reader:
+			yield reader.line_num, row
+		return
+	for number, line in enumerate(stream, 1):
+		if not line.strip():
+			continue
+		try:
+			yield number, json.loads(line)
+		except ValueError as e:
+			yield number, f'invalid JSON: {e}'
+
+
+def to_record(line, row):
+	"""Return ``(Record, None)`` or ``(None, reason)`` for one input row."""
+	if isinstance(row, str):
+		return None, row
+	if not isinstance(row, dict):
+		return None, 'expected an object'
+	username = str(row.get('username') or '').strip()
+	email = str(row.get('email') or '').strip()
+	password = row.get('password') or ''
+	type_names = row.get('user_types') or []
+	if isinstance(type_names, str):
+		type_names = type_names.split(',')
+	type_names = sorted({str(name).strip() for name in type_names if str(name).strip()})
+
+	if not _USERNAME_LENGTH[0] <= len(username) <= _USERNAME_LENGTH[1]:
+		return None, 'username must be between %d and %d characters' % _USERNAME_LENGTH
+	if not _EmailForm(data={'email': email}).validate():
+		return None, 'invalid email address'
+	if not isinstance(password, str) or len(password) < _PASSWORD_MIN_LENGTH:
+		return None, f'password must be at least {_PASSWORD_MIN_LENGTH} characters'
+	return Record(line, username, email, password, type_names), None
+
+
+def _existing(column, values):
+	if not values:
+		return set()
+	return {value for value, in db.session.query(column).filter(column.in_(values))}
+
+
+def import_chunk(rows, executor, rounds):
+	"""Validate, hash and insert one chunk of rows, committing it.
+
+	Returns ``(imported, rejected)`` with ``rejected`` a list of
+	``(line, reason)``. Uniqueness is checked with one query per column
+	for the whole chunk. If the insert still hits a constraint, e.g. a
+	user registered meanwhile, the chunk is rolled back and all its rows
+	are rejected.
+	"""
+	rejected = []
+	records = []
+	for line, row in rows:
+		record, reason = to_record(line, row)
+		if reason:
+			rejected.append((line, reason))
+		else:
+			records.append(record)
+
+	taken_usernames = _existing(User.username, [r.username for r in records])
+	# Emails are unique regardless of case, see ix_user_email_lower.
+	taken_emails = _existing(db.func.lower(User.email), [r.email.lower() for r in records])
+	type_names = {name for r in records for name in r.type_names}
+	type_ids = dict(db.session.query(UserType.name, UserType.id)
+	                .filter(UserType.name.in_(type_names))) if type_names else {}
+
+	accepted = []
+	for record in records:
+		unknown = [name for name in record.type_names if name not in type_ids]
+		if record.username in taken_usernames:
+			rejected.append((record.line, f'username {record.username!r} is taken'))
+		elif record.email.lower() in taken_emails:
+			rejected.append((record.line, f'email {record.email!r} is taken'))
+		elif unknown:
+			rejected.append((record.line, 'unknown user types: ' + ', '.join(unknown)))
+		else:
+			# Later rows in the chunk can't reuse what this one claims.
+			taken_usernames.add(record.username)
+			taken_emails.add(record.email.lower())
+			accepted.append(record)
+
+	if accepted:
+		hashes = executor.map(bcrypt_hash, [r.password for r in accepted],
+		                      itertools.repeat(rounds), chunksize=16)
+		try:
+			_insert(accepted, hashes, type_ids)
+		except IntegrityError as e:
+			db.session.rollback()
+			reason = f'not imported, the chunk conflicts with existing data: {e.orig}'
+			rejected.extend((record.line, reason) for record in accepted)
+			accepted = []
+	rejected.sort()
+	return len(accepted), rejected
+
+
+def _insert(records, hashes, type_ids):
+	db.session.bulk_insert_mappings(User, [
+		{'username': r.username, 'email': r.email, 'password': pw_hash}
+		for r, pw_hash in zip(records, hashes)])
+
+	with_types = [r for r in records if r.type_names]
+	if with_types:
+		ids = dict(db.session.query(User.username, User.id)
+		           .filter(User.username.in_([r.username for r in with_types])))
+		db.session.execute(user_types.insert(), [
+			{'user_id': ids[r.username], 'user_type_id': type_ids[name]}
+			for r in with_types for name in r.type_names])
+	db.session.commit()
+
+
+def _format_for(source, fmt):
+	if fmt:
+		return fmt
+	name = getattr(source, 'name', '')
+	if name.endswith('.csv'):
+		return 'csv'
+	if name.endswith(('.ndjson', '.jsonl')):
+		return 'ndjson'
+	raise click.UsageError('Cannot tell the format from the file name; pass --format.')
+
+
+@click.command('import-users')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help='Input format; defaults to the file extension.')
+@click.option('--chunk-size', default=500, show_default=True, type=click.IntRange(1, 500),
+              help='Rows validated, hashed and committed together.')
+@click.option('--workers', type=click.IntRange(1),
+              help='Password hashing processes; defaults to the CPU count.')
+@with_appcontext
+def import_users_command(source, fmt, chunk_size, workers):
+	"""Import users from a CSV or NDJSON file ('-' for stdin).
+
+	Each row has username, email and password, plus optional user_types
+	(comma-separated in CSV, a list in NDJSON). Rejected rows are reported
+	on stderr and skipped; every chunk is committed as it completes.
+	"""
+	rows = read_rows(source, _format_for(source, fmt))
+	rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+	imported = rejected = 0
+	with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+		while True:
+			chunk = list(itertools.islice(rows, chunk_size))
+			if not chunk:
+				break
+			count, rejects = import_chunk(chunk, executor, rounds)
+			imported += count
+			rejected += len(rejects)
+			for line, reason in rejects:
+				click.echo(f'line {line}: {reason}', err=True)
+			click.echo(f'line {chunk[-1][0]}: imported {imported}, rejected {rejected}')
+	click.echo(f'Done: imported {imported}, rejected {rejected}.')
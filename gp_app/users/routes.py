@@ -1,33 +1,28 @@
-import functools
-from flask import render_template, url_for, flash, redirect, request, Blueprint, abort
+from flask import (render_template, url_for, flash, redirect, request, Blueprint, abort,
+                   current_app, jsonify)
 from flask_login import login_user, current_user, logout_user, login_required
-from .. import db, bcrypt
-from ..models import User, UserType
+from .. import db, passwords, identity_cache, limiter
+from ..csrf import masked_csrf
+from ..models import User, UserType, user_types as user_type_members, MANAGE_USERS, MANAGE_USER_TYPES
 from .forms import (RegistrationForm, LoginForm, UpdateAccountForm,
                                    RequestResetForm, ResetPasswordForm, UserTypeForm,
                                    AssignUserType)
-from .utils import send_reset_email
+from .utils import (send_reset_email, keyset_paginate, escape_like, permission_required,
+                    ChunkedRows, stream_template, user_rows, check_csrf_header)
+from . import bulk, export
+from ..ratelimit import client_ip, form_field
 
 users = Blueprint('users', __name__)
 
 
-def superuser_required(view):
-	@functools.wraps(view)
-	def wrapped_view(**kwargs):
-		if current_user.is_superuser():
-			return view(**kwargs)
-
-		abort(403)
-
-	return wrapped_view
-
 @users.route("/register", methods=['GET', 'POST'])
+@limiter.limit('RATELIMIT_REGISTER', by=(client_ip, form_field('email')))
 def register():
 	if current_user.is_authenticated:
 		return redirect(url_for('main.home'))
 	form = RegistrationForm()
 	if form.validate_on_submit():
-		hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+		hashed_password = passwords.hash(form.password.data)
 		user = User(username=form.username.data, email=form.email.data, password=hashed_password)
 		db.session.add(user)
 		db.session.commit()
@@ -37,13 +32,17 @@ def register():
 
 
 @users.route("/login", methods=['GET', 'POST'])
+@limiter.limit('RATELIMIT_LOGIN', by=(client_ip, form_field('email')))
 def login():
 	if current_user.is_authenticated:
 		return redirect(url_for('main.home'))
 	form = LoginForm()
 	if form.validate_on_submit():
-		user = User.query.filter_by(email=form.email.data).first()
-		if user and bcrypt.check_password_hash(user.password, form.password.data):
+		user = User.by_email(form.email.data)
+		if user and passwords.verify(user.password, form.password.data):
+			if passwords.needs_rehash(user.password):
+				user.password = passwords.hash(form.password.data)
+				db.session.commit()
 			login_user(user, remember=form.remember.data)
 			next_page = request.args.get('next')
 			return redirect(next_page) if next_page else redirect(url_for('main.home'))
@@ -63,9 +62,11 @@ def logout():
 def account():
 	form = UpdateAccountForm()
 	if form.validate_on_submit():
-		current_user.username = form.username.data
-		current_user.email = form.email.data
+		user = User.query.get(current_user.id)
+		user.username = form.username.data
+		user.email = form.email.data
 		db.session.commit()
+		identity_cache.invalidate(user.id)
 		flash('Your account has been updated!', 'success')
 		return redirect(url_for('users.account'))
 	elif request.method == 'GET':
@@ -75,12 +76,13 @@ def account():
 	return render_template('account.html', title='Account', form=form)
 
 @users.route("/reset_password", methods=['GET', 'POST'])
+@limiter.limit('RATELIMIT_RESET_PASSWORD', by=(client_ip, form_field('email')))
 def reset_request():
 	if current_user.is_authenticated:
 		return redirect(url_for('main.home'))
 	form = RequestResetForm()
 	if form.validate_on_submit():
-		user = User.query.filter_by(email=form.email.data).first()
+		user = User.by_email(form.email.data)
 		send_reset_email(user)
 		flash('An email has been sent with instructions to reset your password', 'info')
 		return redirect(url_for('users.login'))
@@ -88,6 +90,7 @@ def reset_request():
 
 
 @users.route("/reset_password/<token>", methods=['GET', 'POST'])
+@limiter.limit('RATELIMIT_RESET_PASSWORD')
 def reset_token(token):
 	if current_user.is_authenticated:
 		return redirect(url_for('main.home'))
@@ -97,29 +100,34 @@ def reset_token(token):
 		return redirect(url_for('users.reset_request'))
 	form = ResetPasswordForm()
 	if form.validate_on_submit():
-		hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
-		user.password = hashed_password
+		user.password = passwords.hash(form.password.data)
 		db.session.commit()
+		identity_cache.invalidate(user.id)
 		flash('Your password has been updated! You are now able to log in.', 'success')
 		return redirect(url_for('users.login'))
 	return render_template('reset_token.html', title='Reset Password', form=form)
 
 @users.route("/user_types")
 @login_required
-@superuser_required
+@permission_required(MANAGE_USER_TYPES)
 def user_types():
-	user_types = UserType.query.all()
-	return render_template('user_types.html', title='User Types', user_types=user_types)
+	# Member counts come from one GROUP BY over the association table,
+	# not from loading each type's users.
+	rows = db.session.query(UserType, db.func.count(user_type_members.c.user_id)) \
+		.outerjoin(user_type_members, user_type_members.c.user_type_id == UserType.id) \
+		.group_by(UserType.id).order_by(UserType.id) \
+		.options(db.selectinload(UserType.grants))
+	return render_template('user_types.html', title='User Types', user_types=rows.all())
 
 
 @users.route("/user_type/new", methods=['GET', 'POST'])
 @login_required
-@superuser_required
+@permission_required(MANAGE_USER_TYPES)
 def new_user_type():
 	form = UserTypeForm()
 	if form.validate_on_submit():
 		flash('A new user type has been added!', 'success')
-		user_type = UserType(name=form.name.data)
+		user_type = UserType(name=form.name.data, permissions=form.permissions.data)
 		db.session.add(user_type)
 		db.session.commit()
 		return redirect(url_for('users.user_types'))
@@ -128,28 +136,33 @@ def new_user_type():
 
 @users.route("/user_type/<int:user_type_id>/delete", methods=['POST'])
 @login_required
-@superuser_required
+@permission_required(MANAGE_USER_TYPES)
 def delete_user_type(user_type_id):
 	user_type = UserType.query.get_or_404(user_type_id)
 	db.session.delete(user_type)
 	db.session.commit()
+	identity_cache.clear()
 	flash('The user type has been deleted!', 'success')
 	return redirect(url_for('users.user_types'))
 
 
 @users.route("/user_type/<int:user_type_id>/update", methods=['GET', 'POST'])
 @login_required
-@superuser_required
+@permission_required(MANAGE_USER_TYPES)
 def update_user_type(user_type_id):
 	user_type = UserType.query.get_or_404(user_type_id)
 	form = UserTypeForm()
+	form.user_type = user_type
 	if form.validate_on_submit():
 		user_type.name = form.name.data
+		user_type.permissions = form.permissions.data
 		db.session.commit()
+		identity_cache.clear()
 		flash('Your user type has been updated!', 'success')
 		return redirect(url_for('users.user_types'))
 	elif request.method == "GET":
 		form.name.data = user_type.name
+		form.permissions.data = user_type.permissions
 	return render_template('add_user_type.html', title='Update User Type', form=form, 
 							legend="Update User Type")
 
@@ -157,51 +170,134 @@ def update_user_type(user_type_id):
 
 @users.route("/users", methods=['GET'])
 @login_required
-@superuser_required
+@permission_required(MANAGE_USERS)
 def all_users():
-	user_types = UserType.query.all()
-	user_types = [(user_type.name, user_type.name) for user_type in user_types]
-
-	all_users = User.query.all()
-	user_forms = []
-	form = AssignUserType()
-
-	for user in all_users:
-		form = AssignUserType()
-
-		uts = user.user_types
-		uts = [user_type.name for user_type in uts]
+	q = request.args.get('q', '').strip()
+	user_type = request.args.get('user_type', '').strip()
+	per_page = request.args.get('per_page', current_app.config['USERS_PER_PAGE'], type=int)
+	per_page = max(1, min(per_page, current_app.config['USERS_MAX_PER_PAGE']))
+
+	# Only the columns the listing shows; password hashes never leave the db.
+	query = db.session.query(User.id, User.username)
+	if q:
+		pattern = '%' + escape_like(q) + '%'
+		query = query.filter(db.or_(User.username.ilike(pattern, escape='\\'),
+		                            User.email.ilike(pattern, escape='\\')))
+	if user_type:
+		# Each (user, type) pair is in user_types once, so the join adds no
+		# duplicate rows.
+		query = query.join(user_type_members, user_type_members.c.user_id == User.id) \
+			.join(UserType, UserType.id == user_type_members.c.user_type_id) \
+			.filter(UserType.name == user_type)
+
+	# Rows carry only each user's current types; the select offers the
+	# rest through users.user_type_lookup, and all rows share one CSRF
+	# token, so the page grows with the number of users only.
+	context = dict(title='All Users', q=q, user_type=user_type, per_page=per_page,
+	               shared_csrf=masked_csrf(), lookup_url=url_for('users.user_type_lookup'))
+
+	if request.args.get('stream', type=int):
+		# Every matching user, rendered as rows are read from the cursor.
+		rows = ChunkedRows(query.order_by(User.id), current_app.config['STREAM_ROWS_PER_FETCH'],
+		                   prepare=user_rows)
+		return stream_template('users.html', 'user_rows', user_rows=rows, page=None, **context)
+
+	page = keyset_paginate(query, User.id, per_page,
+	                       after=request.args.get('after', type=int),
+	                       before=request.args.get('before', type=int))
+	return render_template('users.html', user_rows=user_rows(page.items), page=page, **context)
+
+
+@users.route("/users/export")
+@login_required
+@permission_required(MANAGE_USERS)
+def export_users():
+	fmt = request.args.get('format', 'ndjson')
+	if fmt not in export.FORMATS:
+		abort(400)
+	return export.export_response(fmt)
 
-		form.user_types.data = uts
-		form.user_types.choices = user_types
-		form.user = user
-		user_forms.append(form)
 
-	return render_template('users.html', title='All Users', user_forms=user_forms)
+@users.route("/user_types/lookup")
+@login_required
+@permission_required(MANAGE_USERS)
+def user_type_lookup():
+	# select2's remote data protocol: ?q=<term>&page=<n> in,
+	# {"results": [{"id", "text"}], "pagination": {"more"}} out.
+	q = request.args.get('q', '').strip()
+	page = max(1, request.args.get('page', 1, type=int))
+	per_page = current_app.config['USER_TYPE_LOOKUP_PER_PAGE']
+
+	query = db.session.query(UserType.name)
+	if q:
+		query = query.filter(UserType.name.ilike(escape_like(q) + '%', escape='\\'))
+	names = [name for name, in query.order_by(UserType.name)
+	         .offset((page - 1) * per_page).limit(per_page + 1)]
+	return jsonify(results=[{'id': name, 'text': name} for name in names[:per_page]],
+	               pagination={'more': len(names) > per_page})
 
 
 @users.route("/users/<int:user_id>/update", methods=['POST'])
 @login_required
-@superuser_required
+@permission_required(MANAGE_USERS)
 def update_users(user_id):
 	form = AssignUserType()
 	if form.validate_on_submit():
-		user = User.query.filter_by(id=user_id).first()
-		user.user_types.clear()
-		for user_type in form.user_types.data.split(','):
-			ut = UserType.query.filter_by(name=user_type).first()
-			user.user_types.append(ut)
-
+		user = User.query.get_or_404(user_id)
+		names = [name for name in form.user_types.data.split(',') if name]
+		try:
+			bulk.apply('replace', [user.id], names)
+		except bulk.UnknownUserTypes as e:
+			flash(str(e), 'danger')
+			return redirect(url_for('users.all_users'))
 		db.session.commit()
+		identity_cache.invalidate(user.id)
 		flash(f"{user.username}'s user types have been updated!", 'success')
 	return redirect(url_for('users.all_users'))
 
+
+@users.route("/users/bulk", methods=['POST'])
+@login_required
+@permission_required(MANAGE_USERS)
+def bulk_users():
+	# JSON: {"action": "assign" | "revoke" | "replace" | "delete",
+	#        "user_ids": [...], "user_types": [...]}, all in one transaction.
+	csrf_error = check_csrf_header()
+	if csrf_error:
+		return jsonify(error=csrf_error), 400
+	payload = request.get_json(silent=True)
+	if not isinstance(payload, dict):
+		return jsonify(error='Expected a JSON object.'), 400
+	action = payload.get('action')
+	user_ids = payload.get('user_ids')
+	names = payload.get('user_types', [])
+	if action not in bulk.ACTIONS:
+		return jsonify(error=f"action must be one of {', '.join(bulk.ACTIONS)}."), 400
+	if not isinstance(user_ids, list) or not all(
+			isinstance(i, int) and not isinstance(i, bool) for i in user_ids):
+		return jsonify(error='user_ids must be a list of integers.'), 400
+	if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+		return jsonify(error='user_types must be a list of names.'), 400
+
+	try:
+		rows = bulk.apply(action, user_ids, names)
+	except bulk.UnknownUserTypes as e:
+		db.session.rollback()
+		return jsonify(error=str(e), unknown=e.names), 400
+	db.session.commit()
+	for user_id in set(user_ids):
+		identity_cache.invalidate(user_id)
+	# A delete's rows are the users that existed, not the ids sent.
+	affected = rows if action == 'delete' else len(set(user_ids))
+	return jsonify(action=action, users=affected, rows=rows)
+
 @users.route("/user/<int:user_id>/delete", methods=['POST'])
 @login_required
-@superuser_required
+@permission_required(MANAGE_USERS)
 def delete_user(user_id):
 	user = User.query.get_or_404(user_id)
 	db.session.delete(user)
 	db.session.commit()
+	identity_cache.invalidate(user_id)
 	flash('The user type has been deleted!', 'success')
 	return redirect(url_for('users.all_users'))
\ No newline at end of file
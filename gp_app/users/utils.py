@@ -1,18 +1,156 @@
 import os
-from flask import url_for
+import functools
+from collections import namedtuple
+from flask import (url_for, abort, current_app, get_flashed_messages, Response,
+                   stream_with_context, request)
+from flask_wtf.csrf import generate_csrf
+from wtforms.validators import ValidationError
+from flask_login import current_user
 from flask_mail import Message
-from .. import mail
+from ..csrf import validate_masked_csrf
+from ..mailqueue import enqueue
+from ..models import User
 
 def send_reset_email(user):
-	with mail.record_messages() as outbox:
-		token = user.get_reset_token()
-		msg = Message('Password Reset Request', 
-				sender='drewecherd@gmail.com', 
-				recipients=[user.email])
-		msg.body = f'''To reset your password visit the following link:
+	token = user.get_reset_token()
+	msg = Message('Password Reset Request', 
+			sender='drewecherd@gmail.com', 
+			recipients=[user.email])
+	msg.body = f'''To reset your password visit the following link:
 {url_for('users.reset_token', token=token, _external=True)}
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-		mail.send(msg)
-		return outbox
+	return enqueue(msg)
+
+
+def permission_required(*names):
+	def decorator(view):
+		@functools.wraps(view)
+		def wrapped_view(**kwargs):
+			for name in names:
+				if not current_user.has_permission(name):
+					abort(403)
+			return view(**kwargs)
+
+		return wrapped_view
+	return decorator
+
+
+def check_csrf_header():
+	"""Validate the ``X-CSRFToken`` header of a JSON request.
+
+	Returns an error message, or ``None`` if the token is good or CSRF
+	protection is switched off.
+	"""
+	if not current_app.config.get('WTF_CSRF_ENABLED', True):
+		return None
+	try:
+		validate_masked_csrf(request.headers.get('X-CSRFToken'))
+	except ValidationError as e:
+		return e.args[0]
+	return None
+
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'prev_before', 'next_after'])
+UserRow = namedtuple('UserRow', ['id', 'username', 'type_names'])
+
+def user_rows(users):
+	# One IN query for the role names of a whole page or chunk of users.
+	type_names = User.type_names_by_user([user.id for user in users])
+	return [UserRow(user.id, user.username, type_names[user.id]) for user in users]
+
+def escape_like(value):
+	return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def keyset_paginate(query, key, per_page, after=None, before=None):
+	# Seek on an indexed key instead of OFFSET so every page costs the same
+	# no matter how deep it is. One extra row tells us whether more follow.
+	if before is not None:
+		rows = query.filter(key < before).order_by(key.desc()).limit(per_page + 1).all()
+		has_more = len(rows) > per_page
+		rows = rows[:per_page][::-1]
+		prev_before = getattr(rows[0], key.key) if rows and has_more else None
+		next_after = getattr(rows[-1], key.key) if rows else None
+	else:
+		if after is not None:
+			query = query.filter(key > after)
+		rows = query.order_by(key).limit(per_page + 1).all()
+		has_more = len(rows) > per_page
+		rows = rows[:per_page]
+		prev_before = getattr(rows[0], key.key) if rows and after is not None else None
+		next_after = getattr(rows[-1], key.key) if rows and has_more else None
+	return KeysetPage(rows, prev_before, next_after)
+
+
+def iter_chunks(query, size):
+	# One cursor for the whole result; yield_per fetches `size` rows at a
+	# time and stream_results asks drivers that support it for a
+	# server-side cursor, so memory stays flat however many rows match.
+	chunk = []
+	for row in query.execution_options(stream_results=True).yield_per(size):
+		chunk.append(row)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+class ChunkedRows(object):
+	"""Rows of ``query`` read ``size`` at a time, optionally transformed
+	per chunk by ``prepare`` (e.g. to batch-load related data).
+
+	``pending`` is true whenever the next row has to come from the
+	database, which tells :func:`stream_template` to flush what it has.
+	"""
+
+	def __init__(self, query, size, prepare=None):
+		self.query = query
+		self.size = size
+		self.prepare = prepare
+		self.pending = True
+
+	def __iter__(self):
+		for chunk in iter_chunks(self.query, self.size):
+			if self.prepare is not None:
+				chunk = self.prepare(chunk)
+			self.pending = False
+			for i, row in enumerate(chunk, 1):
+				self.pending = i == len(chunk)
+				yield row
+		self.pending = True
+
+
+def buffer_output(pieces, rows, min_size):
+	# Join small pieces of output into writes of about min_size, flushing
+	# early whenever the next row of `rows` needs a database round trip.
+	buffered, size = [], 0
+	for piece in pieces:
+		buffered.append(piece)
+		size += len(piece)
+		if size >= min_size or rows.pending:
+			yield ''.join(buffered)
+			buffered, size = [], 0
+	if buffered:
+		yield ''.join(buffered)
+
+
+def stream_template(template_name, rows_var, **context):
+	"""Render ``template_name`` as a streamed response.
+
+	``context[rows_var]`` must be a :class:`ChunkedRows`. Output is sent in
+	pieces of ``STREAM_CHUNK_SIZE`` characters, and immediately whenever
+	the next row needs a database round trip, so the page header goes out
+	before the first query for rows runs.
+	"""
+	rows = context[rows_var]
+	app = current_app._get_current_object()
+	# Anything that writes to the session has to happen before the
+	# headers go out: pop flashes and create the CSRF token up front.
+	get_flashed_messages(with_categories=True)
+	generate_csrf()
+	app.update_template_context(context)
+	pieces = app.jinja_env.get_template(template_name).generate(context)
+	return Response(stream_with_context(
+		buffer_output(pieces, rows, app.config['STREAM_CHUNK_SIZE'])))
@@ -0,0 +1,25 @@
+"""index user_types by user
+
+Revision ID: 4f2c8a1d9e73
+Revises: b3d94f0e6a12
+Create Date: 2026-10-18 16:41:05.713902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2c8a1d9e73'
+down_revision = 'b3d94f0e6a12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The (user_type_id, user_id) primary key can't serve lookups by user.
+    op.create_index('ix_user_types_user_id', 'user_types', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_types_user_id', table_name='user_types')
@@ -0,0 +1,35 @@
+"""user type permissions
+
+Revision ID: 7c1e5a9d2b40
+Revises: 51a0a0eaea3c
+Create Date: 2026-10-18 09:12:40.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5a9d2b40'
+down_revision = '51a0a0eaea3c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_type_permission',
+    sa.Column('user_type_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=40), nullable=False),
+    sa.ForeignKeyConstraint(['user_type_id'], ['user_type.id'], ),
+    sa.PrimaryKeyConstraint('user_type_id', 'name')
+    )
+    # Keep existing SuperUser types working: they used to be recognised by name.
+    for permission in ('manage_users', 'manage_user_types'):
+        op.execute(
+            "INSERT INTO user_type_permission (user_type_id, name) "
+            "SELECT id, '%s' FROM user_type WHERE name LIKE '%%SuperUser%%'" % permission
+        )
+
+
+def downgrade():
+    op.drop_table('user_type_permission')
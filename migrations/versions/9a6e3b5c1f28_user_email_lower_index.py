@@ -0,0 +1,26 @@
+"""case-insensitive email index
+
+Revision ID: 9a6e3b5c1f28
+Revises: 4f2c8a1d9e73
+Create Date: 2026-10-18 16:44:52.209417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a6e3b5c1f28'
+down_revision = '4f2c8a1d9e73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression index for User.by_email(); needs SQLite 3.9+ or any
+    # server database.
+    op.execute('CREATE INDEX ix_user_email_lower ON "user" (lower(email))')
+
+
+def downgrade():
+    op.drop_index('ix_user_email_lower', table_name='user')
@@ -0,0 +1,39 @@
+"""outbound mail queue
+
+Revision ID: b3d94f0e6a12
+Revises: 7c1e5a9d2b40
+Create Date: 2026-10-18 10:03:17.452981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d94f0e6a12'
+down_revision = '7c1e5a9d2b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbound_mail',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('sender', sa.String(length=120), nullable=False),
+    sa.Column('recipients', sa.Text(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_outbound_mail_status'), 'outbound_mail', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_outbound_mail_status'), table_name='outbound_mail')
+    op.drop_table('outbound_mail')
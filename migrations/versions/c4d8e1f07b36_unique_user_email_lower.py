@@ -0,0 +1,39 @@
+"""unique case-insensitive emails
+
+Revision ID: c4d8e1f07b36
+Revises: e83f6c2d5a17
+Create Date: 2026-10-19 09:21:05.774120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e1f07b36'
+down_revision = 'e83f6c2d5a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Emails that differ only in case can't be merged or renamed safely:
+    # each account logs in and resets its password at its own address.
+    # Stop and let an admin give them distinct addresses first.
+    clashes = op.get_bind().execute(
+        'SELECT id, email FROM "user" WHERE lower(email) IN '
+        '(SELECT lower(email) FROM "user" GROUP BY lower(email) HAVING count(*) > 1) '
+        'ORDER BY lower(email), id'
+    ).fetchall()
+    if clashes:
+        raise RuntimeError(
+            'These accounts share an email address that differs only in case. '
+            'Give each a distinct address, then run the upgrade again:\n'
+            + '\n'.join(f'  user {user_id}: {email}' for user_id, email in clashes))
+    op.drop_index('ix_user_email_lower', table_name='user')
+    op.execute('CREATE UNIQUE INDEX ix_user_email_lower ON "user" (lower(email))')
+
+
+def downgrade():
+    op.drop_index('ix_user_email_lower', table_name='user')
+    op.execute('CREATE INDEX ix_user_email_lower ON "user" (lower(email))')
@@ -0,0 +1,31 @@
+"""unique user type names
+
+Revision ID: d07b5e2a8c41
+Revises: 9a6e3b5c1f28
+Create Date: 2026-10-18 16:49:30.864150
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd07b5e2a8c41'
+down_revision = '9a6e3b5c1f28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing duplicates keep their users and grants; all but the oldest
+    # get their id appended to the name (within the 20 character limit).
+    op.execute(
+        "UPDATE user_type "
+        "SET name = substr(name, 1, 20 - length(' #' || id)) || ' #' || id "
+        "WHERE id NOT IN (SELECT min(id) FROM user_type GROUP BY name)"
+    )
+    op.create_index(op.f('ix_user_type_name'), 'user_type', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_type_name'), table_name='user_type')
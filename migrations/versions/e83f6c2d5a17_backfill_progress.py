@@ -0,0 +1,30 @@
+"""backfill progress checkpoints
+
+Revision ID: e83f6c2d5a17
+Revises: d07b5e2a8c41
+Create Date: 2026-10-18 19:12:40.318825
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83f6c2d5a17'
+down_revision = 'd07b5e2a8c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('backfill_progress',
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('last_key', sa.Text(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('backfill_progress')
@@ -1,20 +1,29 @@
 import os
+import socketserver
 import tempfile
+import threading
 
 import pytest
-from gp_app import create_app, db
+from sqlalchemy import event
+from gp_app import create_app, db, mail
 from gp_app.models import User, UserType
 
 
 @pytest.fixture
-def app():
+def app_config():
+    # Override in a test module to create the app with extra config.
+    return {}
+
+
+@pytest.fixture
+def app(app_config):
     db_fd, db_path = tempfile.mkstemp()
 
-    app = create_app({
+    app = create_app(dict({
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
         'WTF_CSRF_ENABLED' : False,
-    })
+    }, **app_config))
 
     with app.app_context():
         db.create_all()
@@ -26,7 +35,8 @@ def app():
                     email='a12345@mycompany.com',
                     password='$2b$12$XuPwoWD7h2SdH4O1QDEy6eM7VWm.N/TbKfo5AVTqS.PW4xpkkpKie'
                     )
-        user_type1 = UserType(name='SuperUser')
+        user_type1 = UserType(name='SuperUser',
+                              permissions=['manage_users', 'manage_user_types'])
         user_type2 = UserType(name='Junk')
         user.user_types.append(user_type1)
         user2.user_types.append(user_type2)
@@ -35,6 +45,9 @@ def app():
 
     yield app
 
+    # Closing the pooled connections checkpoints and removes the WAL files.
+    with app.app_context():
+        db.engine.dispose()
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -64,4 +77,102 @@ class AuthActions(object):
 
 @pytest.fixture
 def auth(client):
-    return AuthActions(client)
\ No newline at end of file
+    return AuthActions(client)
+
+
+class QueryCounter(object):
+    def __init__(self, app):
+        self._app = app
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        with self._app.app_context():
+            self._engine = db.engine
+        self.statements = []
+        event.listen(self._engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self._engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def queries(app):
+    return QueryCounter(app)
+
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough of RFC 5321 for smtplib to deliver plain messages.
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self._reply('220 localhost stand-in')
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace').strip()
+            if not line:
+                return
+            verb = line.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self._reply('250 localhost')
+            elif verb == 'MAIL' and server.drop_after is not None \
+                    and len(server.messages) >= server.drop_after:
+                return
+            elif verb == 'RCPT' and server.reject_rcpt:
+                self._reply('550 no such user')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for raw in self.rfile:
+                    if raw in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(raw)
+                server.messages.append(b''.join(data))
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Not implemented')
+
+    def _reply(self, text):
+        self.wfile.write((text + '\r\n').encode('utf-8'))
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.reject_rcpt = False
+        # Hang up on the next message once this many were received.
+        self.drop_after = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+@pytest.fixture
+def smtp_server(app):
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.port,
+                      MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+    mail.init_app(app)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+import pytest
+from gp_app.assets.pipeline import build, minify_css, minify_js, load_manifest
+
+BUNDLES = {'site.css': ['vendor/a.min.css', 'main.css'],
+           'site.js': ['vendor/a.min.js', 'custom.js']}
+
+
+def _static(tmpdir):
+    static = tmpdir.mkdir('static')
+    static.mkdir('vendor')
+    static.join('vendor', 'a.min.css').write('.a{color:red}')
+    static.join('main.css').write('/* site */\nbody {\n  margin-top: 5rem;\n}\n' * 50)
+    static.join('vendor', 'a.min.js').write('var a=1')
+    static.join('custom.js').write('// setup\nvar b = 2;\n\n  $(go)\n')
+    return static
+
+
+@pytest.fixture
+def app_config(tmpdir):
+    out = str(tmpdir.join('dist'))
+    build(str(_static(tmpdir)), out, BUNDLES)
+    return {'ASSETS_FOLDER': out}
+
+
+def test_minify():
+    assert minify_css('/* x */\na:hover ,\nb > i {\n  color : red;\n}\n') == 'a:hover,b>i{color:red}'
+    # a descendant selector keeps its space
+    assert minify_css('a :hover { color : red }') == 'a :hover{color:red}'
+    assert minify_css('@media (max-width: 5px) {\n  a :focus { top : 0 }\n}') == \
+        '@media (max-width: 5px){a :focus{top:0}}'
+    assert minify_js('// c\n  var a = 1;\n\n') == 'var a = 1;'
+
+
+def test_build(tmpdir):
+    out = str(tmpdir.join('out'))
+    manifest = build(str(_static(tmpdir)), out, BUNDLES)
+    assert set(manifest) == {'site.css', 'site.js'}
+    css = manifest['site.css']
+    assert css.startswith('site.') and css.endswith('.css') and len(css) == len('site.css') + 13
+    with open(os.path.join(out, css), 'rb') as f:
+        data = f.read()
+    assert data.startswith(b'.a{color:red}\nbody{margin-top:5rem}')
+    with gzip.open(os.path.join(out, css + '.gz')) as f:
+        assert f.read() == data
+    with open(os.path.join(out, manifest['site.js'])) as f:
+        assert f.read() == 'var a=1;\nvar b = 2;\n$(go)'
+    with open(os.path.join(out, 'manifest.json')) as f:
+        assert json.load(f) == manifest
+
+    # same input, same fingerprint
+    assert build(str(tmpdir.join('static')), out, BUNDLES) == manifest
+
+
+def test_layout_uses_bundles(app, client):
+    manifest = load_manifest(app)
+    response = client.get('/home')
+    assert ('href="/assets/%s"' % manifest['site.css']).encode() in response.data
+    assert ('src="/assets/%s"' % manifest['site.js']).encode() in response.data
+    assert b'cdnjs' not in response.data
+
+
+def test_layout_falls_back_to_cdn(tmpdir):
+    from gp_app import create_app
+    app = create_app({'TESTING': True, 'ASSETS_FOLDER': str(tmpdir)})
+    response = app.test_client().get('/about')
+    assert b'cdnjs' in response.data
+    assert b'/static/main.css?v=' in response.data
+    assert b'/static/custom.js?v=' in response.data
+
+
+@pytest.mark.parametrize(('accept', 'encoding'), (
+    ('gzip, deflate', 'gzip'),
+    ('identity', None),
+    ('', None),
+))
+def test_serve_bundle(app, client, accept, encoding):
+    name = load_manifest(app)['site.css']
+    response = client.get('/assets/' + name, headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/css'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers.get('Content-Encoding') == encoding
+    body = gzip.decompress(response.data) if encoding else response.data
+    assert body.startswith(b'.a{color:red}')
+
+
+def test_serve_missing_bundle(client):
+    assert client.get('/assets/nope.css').status_code == 404
+    assert client.get('/assets/../manifest.json').status_code == 404
+
+
+def test_build_command_without_vendor_files(tmpdir):
+    from gp_app import create_app
+    static = _static(tmpdir)
+    app = create_app({'TESTING': True, 'ASSETS_FOLDER': str(tmpdir.join('dist'))})
+    app.static_folder = str(static)
+    result = app.test_cli_runner().invoke(args=['assets', 'build'])
+    assert result.exit_code != 0
+    assert 'Missing vendor/bootstrap-select.min.css, ' in result.output
+    assert 'flask assets fetch' in result.output
+    assert not tmpdir.join('dist').check()
@@ -0,0 +1,111 @@
+import pytest
+import sqlalchemy as sa
+from alembic.runtime.migration import MigrationContext
+from gp_app import db, backfill
+from gp_app.models import User, BackfillProgress, user_types
+
+user = User.__table__
+lower_email = {'email': sa.func.lower(user.c.email)}
+mixed_case = user.c.email != sa.func.lower(user.c.email)
+
+
+@pytest.fixture
+def mixed_case_users(app):
+    with app.app_context():
+        for i in range(25):
+            db.session.add(User(username='mixed%02d' % i, email='Mixed%02d@MyCompany.com' % i,
+                                password='x'))
+        db.session.commit()
+
+
+def _emails(app):
+    with app.app_context():
+        return [email for email, in db.session.query(User.email).order_by(User.id)]
+
+
+class Reports(list):
+    def __call__(self, name, done, total, elapsed):
+        self.append((name, done, total))
+
+
+def test_update_in_chunks(app, mixed_case_users, monkeypatch):
+    monkeypatch.setattr(backfill, 'REPORT_INTERVAL', 0)
+    sleeps = []
+    monkeypatch.setattr(backfill.time, 'sleep', sleeps.append)
+    reports = Reports()
+    with app.app_context():
+        commits = []
+
+        def on_commit(conn):
+            commits.append(conn)
+
+        sa.event.listen(db.engine, 'commit', on_commit)
+        changed = backfill.update(db.engine, 'lower-emails', user, lower_email, where=mixed_case,
+                                  batch_size=10, pause=0.5, progress=reports)
+        sa.event.remove(db.engine, 'commit', on_commit)
+        assert BackfillProgress.query.count() == 0
+    assert changed == 25
+    # three chunks, then the checkpoint is cleared
+    assert len(commits) == 4
+    assert sleeps == [0.5, 0.5]
+    assert reports == [('lower-emails', 10, 25), ('lower-emails', 20, 25),
+                       ('lower-emails', 25, 25), ('lower-emails', 25, 25)]
+    assert all(email == email.lower() for email in _emails(app))
+
+
+def test_resume_after_interruption(app, mixed_case_users):
+    chunks = []
+
+    def flaky(conn, lower, upper):
+        chunks.append((lower, upper))
+        if len(chunks) == 2:
+            raise KeyboardInterrupt
+        return conn.execute(user.update().where(sa.and_(
+            backfill._after(user.c.id, lower), user.c.id <= upper)).values(lower_email)).rowcount
+
+    with app.app_context():
+        with pytest.raises(KeyboardInterrupt):
+            backfill.run(db.engine, 'lower-emails', user, flaky, batch_size=10, progress=None)
+        checkpoint = BackfillProgress.query.get('lower-emails')
+        assert (checkpoint.last_key, checkpoint.rows) == ('10', 10)
+        # the interrupted chunk rolled back
+        assert _emails(app)[9:11] == ['mixed07@mycompany.com', 'Mixed08@MyCompany.com']
+
+        reports = Reports()
+        backfill.run(db.engine, 'lower-emails', user, flaky, batch_size=10, progress=reports)
+        assert chunks == [(None, 10), (10, 20), (10, 20), (20, 27)]
+        assert reports == [('lower-emails', 27, 27)]
+        assert BackfillProgress.query.count() == 0
+    assert all(email == email.lower() for email in _emails(app))
+
+
+def test_defaults_from_config(app, mixed_case_users, monkeypatch):
+    app.config.update(BACKFILL_BATCH_SIZE=7, BACKFILL_PAUSE=0.25)
+    sleeps = []
+    monkeypatch.setattr(backfill.time, 'sleep', sleeps.append)
+    with app.app_context():
+        assert backfill.update(db.engine, 'lower-emails', user, lower_email, where=mixed_case,
+                               progress=None) == 25
+    assert sleeps == [0.25] * 3
+
+
+def test_inside_migration_autocommit_block(app, mixed_case_users):
+    with app.app_context():
+        conn = db.engine.connect()
+        context = MigrationContext.configure(conn)
+        with context.begin_transaction(_per_migration=True):
+            conn.execute(user.update().where(user.c.id == 1).values(username='renamed'))
+            with context.autocommit_block():
+                assert backfill.update(conn, 'lower-emails', user, lower_email,
+                                       where=mixed_case, batch_size=10, progress=None) == 25
+        conn.close()
+        assert User.query.get(1).username == 'renamed'
+    assert all(email == email.lower() for email in _emails(app))
+
+
+def test_composite_key_needs_explicit_key(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            backfill.run(db.engine, 'types', user_types, lambda *args: 0)
+        assert backfill.run(db.engine, 'types', user_types, lambda *args: 0,
+                            key=user_types.c.user_id, progress=None) == 0
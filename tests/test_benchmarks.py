@@ -0,0 +1,45 @@
+import click
+import pytest
+from benchmarks import login_throughput
+from benchmarks.endpoints import compare, report, load
+
+
+def _run(**endpoints):
+    return {'results': {'100': {
+        name: {'p50_ms': p50, 'p90_ms': p90, 'queries': queries}
+        for name, (p50, p90, queries) in endpoints.items()}}}
+
+
+def test_compare_passes_within_threshold(capsys):
+    baseline = _run(login=(10.0, 20.0, 1), users=(5.0, 8.0, 2))
+    current = _run(login=(11.9, 23.0, 1), users=(4.0, 8.0, 2), new=(1.0, 1.0, 9))
+    rows, regressions = compare(baseline, current, 0.2)
+    assert regressions == 0
+    # endpoints missing from the baseline are skipped
+    assert [name for _, name, _, _, flags in rows] == ['login', 'users']
+    report(rows, regressions)
+    assert 'No regressions.' in capsys.readouterr().out
+
+
+def test_compare_flags_latency_and_query_regressions():
+    baseline = _run(login=(10.0, 20.0, 1), users=(5.0, 8.0, 2), account=(1.0, 2.0, 0))
+    current = _run(login=(12.5, 20.0, 1), users=(5.0, 8.0, 3), account=(1.0, 2.0, 0))
+    rows, regressions = compare(baseline, current, 0.2)
+    assert regressions == 2
+    flags = {name: flags for _, name, _, _, flags in rows}
+    assert flags == {'login': ['p50_ms +25%'], 'users': ['queries 2->3'], 'account': []}
+    with pytest.raises(click.ClickException, match='2 regression'):
+        report(rows, regressions)
+
+
+def test_committed_baseline_compares_with_itself():
+    baseline = load('main')
+    assert {'100', '10000'} <= set(baseline['results'])
+    assert compare(baseline, baseline, 0.0)[1] == 0
+
+
+def test_login_throughput_runs_without_failures():
+    # the login rate limit must not throttle the benchmark
+    rate, failures = login_throughput.run(4, 'inline', threads=2, seconds=0.5)
+    assert failures == 0
+    assert rate > 0
@@ -0,0 +1,123 @@
+import pytest
+from gp_app import db
+from gp_app.models import User, UserType, user_types
+from gp_app.users import bulk
+
+
+def _add_users(app, count):
+    with app.app_context():
+        users = [User(username='bulk%03d' % i, email='bulk%03d@mycompany.com' % i,
+                      password='x') for i in range(count)]
+        db.session.add_all(users)
+        db.session.add(UserType(name='Editor'))
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def _types(app, user_ids):
+    with app.app_context():
+        return User.type_names_by_user(user_ids)
+
+
+def test_bulk_assign_revoke_replace(app, client, auth, queries):
+    ids = _add_users(app, 30)
+    auth.login()
+    client.get('/home')
+
+    with queries:
+        response = client.post('/users/bulk', json={
+            'action': 'assign', 'user_ids': ids + [2], 'user_types': ['Editor', 'Junk']})
+    assert response.get_json() == {'action': 'assign', 'users': 31, 'rows': 61}
+    # the name lookup and one INSERT ... SELECT for every pair (the
+    # identity is cached by the request above)
+    assert len(queries.statements) == 2
+    assert _types(app, ids[:1] + [2]) == {ids[0]: ['Editor', 'Junk'], 2: ['Editor', 'Junk']}
+
+    # linking again is a no-op rather than a primary key violation
+    response = client.post('/users/bulk', json={
+        'action': 'assign', 'user_ids': ids, 'user_types': ['Editor']})
+    assert response.get_json()['rows'] == 0
+
+    response = client.post('/users/bulk', json={
+        'action': 'revoke', 'user_ids': ids[:10], 'user_types': ['Junk']})
+    assert response.get_json()['rows'] == 10
+    assert _types(app, ids[9:11]) == {ids[9]: ['Editor'], ids[10]: ['Editor', 'Junk']}
+
+    response = client.post('/users/bulk', json={
+        'action': 'replace', 'user_ids': ids[10:12], 'user_types': ['SuperUser', 'Junk']})
+    assert response.get_json()['rows'] == 4
+    assert _types(app, ids[10:12]) == {ids[10]: ['Junk', 'SuperUser'],
+                                       ids[11]: ['Junk', 'SuperUser']}
+
+
+def test_bulk_delete(app, client, auth):
+    ids = _add_users(app, 5)
+    auth.login()
+    client.post('/users/bulk', json={'action': 'assign', 'user_ids': ids, 'user_types': ['Junk']})
+
+    response = client.post('/users/bulk', json={'action': 'delete', 'user_ids': ids + [999]})
+    assert response.get_json() == {'action': 'delete', 'users': 5, 'rows': 5}
+    with app.app_context():
+        assert User.query.filter(User.id.in_(ids)).count() == 0
+        assert db.session.query(user_types).filter(user_types.c.user_id.in_(ids)).count() == 0
+        # untouched users keep their types
+        assert User.type_names_by_user([2]) == {2: ['Junk']}
+
+
+@pytest.mark.parametrize(('payload', 'message'), (
+    ({'action': 'promote', 'user_ids': [2]}, b'action must be one of'),
+    ({'action': 'assign', 'user_ids': '2'}, b'user_ids must be a list'),
+    ({'action': 'assign', 'user_ids': [True]}, b'user_ids must be a list'),
+    ({'action': 'assign', 'user_ids': [2], 'user_types': 'Junk'}, b'user_types must be a list'),
+    ({'action': 'assign', 'user_ids': [2], 'user_types': ['Junk', 'Nope', 'Gone']},
+     b'Unknown user types: Gone, Nope'),
+))
+def test_bulk_validation(app, client, auth, payload, message):
+    auth.login()
+    response = client.post('/users/bulk', json=payload)
+    assert response.status_code == 400
+    assert message in response.data
+    assert _types(app, [2]) == {2: ['Junk']}
+
+
+def test_bulk_requires_permission_and_csrf(app, client, auth):
+    assert client.post('/users/bulk', json={}).status_code == 302
+    auth.login(email='a12345@mycompany.com')
+    assert client.post('/users/bulk', json={}).status_code == 403
+
+    auth.logout()
+    auth.login()
+    app.config['WTF_CSRF_ENABLED'] = True
+    payload = {'action': 'revoke', 'user_ids': [2], 'user_types': ['Junk']}
+    response = client.post('/users/bulk', json=payload)
+    assert response.status_code == 400 and b'CSRF token is missing' in response.data
+
+    page = client.get('/users').data
+    token = page.split(b'id="shared-csrf-token" value="')[1].split(b'"')[0].decode()
+    response = client.post('/users/bulk', json=payload, headers={'X-CSRFToken': token})
+    assert response.get_json()['rows'] == 1
+
+
+def test_bulk_invalidates_identities(app, client, auth):
+    auth.login()
+    assert client.get('/users').status_code == 200
+    client.post('/users/bulk', json={
+        'action': 'revoke', 'user_ids': [1], 'user_types': ['SuperUser']})
+    assert client.get('/users').status_code == 403
+
+
+def test_resolve_user_types(app):
+    with app.app_context():
+        assert bulk.resolve_user_types([]) == {}
+        assert bulk.resolve_user_types(['Junk', 'Junk']) == {'Junk': 2}
+        with pytest.raises(bulk.UnknownUserTypes) as exc:
+            bulk.resolve_user_types(['Junk', 'Nope'])
+        assert exc.value.names == ['Nope']
+
+
+def test_update_users_unknown_type(client, auth):
+    auth.login()
+    response = client.post('/users/2/update', data={'user_types': 'Nope'},
+                           follow_redirects=True)
+    assert b'Unknown user types: Nope' in response.data
+    assert b'selected value="Junk"' in response.data
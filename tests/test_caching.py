@@ -0,0 +1,100 @@
+import os
+import pytest
+from gp_app import page_cache
+
+
+def test_anonymous_page_cached_with_etag(app, client):
+    response = client.get('/home')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert 'Cookie' in response.headers['Vary']
+
+    response = client.get('/home', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get('/home', headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    assert b'Home Page' in response.data
+
+    with app.app_context():
+        assert len(page_cache) == 1
+
+
+def test_cache_hit_skips_rendering(app, client, monkeypatch):
+    client.get('/about')
+    import gp_app.main.routes
+    monkeypatch.setattr(gp_app.main.routes, 'render_template',
+                        lambda *a, **k: pytest.fail('rendered again'))
+    response = client.get('/about')
+    assert b'About Page' in response.data
+
+
+def test_template_change_invalidates(app, client, monkeypatch):
+    import gp_app.main.routes
+    render = gp_app.main.routes.render_template
+    calls = []
+    monkeypatch.setattr(gp_app.main.routes, 'render_template',
+                        lambda *a, **k: calls.append(a) or render(*a, **k))
+    client.get('/about')
+    client.get('/about')
+    assert len(calls) == 1
+
+    path = os.path.join(app.root_path, 'templates', 'layout.html')
+    stat = os.stat(path)
+    try:
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        client.get('/about')
+        assert len(calls) == 2
+    finally:
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+
+
+def test_logged_in_cached_per_permission_set(app, client, auth):
+    anonymous = client.get('/home')
+    auth.login()
+    superuser = client.get('/home')
+    assert superuser.headers['ETag'] != anonymous.headers['ETag']
+    assert superuser.headers['Cache-Control'] == 'private, no-cache'
+    assert b'href="/users"' in superuser.data
+    auth.logout()
+
+    auth.login(email='a12345@mycompany.com')
+    plain = client.get('/home')
+    assert b'href="/users"' not in plain.data
+    assert b'Logout' in plain.data
+    with app.app_context():
+        assert len(page_cache) == 3
+
+
+def test_logged_in_bypass(app, client, auth):
+    app.config['PAGE_CACHE_AUTHENTICATED'] = False
+    auth.login()
+    response = client.get('/home')
+    assert 'ETag' not in response.headers
+    with app.app_context():
+        assert len(page_cache) == 0
+
+
+def test_flashed_messages_bypass(app, client):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Hello flash')]
+    response = client.get('/home')
+    assert b'Hello flash' in response.data
+    assert b'Hello flash' not in client.get('/home').data
+
+
+def test_error_pages_cached(app, client):
+    assert client.get('/nope').status_code == 404
+    response = client.get('/still-nope')
+    assert response.status_code == 404
+    assert b'Page Not Found' in response.data
+    assert 'ETag' not in response.headers
+    with app.app_context():
+        assert len(page_cache) == 1
+
+
+def test_disabled(app, client):
+    app.config['PAGE_CACHE_ENABLED'] = False
+    assert 'ETag' not in client.get('/home').headers
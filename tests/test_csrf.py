@@ -0,0 +1,48 @@
+import re
+from gp_app.csrf import mask, unmask
+
+
+def _token(page, pattern):
+    return re.search(pattern, page.decode()).group(1)
+
+
+def test_mask_round_trip():
+    token = 'IjRmNDQ4ZjY1ZDEi.X9ulQw.abc-DEF_123'
+    masked = {mask(token) for _ in range(3)}
+    assert len(masked) == 3 and token not in ''.join(masked)
+    assert all(unmask(value) == token for value in masked)
+    # anything unmasked is left for validate_csrf to reject
+    for value in (None, '', 'not masked!', token):
+        assert unmask(value) == value
+
+
+def test_form_tokens_are_masked_and_accepted(app, client):
+    app.config['WTF_CSRF_ENABLED'] = True
+    pattern = r'name="csrf_token" type="hidden" value="([^"]+)"'
+    first = _token(client.get('/login').data, pattern)
+    second = _token(client.get('/login').data, pattern)
+    assert first != second and unmask(first) == unmask(second)
+
+    response = client.post('/login', data={'email': 'test@mycompany.com', 'password': 'test',
+                                           'csrf_token': first})
+    assert response.headers['Location'] == 'http://localhost/home'
+
+
+def test_forged_token_rejected(app, client):
+    app.config['WTF_CSRF_ENABLED'] = True
+    client.get('/login')
+    response = client.post('/login', data={'email': 'test@mycompany.com', 'password': 'test',
+                                           'csrf_token': mask('forged')})
+    # the form is shown again instead of logging in
+    assert response.status_code == 200
+
+
+def test_shared_token_submits_row_forms(app, client, auth):
+    auth.login()
+    app.config['WTF_CSRF_ENABLED'] = True
+    token = _token(client.get('/users').data, r'id="shared-csrf-token" value="([^"]+)"')
+    response = client.post('/users/2/update', data={'user_types': 'SuperUser',
+                                                     'csrf_token': token})
+    assert response.status_code == 302
+    page = client.get('/users').data.decode()
+    assert 'updated!' in page
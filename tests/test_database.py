@@ -0,0 +1,72 @@
+import os
+import tempfile
+import pytest
+from sqlalchemy.pool import QueuePool
+from gp_app import create_app, db
+from gp_app.database import engine_options, set_pragmas
+
+
+def _pragma(name):
+    return db.session.execute(f'PRAGMA {name}').scalar()
+
+
+def test_sqlite_profile(app):
+    with app.app_context():
+        assert _pragma('journal_mode') == 'wal'
+        assert _pragma('synchronous') == 1
+        assert _pragma('busy_timeout') == 5000
+        assert _pragma('cache_size') == -16000
+        assert _pragma('temp_store') == 2
+        pool = db.engine.pool
+        assert isinstance(pool, QueuePool)
+        assert pool.size() == 5
+
+
+@pytest.fixture
+def db_path():
+    db_fd, path = tempfile.mkstemp()
+    yield path
+    os.close(db_fd)
+    os.unlink(path)
+
+
+def test_sqlite_profile_overrides(db_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'SQLITE_PRAGMAS': {'busy_timeout': 250},
+        'DATABASE_POOL_SIZE': 2,
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 3},
+    })
+    with app.app_context():
+        assert _pragma('busy_timeout') == 250
+        assert _pragma('journal_mode') == 'delete'
+        assert db.engine.pool.size() == 3
+        db.engine.dispose()
+
+
+def test_sqlite_pragmas_off(db_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+                      'SQLITE_PRAGMAS': None})
+    with app.app_context():
+        assert _pragma('journal_mode') == 'delete'
+        db.engine.dispose()
+
+
+def test_engine_options_for_server_database(app):
+    options = engine_options(app.config, 'postgresql://gp@db.internal/gp')
+    assert options == {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30,
+                       'pool_recycle': 1800, 'pool_pre_ping': True}
+    assert engine_options(app.config, 'sqlite://') == {}
+    assert engine_options(app.config, 'sqlite:///:memory:') == {}
+
+
+def test_in_memory_sqlite_keeps_static_pool():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        assert type(db.engine.pool).__name__ == 'StaticPool'
+
+
+def test_pragma_names_are_checked():
+    with pytest.raises(ValueError):
+        set_pragmas({'journal_mode; DROP TABLE user': 'wal'})
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+from gp_app import db
+from gp_app.models import User, user_types
+
+
+def _add_users(app, count):
+    with app.app_context():
+        db.session.add_all([User(username='exp%03d' % i, email='exp%03d@mycompany.com' % i,
+                                 password='x') for i in range(count)])
+        db.session.commit()
+
+
+def test_export_ndjson(app, client, auth, queries):
+    app.config.update(STREAM_ROWS_PER_FETCH=10, STREAM_CHUNK_SIZE=256)
+    _add_users(app, 25)
+    auth.login()
+    client.get('/home')
+
+    with queries:
+        response = client.get('/users/export', buffered=False)
+        assert response.is_streamed
+        chunks = list(response.response)
+        response.close()
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=users.ndjson'
+    assert len(chunks) > 3
+
+    rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    assert len(rows) == 27
+    assert rows[0] == {'id': 1, 'username': 'test', 'email': 'test@mycompany.com',
+                       'user_types': ['SuperUser']}
+    assert rows[-1]['username'] == 'exp024' and rows[-1]['user_types'] == []
+    assert not any('password' in row for row in rows)
+    # one cursor for users, one role query per 10-row fetch
+    assert sum('user_types.user_id IN' in s for s in queries.statements) == 3
+    assert len(queries.statements) == 4
+
+
+def test_export_csv(client, auth):
+    auth.login()
+    response = client.get('/users/export?format=csv')
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.data.decode())))
+    assert rows == [['id', 'username', 'email', 'user_types'],
+                    ['1', 'test', 'test@mycompany.com', 'SuperUser'],
+                    ['2', 'a12345', 'a12345@mycompany.com', 'Junk']]
+
+
+def test_export_permissions_and_format(client, auth):
+    assert client.get('/users/export').status_code == 302
+    auth.login(email='a12345@mycompany.com')
+    assert client.get('/users/export').status_code == 403
+    auth.logout()
+    auth.login()
+    assert client.get('/users/export?format=xml').status_code == 400
+
+
+def test_export_compressed(client, auth):
+    auth.login()
+    response = client.get('/users/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_export_users_command(app, runner, tmp_path):
+    _add_users(app, 3)
+    result = runner.invoke(args=['export-users'])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)['username'] for line in result.output.splitlines()] == \
+        ['test', 'a12345', 'exp000', 'exp001', 'exp002']
+
+    path = tmp_path / 'users.csv'
+    result = runner.invoke(args=['export-users', str(path), '--format', 'csv'])
+    assert result.exit_code == 0, result.output
+    assert path.read_text().splitlines()[1] == '1,test,test@mycompany.com,SuperUser'
+
+
+def test_export_csv_empty_table(app, runner):
+    with app.app_context():
+        db.session.execute(user_types.delete())
+        User.query.delete()
+        db.session.commit()
+    result = runner.invoke(args=['export-users', '--format', 'csv'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ['id,username,email,user_types']
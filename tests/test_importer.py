@@ -0,0 +1,127 @@
+import json
+import pytest
+from gp_app import passwords
+from gp_app.models import User
+from gp_app.users import importer
+from gp_app.users.importer import read_rows, to_record
+
+
+@pytest.fixture
+def app_config():
+    return {'BCRYPT_LOG_ROUNDS': 4}
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_import_users_csv(app, runner, tmp_path, queries):
+    lines = ['username,email,password,user_types']
+    lines += ['new%03d,new%03d@mycompany.com,secret%03d,' % (i, i, i) for i in range(7)]
+    lines += [
+        'typed,typed@mycompany.com,secret,"Junk,SuperUser"',
+        'test,fresh@mycompany.com,secret,',           # username in the database
+        'fresh,Test@MyCompany.com,secret,',           # email in the database
+        'new000,dupe@mycompany.com,secret,',          # username earlier in the file
+        'x,short@mycompany.com,secret,',
+        'short,short@mycompany.com,abc,',
+        'bad,not-an-email,secret,',
+        'ghost,ghost@mycompany.com,secret,Nope',
+    ]
+    path = _write(tmp_path, 'users.csv', '\n'.join(lines) + '\n')
+
+    with queries:
+        result = runner.invoke(args=['import-users', path, '--chunk-size', '5',
+                                     '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Done: imported 8, rejected 7.' in result.output
+    assert "line 10: username 'test' is taken" in result.output
+    assert "line 11: email 'Test@MyCompany.com' is taken" in result.output
+    assert "line 12: username 'new000' is taken" in result.output
+    assert 'line 16: unknown user types: Nope' in result.output
+    assert 'line 6: imported 5, rejected 0' in result.output
+    # users are written with one INSERT per chunk, not one per row
+    inserts = [s for s in queries.statements if s.startswith('INSERT INTO user ')]
+    assert len(inserts) == 2
+
+    with app.app_context():
+        assert User.query.count() == 10
+        user = User.query.filter_by(username='new003').one()
+        assert user.email == 'new003@mycompany.com'
+        assert passwords.verify(user.password, 'secret003')
+        assert passwords.needs_rehash(user.password) is False
+        typed = User.query.filter_by(username='typed').one()
+        assert User.type_names_by_user([typed.id]) == {typed.id: ['Junk', 'SuperUser']}
+
+
+def test_import_users_ndjson(app, runner, tmp_path):
+    rows = [
+        json.dumps({'username': 'nd1', 'email': 'nd1@mycompany.com', 'password': 'secret',
+                    'user_types': ['Junk']}),
+        '',
+        '{"username": ',
+        json.dumps(['not', 'an', 'object']),
+        json.dumps({'username': 'nd2', 'email': 'nd2@mycompany.com', 'password': 'secret'}),
+    ]
+    path = _write(tmp_path, 'users.ndjson', '\n'.join(rows) + '\n')
+    result = runner.invoke(args=['import-users', path, '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Done: imported 2, rejected 2.' in result.output
+    assert 'line 3: invalid JSON' in result.output
+    assert 'line 4: expected an object' in result.output
+    with app.app_context():
+        assert {u.username for u in User.query} >= {'nd1', 'nd2'}
+
+
+def test_import_users_conflict_rejects_chunk(app, runner, tmp_path, monkeypatch):
+    # A user registering between the uniqueness check and the insert.
+    monkeypatch.setattr(importer, '_existing', lambda column, values: set())
+    lines = ['username,email,password',
+             'race1,race1@mycompany.com,secret',
+             'race2,TEST@mycompany.com,secret',
+             'later,later@mycompany.com,secret']
+    path = _write(tmp_path, 'users.csv', '\n'.join(lines) + '\n')
+    result = runner.invoke(args=['import-users', path, '--chunk-size', '2',
+                                 '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Done: imported 1, rejected 2.' in result.output
+    assert 'line 2: not imported, the chunk conflicts with existing data' in result.output
+    assert 'line 3: not imported' in result.output
+    with app.app_context():
+        assert {u.username for u in User.query} == {'test', 'a12345', 'later'}
+
+
+def test_import_users_needs_format(runner, tmp_path):
+    path = _write(tmp_path, 'users.txt', '')
+    result = runner.invoke(args=['import-users', path])
+    assert result.exit_code != 0
+    assert 'pass --format' in result.output
+
+
+def test_read_rows_is_lazy():
+    def lines():
+        yield 'username,email,password\n'
+        yield 'a1,a1@mycompany.com,secret\n'
+        raise AssertionError('read past the first row')
+
+    rows = read_rows(lines(), 'csv')
+    assert next(rows) == (2, {'username': 'a1', 'email': 'a1@mycompany.com',
+                              'password': 'secret'})
+
+
+@pytest.mark.parametrize(('row', 'reason'), (
+    ({'username': 'ok', 'email': 'ok@mycompany.com', 'password': 'secret'}, None),
+    ({'username': 'u' * 21, 'email': 'ok@mycompany.com', 'password': 'secret'},
+     'username must be between 2 and 20 characters'),
+    ({'username': 'ok', 'email': 'ok@mycompany..com', 'password': 'secret'},
+     'invalid email address'),
+    ({'username': 'ok', 'email': 'ok@-mycompany.com', 'password': 'secret'},
+     'invalid email address'),
+    ({'username': 'ok', 'email': 'ok@mycompany.com'}, 'password must be at least 5 characters'),
+    ({'username': 'ok', 'email': 'ok@mycompany.com', 'password': 12345},
+     'password must be at least 5 characters'),
+))
+def test_to_record(row, reason):
+    assert to_record(1, row)[1] == reason
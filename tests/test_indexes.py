@@ -0,0 +1,161 @@
+import contextlib
+import logging
+import os
+import pytest
+from alembic import command
+from flask_migrate import stamp, upgrade, downgrade
+from sqlalchemy import event
+from gp_app import db
+from gp_app.metrics.slow_queries import explain
+from gp_app.models import User, UserType
+from gp_app.users import bulk
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations')
+
+
+@contextlib.contextmanager
+def query_plans(engine, table):
+    """Collect the SQLite plan of every SELECT that reads ``table``."""
+    plans = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and f'FROM {table}' in statement:
+            plans.append(explain(conn, statement, parameters))
+
+    event.listen(engine, 'after_cursor_execute', capture)
+    try:
+        yield plans
+    finally:
+        event.remove(engine, 'after_cursor_execute', capture)
+
+
+def _add_users(app, count):
+    with app.app_context():
+        junk = UserType.query.filter_by(name='Junk').one()
+        for i in range(count):
+            user = User(username='idx%03d' % i, email='Idx%03d@MyCompany.com' % i, password='x')
+            user.user_types.append(junk)
+            db.session.add(user)
+        db.session.commit()
+
+
+def test_user_types_are_loaded_by_user_id_index(app):
+    _add_users(app, 50)
+    with app.app_context():
+        user = User.query.filter_by(username='idx010').one()
+        with query_plans(db.engine, 'user_type') as plans:
+            assert [t.name for t in user.user_types] == ['Junk']
+            User.type_names_by_user([1, 2, user.id])
+        assert len(plans) == 2
+        for plan in plans:
+            assert 'INDEX ix_user_types_user_id (user_id' in plan, plan
+
+
+def test_login_email_lookup_uses_lower_index(app, client):
+    _add_users(app, 50)
+    with app.app_context():
+        engine = db.engine
+    with query_plans(engine, 'user') as plans:
+        response = client.post('/login', data={'email': 'TEST@mycompany.com',
+                                               'password': 'test'})
+        assert response.headers['Location'] == 'http://localhost/home'
+    assert plans and all('INDEX ix_user_email_lower' in plan for plan in plans), plans
+
+
+def test_reset_request_email_lookup_uses_lower_index(app, client):
+    with app.app_context():
+        engine = db.engine
+    with query_plans(engine, 'user') as plans:
+        response = client.post('/reset_password', data={'email': 'A12345@MyCompany.com'})
+        assert response.status_code == 302
+    assert len(plans) == 2
+    assert all('INDEX ix_user_email_lower' in plan for plan in plans), plans
+
+
+def test_user_type_name_lookup_uses_unique_index(app):
+    with app.app_context():
+        with query_plans(db.engine, 'user_type') as plans:
+            UserType.query.filter_by(name='Junk').first()
+            bulk.resolve_user_types(['Junk', 'SuperUser'])
+        assert len(plans) == 2
+        for plan in plans:
+            assert 'INDEX ix_user_type_name (name' in plan, plan
+
+
+def test_user_type_names_are_unique(client, auth):
+    auth.login()
+    response = client.post('/user_type/new', data={'name': 'Junk'})
+    assert b'That user type already exists' in response.data
+    # keeping a type's own name is not a clash
+    response = client.post('/user_type/2/update', data={'name': 'Junk'})
+    assert response.headers['Location'] == 'http://localhost/user_types'
+    response = client.post('/user_type/2/update', data={'name': 'SuperUser'})
+    assert b'That user type already exists' in response.data
+
+
+@pytest.fixture
+def keep_logging():
+    # migrations/env.py runs fileConfig(), which disables the app's loggers.
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)]
+    saved = [(logger, logger.disabled, logger.level, list(logger.handlers)) for logger in loggers]
+    yield
+    for logger, disabled, level, handlers in saved:
+        logger.disabled = disabled
+        logger.setLevel(level)
+        logger.handlers[:] = handlers
+
+
+def test_index_migrations(app, keep_logging):
+    with app.app_context():
+        # The schema as of the mail queue migration, with clashing type names.
+        for index in ('ix_user_types_user_id', 'ix_user_email_lower', 'ix_user_type_name'):
+            db.session.execute(f'DROP INDEX {index}')
+        db.session.execute('DROP TABLE backfill_progress')
+        db.session.execute("INSERT INTO user_type (name) VALUES ('Junk'), ('Junk'), "
+                           "('Twenty characters!!'), ('Twenty characters!!')")
+        db.session.execute("INSERT INTO user (username, email, password) VALUES "
+                           "('upper', 'TEST@mycompany.com', 'x'), ('mixed', 'Test@MyCompany.com', 'x')")
+        db.session.commit()
+        stamp(directory=MIGRATIONS, revision='b3d94f0e6a12')
+
+        # Case-only duplicate emails stop the upgrade for an admin to resolve.
+        config = app.extensions['migrate'].migrate.get_config(MIGRATIONS)
+        with pytest.raises(RuntimeError) as excinfo:
+            command.upgrade(config, 'head')
+        assert ('  user 1: test@mycompany.com\n  user 3: TEST@mycompany.com\n'
+                '  user 4: Test@MyCompany.com') in str(excinfo.value)
+        db.session.execute("UPDATE user SET email = username || '@mycompany.com' "
+                           "WHERE id IN (3, 4)")
+        db.session.commit()
+
+        upgrade(directory=MIGRATIONS)
+        indexes = dict(db.session.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index'").fetchall())
+        assert 'ON user_types (user_id)' in indexes['ix_user_types_user_id']
+        assert indexes['ix_user_email_lower'].startswith('CREATE UNIQUE INDEX')
+        assert 'lower(email)' in indexes['ix_user_email_lower']
+        emails = [email for email, in db.session.execute('SELECT email FROM user ORDER BY id')]
+        assert emails == ['test@mycompany.com', 'a12345@mycompany.com',
+                          'upper@mycompany.com', 'mixed@mycompany.com']
+        assert indexes['ix_user_type_name'].startswith('CREATE UNIQUE INDEX')
+        assert db.session.execute('SELECT count(*) FROM backfill_progress').scalar() == 0
+        names = [name for name, in db.session.execute('SELECT name FROM user_type ORDER BY id')]
+        # Renamed within the 20 character column.
+        assert names == ['SuperUser', 'Junk', 'Junk #3', 'Junk #4', 'Twenty characters!!',
+                         'Twenty characters #6']
+
+        downgrade(directory=MIGRATIONS, revision='b3d94f0e6a12')
+        remaining = {name for name, in db.session.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert not remaining & {'ix_user_types_user_id', 'ix_user_email_lower',
+                                'ix_user_type_name'}
+
+
+def test_emails_are_unique_regardless_of_case(app):
+    from sqlalchemy.exc import IntegrityError
+    with app.app_context():
+        db.session.add(User(username='shouty', email='TEST@MYCOMPANY.COM', password='x'))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
@@ -0,0 +1,142 @@
+import time
+from datetime import datetime, timedelta
+from flask_mail import Message
+from gp_app import db
+from gp_app.mailqueue import enqueue, deliver_due, retry_delay, claim_due, MailWorker
+from gp_app.models import OutboundMail
+
+
+def _enqueue(app, count):
+    with app.app_context():
+        for i in range(count):
+            enqueue(Message('Subject %d' % i, sender='noreply@mycompany.com',
+                            recipients=['user%d@mycompany.com' % i], body='body %d' % i))
+
+
+def test_deliver_batch_over_one_connection(app, smtp_server):
+    _enqueue(app, 3)
+    with app.app_context():
+        assert deliver_due() == (3, 0)
+        assert deliver_due() == (0, 0)
+        sent = OutboundMail.query.filter_by(status='sent').all()
+        assert len(sent) == 3
+        assert all(m.sent_at is not None for m in sent)
+    assert smtp_server.connections == 1
+    assert len(smtp_server.messages) == 3
+    assert b'Subject: Subject 0' in smtp_server.messages[0]
+
+
+def test_batch_size(app, smtp_server):
+    _enqueue(app, 3)
+    with app.app_context():
+        assert deliver_due(batch_size=2) == (2, 0)
+        assert deliver_due(batch_size=2) == (1, 0)
+    assert smtp_server.connections == 2
+
+
+def test_retry_with_backoff(app, smtp_server):
+    smtp_server.reject_rcpt = True
+    _enqueue(app, 1)
+    with app.app_context():
+        assert deliver_due() == (0, 1)
+        queued = OutboundMail.query.one()
+        assert queued.status == 'pending'
+        assert queued.attempts == 1
+        assert 'SMTPRecipientsRefused' in queued.last_error
+        assert queued.next_attempt_at > datetime.utcnow()
+        # not due yet
+        assert deliver_due() == (0, 0)
+
+        smtp_server.reject_rcpt = False
+        queued.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert deliver_due() == (1, 0)
+        assert OutboundMail.query.one().attempts == 2
+
+
+def test_unreachable_server_gives_up(app, smtp_server):
+    app.config['MAIL_QUEUE_MAX_ATTEMPTS'] = 2
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    _enqueue(app, 2)
+    with app.app_context():
+        assert deliver_due() == (0, 2)
+        OutboundMail.query.update({'next_attempt_at': datetime.utcnow()})
+        db.session.commit()
+        assert deliver_due() == (0, 2)
+        assert OutboundMail.query.filter_by(status='failed').count() == 2
+
+
+def test_dropped_connection_leaves_the_rest_for_the_next_pass(app, smtp_server):
+    smtp_server.drop_after = 1
+    _enqueue(app, 4)
+    with app.app_context():
+        assert deliver_due() == (1, 1)
+        by_status = {}
+        for queued in OutboundMail.query.order_by(OutboundMail.id):
+            by_status.setdefault(queued.status, []).append((queued.id, queued.attempts))
+        # the message the server hung up on is charged; the two after it aren't
+        assert by_status == {'sent': [(1, 1)], 'pending': [(2, 1), (3, 0), (4, 0)]}
+
+        smtp_server.drop_after = None
+        assert deliver_due() == (2, 0)
+
+
+def test_claimed_messages_are_not_sent_twice(app, smtp_server):
+    _enqueue(app, 3)
+    with app.app_context():
+        # another worker got there first
+        other = claim_due(2, datetime.utcnow())
+        assert [m.id for m in other] == [1, 2]
+        assert OutboundMail.query.get(1).status == 'sending'
+        assert deliver_due() == (1, 0)
+        assert deliver_due() == (0, 0)
+    assert len(smtp_server.messages) == 1
+
+
+def test_expired_claims_are_taken_over(app, smtp_server):
+    _enqueue(app, 1)
+    with app.app_context():
+        claim_due(1, datetime.utcnow() - timedelta(seconds=app.config['MAIL_QUEUE_LEASE'] + 1))
+        assert deliver_due() == (1, 0)
+        assert OutboundMail.query.one().status == 'sent'
+
+
+def test_retry_delay(app):
+    with app.app_context():
+        assert retry_delay(1) == timedelta(seconds=30)
+        assert retry_delay(3) == timedelta(seconds=120)
+        assert retry_delay(20) == timedelta(seconds=3600)
+
+
+def test_mail_worker_command(app, runner, smtp_server):
+    _enqueue(app, 2)
+    result = runner.invoke(args=['mail-worker', '--once'])
+    assert 'Sent 2, failed 0.' in result.output
+    assert len(smtp_server.messages) == 2
+
+
+def test_reset_request_is_queued(app, client, smtp_server):
+    response = client.post('/reset_password', data={'email': 'test@mycompany.com'},
+                           follow_redirects=True)
+    assert b'An email has been sent' in response.data
+    assert smtp_server.connections == 0
+    with app.app_context():
+        assert OutboundMail.query.filter_by(recipients='test@mycompany.com').count() == 1
+
+
+def test_mail_worker_thread(app, smtp_server):
+    worker = MailWorker(app)
+    app.extensions['mail_worker'] = worker
+    worker.start()
+    try:
+        _enqueue(app, 1)
+        for _ in range(100):
+            if smtp_server.messages:
+                break
+            time.sleep(0.05)
+        assert len(smtp_server.messages) == 1
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert not worker.is_alive()
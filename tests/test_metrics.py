@@ -0,0 +1,93 @@
+import re
+import pytest
+from gp_app import create_app
+
+
+@pytest.fixture
+def app_config():
+    return {'METRICS_ENABLED': True, 'METRICS_TOKEN': 's3cret', 'BCRYPT_LOG_ROUNDS': 4}
+
+SCRAPE = {'Authorization': 'Bearer s3cret'}
+
+
+def _sample(body, name, endpoint, suffix=''):
+    match = re.search(r'^%s%s\{endpoint="%s"\} (\S+)$' % (name, suffix, re.escape(endpoint)),
+                      body, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_metrics_disabled_by_default():
+    app = create_app({'TESTING': True})
+    assert app.test_client().get('/metrics').status_code == 404
+    assert 'metrics' not in app.extensions
+
+
+def test_server_timing_header(client, auth):
+    response = client.get('/home')
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('app;dur=')
+    assert 'db;dur=' in timing and 'desc="0 queries"' in timing
+    assert 'tpl;dur=' in timing and 'bcrypt;dur=0.00' in timing
+
+    response = auth.login()
+    # user lookup, then the cost-4 rehash of the stored cost-12 password
+    assert 'desc="3 queries"' in response.headers['Server-Timing']
+    assert 'bcrypt;dur=0.00' not in response.headers['Server-Timing']
+
+
+def test_metrics_endpoint(client, auth):
+    client.get('/home')
+    client.get('/home')
+    auth.login()
+    client.get('/account')
+    client.get('/nope')
+
+    response = client.get('/metrics', headers=SCRAPE)
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+
+    assert '# TYPE gp_request_duration_seconds histogram' in body
+    assert _sample(body, 'gp_request_duration_seconds', 'main.home', '_count') == 2
+    assert _sample(body, 'gp_sql_queries_per_request', 'main.home', '_sum') == 0
+    assert _sample(body, 'gp_sql_queries_per_request', 'users.login', '_sum') == 3
+    assert _sample(body, 'gp_sql_queries_per_request', 'users.account', '_sum') == 1
+    assert _sample(body, 'gp_template_render_seconds', 'main.home', '_sum') > 0
+    assert _sample(body, 'gp_bcrypt_seconds', 'users.login', '_sum') > 0
+    assert _sample(body, 'gp_request_duration_seconds', '<unmatched>', '_count') == 1
+    assert ('gp_request_duration_seconds_bucket{endpoint="main.home",le="+Inf"} 2'
+            in body)
+
+
+@pytest.mark.parametrize('headers', (
+    {},
+    {'Authorization': 'Bearer wrong'},
+    {'Authorization': 's3cret'},
+    {'Authorization': 'Bearer s3cr\u00e9t'},
+))
+def test_metrics_needs_the_token(client, headers):
+    response = client.get('/metrics', headers=headers)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+    assert 'gp_request' not in response.get_data(as_text=True)
+
+
+def test_metrics_endpoint_needs_a_token_configured():
+    app = create_app({'TESTING': True, 'METRICS_ENABLED': True})
+    assert app.test_client().get('/metrics').status_code == 404
+    # instrumentation still runs
+    assert 'Server-Timing' in app.test_client().get('/about').headers
+
+
+def test_failed_statement_does_not_skew_timings(app, client):
+    from flask import g
+    from sqlalchemy.exc import OperationalError
+    from gp_app import db
+    with app.test_request_context('/home'):
+        app.preprocess_request()
+        with pytest.raises(OperationalError):
+            db.session.execute('SELECT * FROM no_such_table')
+        db.session.rollback()
+        db.session.execute('SELECT 1')
+        stats = g._request_stats
+        assert stats.sql_count == 1
+        assert 'query_start' not in db.session.connection().info
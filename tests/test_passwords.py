@@ -0,0 +1,71 @@
+import pytest
+from gp_app import passwords
+from gp_app.models import User
+from gp_app.passwords import bcrypt_cost
+
+
+def _configure(app, **config):
+    app.config.update(config)
+    passwords.init_app(app)
+
+
+@pytest.mark.parametrize('executor', ('inline', 'thread', 'process'))
+def test_hash_and_verify(app, executor):
+    _configure(app, BCRYPT_LOG_ROUNDS=4, PASSWORD_HASH_EXECUTOR=executor,
+               PASSWORD_HASH_WORKERS=2)
+    with app.app_context():
+        pw_hash = passwords.hash('secret')
+        assert bcrypt_cost(pw_hash) == 4
+        assert passwords.verify(pw_hash, 'secret')
+        assert not passwords.verify(pw_hash, 'wrong')
+        assert not passwords.needs_rehash(pw_hash)
+    app.extensions['password_hasher'].shutdown()
+
+
+def test_verify_existing_and_bad_hashes(app):
+    with app.app_context():
+        assert passwords.verify(User.query.get(1).password, 'test')
+        assert not passwords.verify('not a hash', 'test')
+        with pytest.raises(ValueError):
+            passwords.hash('')
+
+
+def test_long_passwords_are_truncated(app):
+    _configure(app, BCRYPT_LOG_ROUNDS=4)
+    with app.app_context():
+        pw_hash = passwords.hash('x' * 100)
+        assert passwords.verify(pw_hash, 'x' * 72)
+
+
+def test_needs_rehash(app):
+    _configure(app, BCRYPT_LOG_ROUNDS=10)
+    with app.app_context():
+        assert passwords.needs_rehash(User.query.get(1).password)
+        assert passwords.needs_rehash('garbage')
+
+
+def test_login_rehashes_on_cost_change(app, auth):
+    _configure(app, BCRYPT_LOG_ROUNDS=4)
+    response = auth.login()
+    assert response.headers['Location'] == 'http://localhost/home'
+    with app.app_context():
+        pw_hash = User.query.get(1).password
+        assert bcrypt_cost(pw_hash) == 4
+        assert passwords.verify(pw_hash, 'test')
+
+    # a failed login must not touch the stored hash
+    auth.logout()
+    _configure(app, BCRYPT_LOG_ROUNDS=5)
+    auth.login(password='wrong')
+    with app.app_context():
+        assert User.query.get(1).password == pw_hash
+
+
+def test_register_uses_configured_cost(app, client):
+    _configure(app, BCRYPT_LOG_ROUNDS=5)
+    client.post('/register', data={'email': 'other@othercompany.com',
+                                   'password': 'testing',
+                                   'confirm_password': 'testing',
+                                   'username': 'other'})
+    with app.app_context():
+        assert bcrypt_cost(User.query.filter_by(username='other').one().password) == 5
@@ -0,0 +1,108 @@
+import pytest
+from gp_app import limiter, passwords
+from gp_app.ratelimit import MemoryBackend, SQLiteBackend, parse_rate
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_rate():
+    assert parse_rate('10/minute') == (10, 10 / 60.0)
+    assert parse_rate('1/seconds') == (1, 1.0)
+    with pytest.raises(KeyError):
+        parse_rate('1/fortnight')
+
+
+@pytest.fixture(params=('memory', 'sqlite'))
+def backend(request, tmpdir):
+    clock = Clock()
+    if request.param == 'memory':
+        return MemoryBackend(clock=clock)
+    return SQLiteBackend(str(tmpdir.join('ratelimit.sqlite')), clock=clock)
+
+
+def test_token_bucket(backend):
+    for _ in range(3):
+        assert backend.take('k', 3, 1.0)[0]
+    allowed, retry_after = backend.take('k', 3, 1.0)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+    # other keys have their own bucket
+    assert backend.take('other', 3, 1.0)[0]
+
+    backend.clock.now += 1.5
+    assert backend.take('k', 3, 1.0)[0]
+    assert not backend.take('k', 3, 1.0)[0]
+
+    # refills never exceed capacity
+    backend.clock.now += 100
+    assert sum(backend.take('k', 3, 1.0)[0] for _ in range(5)) == 3
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryBackend(max_keys=2)
+    for key in 'abc':
+        backend.take(key, 1, 1.0)
+    assert list(backend._buckets) == ['b', 'c']
+
+
+def test_sqlite_backend_is_shared(tmpdir):
+    path = str(tmpdir.join('ratelimit.sqlite'))
+    clock = Clock()
+    first, second = SQLiteBackend(path, clock), SQLiteBackend(path, clock)
+    assert first.take('k', 1, 0.1)[0]
+    assert not second.take('k', 1, 0.1)[0]
+
+
+def test_login_rate_limited_before_any_work(app, client, queries, monkeypatch):
+    app.config['RATELIMIT_LOGIN'] = '2/minute'
+    hashed = []
+    monkeypatch.setattr(passwords, 'verify', lambda *args: hashed.append(args))
+
+    for _ in range(2):
+        response = client.post('/login', data={'email': 'x@mycompany.com', 'password': 'a'})
+        assert response.status_code == 200
+    assert len(hashed) == 0  # no such user
+
+    with queries:
+        response = client.post('/login', data={'email': 'test@mycompany.com', 'password': 'a'},
+                               environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        response = client.post('/login', data={'email': 'test@mycompany.com', 'password': 'a'},
+                               environ_base={'REMOTE_ADDR': '10.0.0.3'})
+        assert len(hashed) == 2
+        del queries.statements[:]
+        hashed[:] = []
+        # new IP, but this email's bucket is empty
+        response = client.post('/login', data={'email': 'TEST@mycompany.com', 'password': 'a'},
+                               environ_base={'REMOTE_ADDR': '10.0.0.4'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert b'Too many attempts' in response.data
+    assert queries.count == 0
+    assert hashed == []
+
+    # GETs are never limited
+    assert client.get('/login').status_code == 200
+
+
+@pytest.mark.parametrize(('route', 'config_key', 'data'), (
+    ('/register', 'RATELIMIT_REGISTER', {'email': 'x@mycompany.com'}),
+    ('/reset_password', 'RATELIMIT_RESET_PASSWORD', {'email': 'x@mycompany.com'}),
+    ('/reset_password/abc', 'RATELIMIT_RESET_PASSWORD', {}),
+))
+def test_routes_are_limited(app, client, route, config_key, data):
+    app.config[config_key] = '1/hour'
+    assert client.post(route, data=data).status_code != 429
+    assert client.post(route, data=data).status_code == 429
+
+
+def test_limiter_disabled(app, client):
+    app.config.update(RATELIMIT_BACKEND=None, RATELIMIT_LOGIN='1/hour')
+    limiter.init_app(app)
+    for _ in range(3):
+        assert client.post('/login', data={}).status_code == 200
@@ -0,0 +1,88 @@
+import pytest
+from gp_app import db, identity_cache
+from gp_app.database import use_primary
+from gp_app.models import User, UserType, load_identity
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    return {
+        'SQLALCHEMY_BINDS': {'replica1': 'sqlite:///' + str(tmp_path / 'replica1.sqlite'),
+                             'replica2': 'sqlite:///' + str(tmp_path / 'replica2.sqlite')},
+        'DATABASE_REPLICAS': ['replica1', 'replica2'],
+    }
+
+
+@pytest.fixture
+def synced(app, runner):
+    result = runner.invoke(args=['sync-replicas'])
+    assert result.exit_code == 0, result.output
+    assert result.output.count('->') == 2
+    # A change the replicas haven't seen yet tells them apart from the primary.
+    with app.app_context():
+        db.session.add(User(username='primaryonly', email='primaryonly@mycompany.com',
+                            password='x'))
+        db.session.commit()
+
+
+def test_get_requests_read_from_a_replica(client, auth, synced):
+    auth.login()
+    response = client.get('/users')
+    assert b'a12345' in response.data
+    assert b'primaryonly' not in response.data
+    assert b'primaryonly' not in client.get('/users/export').data
+
+
+def test_writes_and_read_after_write_use_the_primary(app, client, auth, synced):
+    auth.login()
+    assert b'primaryonly' not in client.get('/users').data
+
+    response = client.post('/users/bulk', json={
+        'action': 'assign', 'user_ids': [2], 'user_types': ['SuperUser']})
+    assert response.get_json()['rows'] == 1
+    # this client wrote, so its next reads see the primary
+    assert b'primaryonly' in client.get('/users').data
+
+    app.config['DATABASE_REPLICA_STICKY_SECONDS'] = -1
+    client.post('/users/bulk', json={
+        'action': 'revoke', 'user_ids': [2], 'user_types': ['SuperUser']})
+    assert b'primaryonly' not in client.get('/users').data
+
+
+def test_outside_requests_use_the_primary(app, synced):
+    with app.app_context():
+        assert User.query.filter_by(username='primaryonly').count() == 1
+
+
+def test_read_after_write_in_one_request(app, synced):
+    with app.test_request_context('/users'):
+        assert User.query.filter_by(username='primaryonly').count() == 0
+        db.session.add(User(username='fresh', email='fresh@mycompany.com', password='x'))
+        # the autoflush is a write, so the query after it goes to the primary
+        assert User.query.filter_by(username='fresh').count() == 1
+        assert User.query.filter_by(username='primaryonly').count() == 1
+        db.session.rollback()
+
+    with app.test_request_context('/users'):
+        use_primary()
+        assert User.query.filter_by(username='primaryonly').count() == 1
+
+
+def test_replicas_must_be_binds():
+    from gp_app import create_app
+    with pytest.raises(ValueError):
+        create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'DATABASE_REPLICAS': ['nope']})
+
+
+def test_identity_is_read_from_the_primary(app, client, auth, synced):
+    # SuperUser loses its permissions; the replicas haven't caught up.
+    with app.app_context():
+        UserType.query.get(1).permissions = []
+        db.session.commit()
+
+    auth.login()
+    assert client.get('/users').status_code == 403
+    with app.app_context():
+        assert identity_cache.get(1, load_identity).permissions == frozenset()
+        with app.test_request_context('/users'):
+            assert User.query.get(1).permissions == frozenset()
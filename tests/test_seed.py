@@ -0,0 +1,70 @@
+import random
+import pytest
+from gp_app import db, passwords
+from gp_app.models import User, UserType, user_types
+from gp_app.seed import parse_distribution, RoleSampler
+
+
+@pytest.fixture
+def app_config():
+    return {'BCRYPT_LOG_ROUNDS': 4}
+
+
+def test_seed_command(app, runner, queries):
+    with queries:
+        result = runner.invoke(args=['seed', '--users', '250', '--user-types', '4',
+                                     '--batch-size', '100', '--random-seed', '1'])
+    assert result.exit_code == 0, result.output
+    assert '250/250 users' in result.output
+    assert 'Seeded 250 users, 4 user types' in result.output
+    # one executemany per table per batch
+    assert sum(s.startswith('INSERT INTO user ') for s in queries.statements) == 3
+
+    with app.app_context():
+        assert User.query.count() == 252
+        assert UserType.query.filter(UserType.name.like('seed-type-%')).count() == 4
+        seeded = User.query.filter_by(username='seed3').one()
+        assert seeded.email == 'seed3@example.com'
+        assert passwords.verify(seeded.password, 'password')
+        hashes = {pw for pw, in db.session.query(User.password)
+                  .filter(User.username.like('seed%'))}
+        assert len(hashes) == 1
+        links = db.session.query(user_types).filter(user_types.c.user_id > 2).count()
+        # 0:1,1:6,2:2,3:1 averages 1.3 types per user
+        assert 250 < links < 400
+
+    # a second run adds users after the first and reuses the types
+    result = runner.invoke(args=['seed', '--users', '10', '--user-types', '4'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert User.query.count() == 262
+        assert UserType.query.count() == 6
+        assert User.query.filter_by(username='seed262').one()
+
+
+def test_seed_without_roles(app, runner):
+    result = runner.invoke(args=['seed', '--users', '5', '--user-types', '0'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert db.session.query(user_types).count() == 2
+
+
+def test_seed_rejects_bad_distribution(runner):
+    result = runner.invoke(args=['seed', '--roles-per-user', 'one:two'])
+    assert result.exit_code != 0
+    assert 'expected count:weight pairs' in result.output
+
+
+def test_parse_distribution():
+    assert parse_distribution('0:1,1:6,2') == ([0, 1, 2], [1.0, 6.0, 1.0])
+    with pytest.raises(ValueError):
+        parse_distribution('1:0')
+
+
+def test_role_sampler_skew():
+    sampler = RoleSampler([10, 20, 30], [1, 5], [1, 1], 2.0, random.Random(0))
+    roles = sampler.sample(2000)
+    # counts above the number of types are capped
+    assert {len(chosen) for chosen in roles} == {1, 3}
+    singles = [next(iter(chosen)) for chosen in roles if len(chosen) == 1]
+    assert singles.count(10) > singles.count(20) > singles.count(30)
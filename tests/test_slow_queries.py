@@ -0,0 +1,70 @@
+import logging
+import pytest
+from gp_app import db
+from gp_app.metrics.slow_queries import redact, REDACTED
+
+
+@pytest.fixture
+def app_config():
+    return {'SLOW_QUERY_THRESHOLD': 0, 'BCRYPT_LOG_ROUNDS': 4}
+
+
+def _entries(caplog):
+    return [r.slow_query for r in caplog.records if r.name == 'gp_app.slow_query']
+
+
+def test_redact():
+    pw_hash = '$2b$12$XuPwoWD7h2SdH4O1QDEy6eM7VWm.N/TbKfo5AVTqS.PW4xpkkpKie'
+    assert redact(('a', pw_hash, 1)) == ('a', REDACTED, 1)
+    assert redact([(pw_hash,), ('b',)]) == [(REDACTED,), ('b',)]
+    assert redact({'password': 'x', 'email': 'e'}) == {'password': REDACTED, 'email': 'e'}
+
+
+def test_slow_queries_logged_with_plan(client, auth, caplog):
+    caplog.set_level(logging.WARNING, logger='gp_app.slow_query')
+    auth.login()
+    entries = _entries(caplog)
+    assert entries and all(e['endpoint'] == 'users.login' for e in entries)
+
+    lookup = next(e for e in entries if e['statement'].startswith('SELECT'))
+    assert lookup['parameters'] == ('test@mycompany.com', 1, 0)
+    assert 'user' in lookup['plan']
+    assert 'SCAN' in lookup['plan'] or 'SEARCH' in lookup['plan']
+
+    # the cost-4 rehash writes a new hash; it must never reach the log
+    update = next(e for e in entries if e['statement'].startswith('UPDATE'))
+    assert REDACTED in update['parameters']
+    assert '$2b$' not in caplog.text
+
+
+def test_association_join_plan(app, caplog):
+    caplog.set_level(logging.WARNING, logger='gp_app.slow_query')
+    from gp_app.models import User
+    with app.app_context():
+        User.type_names_by_user([1, 2])
+    entry = _entries(caplog)[-1]
+    assert entry['endpoint'] is None
+    assert 'user_types' in entry['plan']
+
+
+@pytest.mark.parametrize('threshold', (None, 60))
+def test_fast_or_disabled(caplog, threshold):
+    from gp_app import create_app
+    caplog.set_level(logging.WARNING, logger='gp_app.slow_query')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                      'SLOW_QUERY_THRESHOLD': threshold})
+    with app.app_context():
+        db.session.execute('SELECT 1')
+    assert not _entries(caplog)
+
+
+def test_failed_statement_leaves_no_start_time(app, caplog):
+    from sqlalchemy.exc import OperationalError
+    caplog.set_level(logging.WARNING, logger='gp_app.slow_query')
+    with app.app_context():
+        with pytest.raises(OperationalError):
+            db.session.execute('SELECT * FROM no_such_table')
+        db.session.rollback()
+        assert 'slow_query_start' not in db.session.connection().info
+        db.session.execute('SELECT 1')
+    assert _entries(caplog)[-1]['statement'] == 'SELECT 1'
@@ -1,7 +1,8 @@
 import pytest
 from flask import g, session
 from flask_login import current_user
-from gp_app.models import User
+from gp_app import db, mail
+from gp_app.models import User, UserType
 from wtforms.validators import ValidationError
 from gp_app.users.utils import send_reset_email
 
@@ -30,6 +31,7 @@ def test_redirect_with_login(client, auth):
 
 @pytest.mark.parametrize(('username', 'email', 'password', 'confirm_password'), (
     ('other', 'test@mycompany.com', 'test', 'test'),
+    ('other', 'Test@MyCompany.com', 'test', 'test'),
     ('test', 'other@other.com', 'test', 'test'),
 ))
 def test_register_validate_error(client, username, email, password, confirm_password):
@@ -83,6 +85,8 @@ def test_update_account(auth, client):
 
 @pytest.mark.parametrize(('email', 'username', 'message'), (
     ('a12345@mycompany.com', 'test', b'That email is taken.'),
+    ('A12345@MyCompany.com', 'test', b'That email is taken.'),
+    ('Test@MyCompany.com', 'test', b'Your account has been updated!'),
     ('test@mycompany.com', 'a12345', b'That username is taken.'),
     ('other@other.com', 'other', b'Your account has been updated!'),
 ))
@@ -109,9 +113,15 @@ def test_get_verify_reset_token(app):
 def test_send_reset_email(app):
     with app.app_context(), app.test_request_context():
         user = User.query.first()
-        outbox = send_reset_email(user)
-        assert len(outbox) == 1
-        assert outbox[0].subject == 'Password Reset Request'
+        with mail.record_messages() as outbox:
+            queued = send_reset_email(user)
+        # queued for the worker, not sent inside the request
+        assert len(outbox) == 0
+        assert queued.id is not None
+        assert queued.status == 'pending'
+        assert queued.subject == 'Password Reset Request'
+        assert queued.recipients == 'test@mycompany.com'
+        assert '/reset_password/' in queued.body
 
 
 def test_reset_request(client, auth):
@@ -226,3 +236,304 @@ def test_update_users(client, auth):
     response = client.get('/users', follow_redirects=True)
     assert b'a12345' and not b'Junk' in response.data
 
+
+
+def test_all_users_keyset_pagination(app, client, auth):
+    with app.app_context():
+        for i in range(5):
+            db.session.add(User(username='page%d' % i, email='page%d@mycompany.com' % i,
+                                password='x'))
+        db.session.commit()
+
+    auth.login()
+    response = client.get('/users?per_page=3')
+    assert b'a12345' in response.data
+    assert b'page0' in response.data
+    assert b'page1' not in response.data
+    assert b'after=3' in response.data
+    assert b'before=' not in response.data
+
+    response = client.get('/users?per_page=3&after=3')
+    assert b'page1' in response.data and b'page3' in response.data
+    assert b'page0' not in response.data
+    assert b'before=4' in response.data
+    assert b'after=6' in response.data
+
+    response = client.get('/users?per_page=3&after=6')
+    assert b'page4' in response.data
+    assert b'after=' not in response.data
+
+    response = client.get('/users?per_page=3&before=4')
+    assert b'page0' in response.data and b'test' in response.data
+    assert b'before=' not in response.data
+
+
+@pytest.mark.parametrize(('q', 'present', 'absent'), (
+    ('a123', b'a12345', b'>test<'),
+    ('TEST@', b'>test<', b'a12345'),
+    ('%', None, b'a12345'),
+))
+def test_all_users_search(client, auth, q, present, absent):
+    auth.login()
+    response = client.get('/users', query_string={'q': q})
+    if present:
+        assert present in response.data
+    assert absent not in response.data
+
+
+@pytest.mark.parametrize(('route', 'expected'), (
+    # one identity query for load_user, which also answers the role check
+    ('/account', 1),
+    # identity, one page of users, their roles
+    ('/users', 3),
+    # identity, user types, their permissions
+    ('/user_types', 3),
+))
+def test_view_query_counts(app, client, auth, queries, route, expected):
+    with app.app_context():
+        for i in range(20):
+            user = User(username='count%d' % i, email='count%d@mycompany.com' % i,
+                        password='x')
+            user.user_types.append(UserType.query.get(2))
+            db.session.add(user)
+        db.session.commit()
+
+    auth.login()
+    with queries:
+        response = client.get(route)
+    assert response.status_code == 200
+    assert queries.count == expected, queries.statements
+
+
+def test_all_users_does_not_fetch_password(client, auth, queries):
+    auth.login()
+    with queries:
+        client.get('/users')
+    listing = [s for s in queries.statements if 'LIMIT' in s]
+    assert len(listing) == 1
+    assert 'user.password' not in listing[0]
+
+
+def test_login_does_not_load_roles(client, queries):
+    with queries:
+        client.post('/login', data={'email': 'test@mycompany.com', 'password': 'test'})
+    assert not any('user_types' in s for s in queries.statements)
+
+
+
+def test_identity_cache(app, client, auth, queries):
+    auth.login()
+    client.get('/account')
+    with queries:
+        client.get('/account')
+    assert queries.count == 0
+
+    with app.app_context():
+        from gp_app import identity_cache
+        assert identity_cache.hits >= 1
+        assert identity_cache.misses >= 1
+        assert identity_cache.stats()['size'] == 1
+
+    client.post('/account', data={'email': 'new@mycompany.com', 'username': 'renamed'})
+    response = client.get('/account')
+    assert b'renamed' in response.data
+
+    client.post('/users/1/update', data={'user_types': 'Junk'})
+    response = client.get('/users', follow_redirects=True)
+    assert b"You don't have permission" in response.data
+
+
+def test_identity_cache_eviction(app):
+    app.config['IDENTITY_CACHE_SIZE'] = 1
+    from gp_app import identity_cache
+    from gp_app.models import load_identity
+    identity_cache.init_app(app)
+    with app.app_context():
+        assert identity_cache.get(1, load_identity).username == 'test'
+        assert identity_cache.get(2, load_identity).username == 'a12345'
+        identity_cache.get(1, load_identity)
+        assert identity_cache.stats() == {'hits': 0, 'misses': 3, 'size': 1, 'maxsize': 1}
+        assert identity_cache.get(3, load_identity) is None
+
+
+
+def test_user_type_permissions(app, client, auth, queries):
+    auth.login(email='a12345@mycompany.com')
+    assert client.get('/users').status_code == 403
+    response = client.get('/home')
+    assert b'User Types' not in response.data
+    auth.logout()
+
+    auth.login()
+    response = client.post('/user_type/2/update',
+                           data={'name': 'Junk', 'permissions': ['manage_users']})
+    assert response.headers['Location'] == 'http://localhost/user_types'
+    response = client.get('/user_type/2/update')
+    assert b'<option selected value="manage_users">' in response.data
+    response = client.post('/user_type/new', data={'name': 'Bad', 'permissions': ['nope']})
+    assert b'is not a valid choice' in response.data
+    auth.logout()
+
+    auth.login(email='a12345@mycompany.com')
+    with queries:
+        response = client.get('/users')
+    assert response.status_code == 200
+    assert b'href="/users"' in response.data
+    assert b'href="/user_types"' not in response.data
+    assert sum('permission' in s for s in queries.statements) == 1
+    assert client.get('/user_types').status_code == 403
+
+
+def test_model_user_permissions(app):
+    with app.app_context():
+        user = User.query.get(1)
+        assert user.permissions == {'manage_users', 'manage_user_types'}
+        assert user.has_permission('manage_users')
+        assert not User.query.get(2).has_permission('manage_users')
+
+
+def _add_users(app, count):
+    with app.app_context():
+        db.session.add_all([User(username='bulk%03d' % i, email='bulk%03d@mycompany.com' % i,
+                                 password='x') for i in range(count)])
+        db.session.commit()
+
+
+def test_all_users_streamed(app, client, auth, queries):
+    app.config.update(STREAM_ROWS_PER_FETCH=10, STREAM_CHUNK_SIZE=4096)
+    _add_users(app, 25)
+    auth.login()
+    client.get('/home')
+
+    with queries:
+        response = client.get('/users?stream=1', buffered=False)
+        assert response.is_streamed
+        chunks = iter(response.response)
+        head = b''
+        while b'<tbody>' not in head:
+            head += next(chunks)
+        # the table header is out before any user rows were queried
+        assert b'All Users' in head and b'<th scope="col">Username</th>' in head
+        assert not any('user_types.user_id IN' in s for s in queries.statements)
+        body = head + b''.join(chunks)
+        response.close()
+
+    assert all(b'bulk%03d' % i in body for i in range(25))
+    assert b'a12345' in body
+    assert b'Show all' not in body and b'after=' not in body
+    # 27 users at 10 per fetch: one role query per fetched chunk
+    assert sum('user_types.user_id IN' in s for s in queries.statements) == 3
+
+
+def test_all_users_streamed_filter_and_flashes(app, client, auth):
+    _add_users(app, 3)
+    auth.login()
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Streamed flash')]
+    response = client.get('/users?stream=1&q=bulk001')
+    assert b'bulk001' in response.data
+    assert b'bulk002' not in response.data
+    assert b'Streamed flash' in response.data
+    # the flash was consumed even though the body was streamed
+    assert b'Streamed flash' not in client.get('/users').data
+
+
+def test_all_users_shares_one_csrf_token(app, client, auth):
+    from flask import template_rendered
+    _add_users(app, 5)
+    auth.login()
+    contexts = []
+
+    def record(sender, template, context, **extra):
+        contexts.append(context)
+
+    with template_rendered.connected_to(record, app):
+        response = client.get('/users')
+    # Flask-WTF's csrf_token() global stays callable in the template
+    assert 'csrf_token' not in contexts[0]
+    assert response.data.count(b'name="csrf_token"') == 0
+    assert response.data.count(b'id="shared-csrf-token"') == 1
+    assert b'id="shared-csrf-token" value="%s"' % contexts[0]['shared_csrf'].encode() \
+        in response.data
+    # rows only carry their current types; the rest come from the lookup
+    assert b'<option selected value="Junk">' in response.data
+    row = response.data.split(b'>a12345<')[1].split(b'</tr>')[0]
+    assert b'value="Junk"' in row and b'SuperUser' not in row
+    assert b'data-ajax--url="/user_types/lookup"' in response.data
+
+
+def test_user_type_lookup(app, client, auth):
+    app.config['USER_TYPE_LOOKUP_PER_PAGE'] = 2
+    with app.app_context():
+        db.session.add_all([UserType(name=name) for name in ('Jumper', 'Juror', 'Ju%')])
+        db.session.commit()
+
+    assert client.get('/user_types/lookup?q=J').status_code == 302
+    auth.login()
+    data = client.get('/user_types/lookup?q=ju').get_json()
+    assert data == {'results': [{'id': 'Ju%', 'text': 'Ju%'}, {'id': 'Jumper', 'text': 'Jumper'}],
+                    'pagination': {'more': True}}
+    data = client.get('/user_types/lookup?q=ju&page=2').get_json()
+    assert [r['id'] for r in data['results']] == ['Junk', 'Juror']
+    assert data['pagination'] == {'more': False}
+    # LIKE wildcards in the term are literal
+    assert [r['id'] for r in client.get('/user_types/lookup?q=ju%25').get_json()['results']] \
+        == ['Ju%']
+    assert [r['id'] for r in client.get('/user_types/lookup').get_json()['results']] \
+        == ['Ju%', 'Jumper']
+
+
+def test_user_type_lookup_requires_permission(client, auth):
+    auth.login(email='a12345@mycompany.com')
+    assert client.get('/user_types/lookup?q=J').status_code == 403
+
+
+def _add_typed_users(app):
+    with app.app_context():
+        superuser, junk = UserType.query.get(1), UserType.query.get(2)
+        db.session.add(UserType(name='Empty'))
+        for i in range(4):
+            user = User(username='typed%d' % i, email='typed%d@mycompany.com' % i, password='x')
+            user.user_types.append(junk if i % 2 else superuser)
+            db.session.add(user)
+        db.session.commit()
+
+
+def test_all_users_filtered_by_user_type(app, client, auth, queries):
+    _add_typed_users(app)
+    auth.login()
+    with queries:
+        response = client.get('/users', query_string={'user_type': 'Junk', 'per_page': 2})
+    assert queries.count == 3, queries.statements
+    assert b'>a12345<' in response.data and b'>typed1<' in response.data
+    assert b'>test<' not in response.data and b'>typed3<' not in response.data
+    assert b'/users?after=4&amp;user_type=Junk&amp;per_page=2' in response.data
+
+    response = client.get('/users', query_string={'user_type': 'Junk', 'after': 4})
+    assert b'>typed3<' in response.data and b'>typed1<' not in response.data
+
+    response = client.get('/users', query_string={'user_type': 'SuperUser', 'q': 'typed'})
+    assert b'>typed0<' in response.data and b'>typed2<' in response.data
+    assert b'>test<' not in response.data and b'>typed1<' not in response.data
+
+    response = client.get('/users', query_string={'user_type': 'SuperUser', 'stream': 1})
+    assert b'>test<' in response.data and b'>typed2<' in response.data
+    assert b'>a12345<' not in response.data
+
+    response = client.get('/users', query_string={'user_type': 'Nobody'})
+    assert response.status_code == 200
+    assert b'>test<' not in response.data
+
+
+def test_user_types_member_counts(app, client, auth, queries):
+    _add_typed_users(app)
+    auth.login()
+    with queries:
+        response = client.get('/user_types')
+    assert queries.count == 3, queries.statements
+    counts = [s for s in queries.statements if 'count(' in s]
+    assert len(counts) == 1 and 'GROUP BY' in counts[0]
+    html = response.data.decode()
+    assert '/users?user_type=SuperUser">3 users<' in html
+    assert '/users?user_type=Junk">3 users<' in html
+    assert '/users?user_type=Empty">0 users<' in html